@@ -0,0 +1,54 @@
+"""
+Environment configuration helpers.
+
+`.env` used to be loaded at import time by every service module. It is now
+loaded once, on first access, so importing the app stays cheap on cold start.
+"""
+import logging
+import os
+
+_env_loaded = False
+
+
+def load_env():
+    """Loads `.env` into the process environment (only the first call does any work)."""
+    global _env_loaded
+    if _env_loaded:
+        return
+    _env_loaded = True
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        # python-dotenv is a convenience for local dev; hosted deploys set real env vars.
+        return
+    load_dotenv()
+
+
+def get_env(name: str, default: str = None) -> str:
+    load_env()
+    return os.getenv(name, default)
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    value = get_env(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name: str, default: int) -> int:
+    value = get_env(name)
+    try:
+        return int(value) if value not in (None, "") else default
+    except ValueError:
+        logging.getLogger("wordcloud.config").warning(f"{name}={value!r} is not an integer, using {default}")
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    value = get_env(name)
+    try:
+        return float(value) if value not in (None, "") else default
+    except ValueError:
+        logging.getLogger("wordcloud.config").warning(f"{name}={value!r} is not a number, using {default}")
+        return default
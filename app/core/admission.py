@@ -0,0 +1,162 @@
+"""
+Admission control for the generation routes.
+
+The routes used to accept unlimited work: one enthusiastic user could submit
+dozens of uploads and fill every worker slot, and under load every job just
+waited longer. Each submission now passes through `AdmissionController.admit()`
+before a task is created. The checks run cheapest first:
+
+1. Load shedding: if the global backlog (queued, not yet running) is at
+   capacity, the request is rejected with an estimate of when a slot frees up.
+2. Per-session concurrency: a session may only have a few jobs queued or
+   running at once.
+3. Per-session rate: a token bucket (refill rate plus burst), kept in SQLite so
+   every worker process on the host shares it.
+
+A rejection is a `Rejected` error carrying a `Retry-After` value, which the
+routes turn into a fast 429. Admitted jobs are then ordered across sessions by
+the queue's weighted fair queueing (`app.core.job_queue`).
+
+The checks and the reservation of a place happen in one transaction: an
+admitted request holds a reservation in the queue database, which counts as
+one of the session's active jobs until `JobQueue.submit()` replaces it with the
+job (in the same transaction), so concurrent requests from one session can't
+all slip under the limit. `/generate/stream` runs its pipeline inside the
+response instead of queueing a job, so its reservation lasts until the stream
+ends (`release()`). A reservation whose process died without using it stops
+counting once it expires.
+"""
+import math
+import threading
+import time
+
+from app.config import env_int, env_float
+from app.core.job_queue import JobQueue, get_job_queue, QUEUED, RUNNING
+from app.core.sqlite import ThreadLocalConnections, transaction
+
+# Used for Retry-After estimates until some jobs have finished.
+DEFAULT_JOB_SECONDS = 60.0
+MAX_RETRY_AFTER = 300
+# How long an admitted request may take to submit its job before its place lapses.
+RESERVATION_SECONDS = 60.0
+
+
+class Rejected(Exception):
+    """A submission was refused; `retry_after` is in whole seconds."""
+
+    def __init__(self, reason: str, retry_after: float, message: str):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = max(1, min(MAX_RETRY_AFTER, math.ceil(retry_after)))
+        self.message = message
+
+
+class AdmissionController:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS rate_buckets (
+        owner TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, queue: JobQueue, max_active: int = 3, rate_per_minute: float = 6.0, burst: int = 4,
+                 max_backlog: int = 32, worker_slots: int = 4):
+        self.queue = queue
+        self.max_active = max_active
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_backlog = max_backlog
+        self.worker_slots = max(1, worker_slots)
+        # The buckets live next to the jobs, so all processes on the host share them.
+        self._conns = ThreadLocalConnections(queue.path, self.SCHEMA)
+        self._stats_lock = threading.Lock()
+        self._stats = {"admitted": 0, "overloaded": 0, "concurrency": 0, "rate": 0}
+
+    def admit(self, owner: str, kind: str = "job", hold_seconds: float = RESERVATION_SECONDS) -> str:
+        """
+        Raises Rejected if `owner` may not submit another job right now.
+        Otherwise reserves a place for `hold_seconds` and returns its id, for
+        `JobQueue.submit(reservation=...)` or `release()`.
+        """
+        job_seconds = self.queue.recent_duration() or DEFAULT_JOB_SECONDS
+        conn = self._conns.get()
+        try:
+            with transaction(conn):
+                load = self.queue.load(owner, conn)
+                if self.max_backlog and load["backlog"] >= self.max_backlog:
+                    excess = load["backlog"] - self.max_backlog + 1
+                    raise Rejected("overloaded", job_seconds * excess / self.worker_slots,
+                                   "The gallery is very busy right now. Please try again shortly.")
+                if self.max_active and load["owner_active"] >= self.max_active:
+                    raise Rejected("concurrency", job_seconds / 2,
+                                   f"You already have {load['owner_active']} creations in progress. "
+                                   "Please wait for one to finish.")
+                if self.rate_per_minute:
+                    self._take_token(conn, owner)
+                reservation = self.queue.reserve(conn, owner, kind, hold_seconds)
+        except Rejected as e:
+            self._count(e.reason)
+            raise
+        self._count("admitted")
+        return reservation
+
+    def admit_stream(self, owner: str, max_seconds: float) -> str:
+        """Admits a streaming run like a job; its reservation lasts `max_seconds` or until `release()`."""
+        return self.admit(owner, kind="stream", hold_seconds=max_seconds)
+
+    def release(self, reservation: str):
+        """Gives back a reservation that no job consumed (a stream ended, a submission failed)."""
+        self.queue.release_reservation(reservation)
+
+    def _take_token(self, conn, owner: str):
+        """Takes a token from the owner's bucket, inside the caller's transaction."""
+        now = time.time()
+        rate = self.rate_per_minute / 60.0
+        row = conn.execute("SELECT tokens, updated_at FROM rate_buckets WHERE owner = ?", (owner,)).fetchone()
+        tokens = float(self.burst) if row is None else min(
+            float(self.burst), row["tokens"] + (now - row["updated_at"]) * rate
+        )
+        if tokens < 1.0:
+            # Nothing to write: the refill is computed from the time of the last take.
+            raise Rejected("rate", (1.0 - tokens) / rate,
+                           "You're creating faster than the easel can keep up. Please try again shortly.")
+        conn.execute(
+            "INSERT OR REPLACE INTO rate_buckets (owner, tokens, updated_at) VALUES (?, ?, ?)",
+            (owner, tokens - 1.0, now),
+        )
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self) -> dict:
+        """Admissions and rejections (by reason) in this process, plus the current queue load."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        counts = self.queue.counts()
+        stats["backlog"] = counts.get(QUEUED, 0)
+        stats["running"] = counts.get(RUNNING, 0)
+        stats["streams"] = self.queue.reservations("stream")
+        stats["max_backlog"] = self.max_backlog
+        return stats
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(
+                    get_job_queue(),
+                    max_active=env_int("ADMISSION_MAX_ACTIVE_PER_SESSION", 3),
+                    rate_per_minute=env_float("ADMISSION_RATE_PER_MINUTE", 6),
+                    burst=env_int("ADMISSION_BURST", 4),
+                    max_backlog=env_int("ADMISSION_MAX_BACKLOG", 32),
+                    worker_slots=env_int("JOB_WORKER_CONCURRENCY", 4),
+                )
+    return _controller
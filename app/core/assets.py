@@ -0,0 +1,245 @@
+"""
+Fingerprinted, precompressed static assets.
+
+`/static` and `/images` serve `script.js`, `style.css` and the ~2.5 MB style
+preview PNGs as-is: uncompressed, and with only Last-Modified/ETag validators.
+Every page view re-validates them and the first one downloads ~12 MB.
+
+`build_assets()` copies each source asset to ASSET_DIR under a content-hashed
+name (`style.3f9c2a1b7d.css`). Text assets get `.gz` and `.br` siblings; the
+Brotli one is only written if the optional `brotli` package is installed. The
+style previews are downsized and re-encoded as WebP. A changed file gets a new
+name, so `/assets/<name>` can be served with `immutable` caching.
+
+The build runs at deploy time (`python -m app.tools.build_assets`); with
+ASSET_BUILD_ON_STARTUP it also runs in a thread on startup. Templates resolve
+the original paths through `asset_url()`. Without a manifest, or for entries
+whose file is missing, it returns the original `/static/...` URL, so the app
+never depends on the build step.
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import threading
+
+from app.config import get_env, env_int
+from app.core.logs import get_logger
+
+log = get_logger(__name__)
+
+# Source files to fingerprint: (URL prefix, directory, extensions)
+SOURCES = (
+    ("/static/", "static", (".js", ".css")),
+    ("/images/", "images", (".png", ".jpg", ".jpeg")),
+)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+MIME_TYPES = {
+    ".js": "application/javascript",
+    ".css": "text/css",
+    ".svg": "image/svg+xml",
+    ".json": "application/json",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+}
+
+# Brotli is preferred over gzip when the client accepts both.
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+ASSET_NAME_RE = re.compile(r"^[A-Za-z0-9_.-]{1,120}$")
+HASH_LENGTH = 10
+MANIFEST_NAME = "manifest.json"
+
+_manifest = {}
+_manifest_lock = threading.Lock()
+
+
+def asset_dir() -> str:
+    return get_env("ASSET_DIR", os.path.join("static", "dist"))
+
+
+def _fingerprint(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def _write_if_missing(path: str, data: bytes):
+    if os.path.exists(path):
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _compress(path: str, data: bytes) -> list[str]:
+    """Writes .gz (and .br if available) next to `path`; returns the encodings written."""
+    written = []
+    try:
+        import brotli
+        _write_if_missing(path + ".br", brotli.compress(data, quality=11))
+        written.append("br")
+    except ImportError:
+        pass
+    _write_if_missing(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+    written.append("gzip")
+    return written
+
+
+def _preview_webp(data: bytes, max_edge: int) -> bytes:
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(data))
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format="WEBP", quality=80, method=6)
+    return out.getvalue()
+
+
+def build_assets(out_dir: str = None, preview_max_edge: int = None) -> dict:
+    """
+    Builds every fingerprinted asset into `out_dir` and writes its manifest.
+    Incremental: outputs that already exist for a content hash are not rebuilt.
+    Returns the manifest (`{original URL: entry}`).
+    """
+    out_dir = out_dir or asset_dir()
+    preview_max_edge = preview_max_edge or env_int("ASSET_PREVIEW_MAX_EDGE", 800)
+    os.makedirs(out_dir, exist_ok=True)
+
+    manifest = {}
+    for prefix, directory, extensions in SOURCES:
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            source = os.path.join(directory, name)
+            stem, ext = os.path.splitext(name)
+            if not os.path.isfile(source) or ext.lower() not in extensions:
+                continue
+            with open(source, "rb") as f:
+                data = f.read()
+            digest = _fingerprint(data)
+            entry = {"source_bytes": len(data)}
+
+            if ext.lower() in IMAGE_EXTENSIONS:
+                try:
+                    # Hash the encoder settings too, so changing them produces new names.
+                    hashed = f"{stem}.{_fingerprint(data + str(preview_max_edge).encode())}.webp"
+                    target = os.path.join(out_dir, hashed)
+                    if not os.path.exists(target):
+                        _write_if_missing(target, _preview_webp(data, preview_max_edge))
+                except Exception as e:
+                    # No Pillow / no WebP support: still fingerprint the original.
+                    log.warning(f"Could not build WebP preview for {source}: {type(e).__name__}: {e}")
+                    hashed = f"{stem}.{digest}{ext}"
+                    target = os.path.join(out_dir, hashed)
+                    _write_if_missing(target, data)
+                entry["encodings"] = []
+            else:
+                hashed = f"{stem}.{digest}{ext}"
+                target = os.path.join(out_dir, hashed)
+                _write_if_missing(target, data)
+                entry["encodings"] = _compress(target, data)
+
+            entry["file"] = hashed
+            entry["url"] = f"/assets/{hashed}"
+            entry["bytes"] = os.path.getsize(target)
+            manifest[prefix + name] = entry
+
+    tmp = os.path.join(out_dir, MANIFEST_NAME + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, os.path.join(out_dir, MANIFEST_NAME))
+    set_manifest(manifest)
+    return manifest
+
+
+def load_manifest(out_dir: str = None) -> dict:
+    """
+    Loads a previously built manifest from disk (empty if there is none).
+    Entries whose file is missing from the build output are left out, so those
+    assets keep their original URLs instead of pointing at a 404.
+    """
+    out_dir = out_dir or asset_dir()
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        log.info(f"No asset manifest in {out_dir}; serving original asset URLs")
+        set_manifest({})
+        return {}
+    missing = [path for path, entry in manifest.items()
+               if not os.path.isfile(os.path.join(out_dir, entry.get("file", "")))]
+    if missing:
+        log.warning(f"Asset manifest lists {len(missing)} missing file(s); serving their original URLs")
+        manifest = {path: entry for path, entry in manifest.items() if path not in missing}
+    set_manifest(manifest)
+    return manifest
+
+
+def set_manifest(manifest: dict):
+    global _manifest
+    with _manifest_lock:
+        _manifest = dict(manifest)
+
+
+def asset_url(path: str) -> str:
+    """Fingerprinted URL for an original asset path, or the path itself if it isn't built."""
+    entry = _manifest.get(path)
+    return entry["url"] if entry else path
+
+
+def asset_urls() -> dict:
+    """`{original URL: fingerprinted URL}` for scripts that build asset URLs at runtime."""
+    return {path: entry["url"] for path, entry in _manifest.items()}
+
+
+def start_build_thread() -> threading.Thread:
+    """Loads any prebuilt manifest right away, then (re)builds in a daemon thread."""
+    load_manifest()
+
+    def _run():
+        try:
+            manifest = build_assets()
+            log.info(f"Built {len(manifest)} fingerprinted assets in {asset_dir()}")
+        except Exception as e:
+            log.warning(f"Asset build failed, serving original files: {type(e).__name__}: {e}")
+
+    thread = threading.Thread(target=_run, name="asset-build", daemon=True)
+    thread.start()
+    return thread
+
+
+def resolve(filename: str, accept_encoding: str = ""):
+    """
+    Maps a fingerprinted file name to `(path, media_type, content_encoding)`,
+    picking a precompressed sibling the client accepts. Returns None if unknown.
+    """
+    if (not ASSET_NAME_RE.match(filename) or filename == MANIFEST_NAME
+            or filename.endswith((".gz", ".br", ".tmp"))):
+        return None
+    path = os.path.join(asset_dir(), filename)
+    if not os.path.isfile(path):
+        return None
+    media_type = MIME_TYPES.get(os.path.splitext(filename)[1].lower(), "application/octet-stream")
+    accepted = {
+        part.split(";")[0].strip().lower()
+        for part in (accept_encoding or "").split(",")
+        if not part.strip().endswith(("q=0", "q=0.0"))
+    }
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.isfile(path + suffix):
+            return path + suffix, media_type, encoding
+    return path, media_type, None
+
+
+def clean(out_dir: str = None):
+    """Removes the build output (used by the build tool's --clean)."""
+    shutil.rmtree(out_dir or asset_dir(), ignore_errors=True)
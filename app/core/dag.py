@@ -0,0 +1,232 @@
+"""
+Dependency-graph executor for pipeline stages.
+
+The pipelines used to be hand-written chains (clean -> enrich -> image ->
+variants), so nothing overlapped, and adding a step meant rewriting them.
+Each step is now a `Stage` that declares the values it consumes (`inputs`) and
+the ones it produces (`outputs`). `run_graph()` starts every stage whose inputs
+are available, so independent stages run concurrently. For example, the venue
+is described while the Untappd words are still being categorized.
+
+- Sync stage functions run in the default executor; async ones on the loop.
+- A stage function gets its inputs as keyword arguments. It also gets `ctx`
+  (the `JobContext`) and/or `emit` if its signature asks for them.
+- `emit(name, value)` publishes one of the stage's outputs before the stage
+  returns. Dependents start right away; this is how the image starts as soon
+  as the streamed prompt is complete. `emit` is safe to call from any thread.
+- Outputs are checkpointed on the job. A stage whose outputs all have
+  checkpoints is not run again when a job is recovered.
+- `on_start(stage)` and `on_output(name, value)` let the pipeline publish
+  progress and partial results to the task record.
+- With a job deadline (`ctx.deadline`), each stage gets a share of the time
+  left: its `weight` over the total weight of the longest chain of stages
+  still ahead of it (itself included). Time a stage doesn't use goes to the
+  stages after it. A stage that runs out of time fails with DeadlineExceeded
+  (optional stages just yield None).
+"""
+import asyncio
+import contextvars
+import inspect
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from app.core.deadline import Deadline, TaskCancelled, guard, use_deadline
+from app.core.logs import get_logger, log_context
+
+log = get_logger(__name__)
+
+
+class GraphError(Exception):
+    """The graph itself is invalid (missing input, duplicate output or a cycle)."""
+
+
+class StageFailed(Exception):
+    """Raised by a stage to fail the pipeline with a user-facing message."""
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable
+    inputs: tuple = ()
+    # Defaults to a single output named after the stage. With several outputs
+    # the function returns a dict keyed by output name.
+    outputs: tuple = None
+    # A failing optional stage yields None outputs instead of failing the graph.
+    optional: bool = False
+    checkpoint: bool = True
+    # Task status/progress to publish when the stage starts.
+    status: Optional[str] = None
+    progress: Optional[int] = None
+    # Relative share of the job's time budget (see the module docstring).
+    weight: float = 1.0
+    _params: frozenset = field(default=frozenset(), init=False, repr=False)
+
+    def __post_init__(self):
+        if self.outputs is None:
+            self.outputs = (self.name,)
+        self.inputs = tuple(self.inputs)
+        self.outputs = tuple(self.outputs)
+        try:
+            self._params = frozenset(inspect.signature(self.fn).parameters)
+        except (TypeError, ValueError):
+            self._params = frozenset()
+
+
+def validate(stages: list, available) -> list:
+    """Checks the graph against the initially `available` values and returns the stages in topological order."""
+    producers = {}
+    for stage in stages:
+        for name in stage.outputs:
+            if name in producers or name in available:
+                raise GraphError(f"Value '{name}' is produced more than once")
+            producers[name] = stage
+    for stage in stages:
+        for name in stage.inputs:
+            if name not in producers and name not in available:
+                raise GraphError(f"Stage '{stage.name}' needs '{name}', which nothing provides")
+
+    ordered, done, visiting = [], set(), set()
+
+    def visit(stage):
+        if stage.name in done:
+            return
+        if stage.name in visiting:
+            raise GraphError(f"Cycle through stage '{stage.name}'")
+        visiting.add(stage.name)
+        for name in stage.inputs:
+            if name in producers:
+                visit(producers[name])
+        visiting.discard(stage.name)
+        done.add(stage.name)
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return ordered
+
+
+def path_weights(ordered: list) -> dict:
+    """Stage name -> its weight plus the heaviest chain of stages depending on it."""
+    weights = {}
+    for stage in reversed(ordered):
+        after = [weights[s.name] for s in ordered
+                 if s.name in weights and any(o in s.inputs for o in stage.outputs)]
+        weights[stage.name] = stage.weight + max(after, default=0.0)
+    return weights
+
+
+async def run_graph(stages: list, initial: dict, ctx=None, on_start=None, on_output=None) -> dict:
+    """
+    Runs `stages` to completion and returns every value (initial + produced).
+    Raises the first error of a non-optional stage after cancelling the rest.
+    """
+    weights = path_weights(validate(stages, initial))
+    deadline = getattr(ctx, "deadline", None)
+    loop = asyncio.get_running_loop()
+    values = dict(initial)
+    pending = list(stages)
+    running = {}
+    emitted = asyncio.Queue()
+    started_at = time.perf_counter()
+
+    async def publish(name, value):
+        values[name] = value
+        if on_output is not None:
+            await on_output(name, value)
+
+    def emitter(stage):
+        def emit(name, value):
+            if name not in stage.outputs:
+                raise GraphError(f"Stage '{stage.name}' has no output '{name}'")
+            loop.call_soon_threadsafe(emitted.put_nowait, (stage, name, value))
+        return emit
+
+    async def execute(stage):
+        # Each stage runs in its own task, so the log context doesn't leak into its siblings.
+        with log_context(stage=stage.name):
+            return await _execute(stage)
+
+    async def _execute(stage):
+        if ctx is not None and stage.checkpoint and all(ctx.has_checkpoint(o) for o in stage.outputs):
+            log.debug(f"Job {ctx.job_id}: reusing checkpoint '{stage.name}'")
+            return {o: ctx.get_checkpoint(o) for o in stage.outputs}
+        if on_start is not None:
+            await on_start(stage)
+        kwargs = {name: values[name] for name in stage.inputs}
+        if "ctx" in stage._params:
+            kwargs["ctx"] = ctx
+        if "emit" in stage._params:
+            kwargs["emit"] = emitter(stage)
+        stage_deadline, what = None, f"Stage '{stage.name}'"
+        if deadline is not None:
+            remaining = deadline.remaining()
+            budget = remaining * stage.weight / weights[stage.name] if remaining != math.inf else None
+            stage_deadline = Deadline(budget, parent=deadline)
+            if budget is not None:
+                what = f"Stage '{stage.name}' ({budget:.0f}s budget)"
+        begin = time.perf_counter()
+        try:
+            # Provider calls inside the stage see its deadline (call_timeout, deadline_reached).
+            with use_deadline(stage_deadline):
+                if inspect.iscoroutinefunction(stage.fn):
+                    result = await guard(stage.fn(**kwargs), stage_deadline, what)
+                else:
+                    context = contextvars.copy_context()
+                    call = loop.run_in_executor(None, lambda: context.run(lambda: stage.fn(**kwargs)))
+                    result = await guard(call, stage_deadline, what)
+        finally:
+            if stage_deadline is not None:
+                stage_deadline.close()
+        if ctx is not None:
+            ctx.timings[stage.name] = round(time.perf_counter() - begin, 3)
+        outputs = result if len(stage.outputs) > 1 else {stage.outputs[0]: result}
+        outputs = {o: (outputs or {}).get(o) for o in stage.outputs}
+        if ctx is not None and stage.checkpoint:
+            for name, value in outputs.items():
+                if value:
+                    await ctx.checkpoint(name, value)
+        return outputs
+
+    try:
+        while pending or running:
+            for stage in [s for s in pending if all(i in values for i in s.inputs)]:
+                pending.remove(stage)
+                running[asyncio.ensure_future(execute(stage))] = stage
+            if not running:
+                raise GraphError(f"Stages can never run: {[s.name for s in pending]}")
+
+            waiter = asyncio.ensure_future(emitted.get())
+            done, _ = await asyncio.wait(set(running) | {waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if waiter in done:
+                stage, name, value = waiter.result()
+                if name not in values:
+                    if ctx is not None:
+                        ctx.timings[f"{name}_ready"] = round(time.perf_counter() - started_at, 3)
+                    await publish(name, value)
+            else:
+                waiter.cancel()
+
+            for task in [t for t in done if t is not waiter]:
+                stage = running.pop(task)
+                try:
+                    outputs = task.result()
+                except Exception as e:
+                    # A cancelled job stops even its optional stages.
+                    job_stopped = isinstance(e, TaskCancelled) and deadline is not None and deadline.reached()
+                    # A fenced-out worker (lost lease) must stop too, not carry on without the stage.
+                    lease_lost = ctx is not None and getattr(ctx, "lease_lost", False)
+                    if not stage.optional or job_stopped or lease_lost:
+                        raise
+                    log.warning(f"Optional stage '{stage.name}' failed: {type(e).__name__}: {e}")
+                    outputs = {o: None for o in stage.outputs}
+                for name, value in outputs.items():
+                    # An emitted value is final; the stage's return value doesn't replace it.
+                    if name not in values:
+                        await publish(name, value)
+    finally:
+        for task in running:
+            task.cancel()
+    return values
@@ -0,0 +1,199 @@
+"""
+Deadlines and cancellation for running jobs.
+
+Nothing in a pipeline used to have a timeout: a hung Untappd request, SDK call
+or the Playwright login loop could hold a worker thread forever, and a user
+who closed the tab still paid for the whole generation.
+
+Every job now runs under a `Deadline`: a point in time plus a cancellation
+flag. It is cancelled by `/cancel/{task_id}`, by the worker when nobody has
+polled the task for a while ("abandoned"), or runs out on its own.
+
+- The stage graph (`app.core.dag`) splits the job's remaining time between the
+  stages on the way to the result; each stage gets a child deadline.
+- The current deadline is kept in a context variable, which follows the stage
+  into its executor thread. Provider calls ask `call_timeout(default)` for their
+  HTTP timeout, and loops check `deadline_reached()`.
+- `guard()` races a stage against its deadline. On timeout or cancellation the
+  stage is abandoned right away and the `on_cancel` callbacks run. A streaming
+  call registers its `close()` there, so the socket is closed and the executor
+  thread is freed. Blocking calls end at their timeout at the latest.
+"""
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from app.core.logs import get_logger
+
+log = get_logger(__name__)
+
+# Why a job stopped early
+CANCELLED = "cancelled"    # the user asked for it
+ABANDONED = "abandoned"    # nobody has polled the task for a while
+TIMEOUT = "timeout"        # the job (or one of its stages) ran out of time
+LEASE_LOST = "lease_lost"  # another worker took the job over; it owns the task record now
+
+# Provider calls get at least this long, so a nearly spent budget fails fast instead of with 0 s.
+MIN_CALL_TIMEOUT = 1.0
+
+
+class TaskCancelled(Exception):
+    """The job was stopped before it finished; `reason` says why."""
+
+    def __init__(self, reason: str = CANCELLED, message: str = None):
+        super().__init__(message or f"Task {reason}")
+        self.reason = reason
+
+
+class DeadlineExceeded(TaskCancelled):
+    def __init__(self, message: str = "Ran out of time"):
+        super().__init__(TIMEOUT, message)
+
+
+class Deadline:
+    """
+    Expiry time (monotonic) plus a cancellation flag. A child deadline never
+    outlives its parent and is cancelled with it. Thread-safe.
+    """
+
+    def __init__(self, seconds: float = None, parent: "Deadline" = None):
+        expires_at = time.monotonic() + seconds if seconds is not None else math.inf
+        if parent is not None:
+            expires_at = min(expires_at, parent.expires_at)
+        self.expires_at = expires_at
+        self.reason = None
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._detach = parent.on_cancel(lambda: self.cancel(parent.reason)) if parent is not None else None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def reached(self) -> bool:
+        return self.cancelled or self.remaining() <= 0
+
+    def check(self):
+        """Raises TaskCancelled / DeadlineExceeded if the deadline was cancelled or has passed."""
+        if self.reason == TIMEOUT or (self.reason is None and self.remaining() <= 0):
+            raise DeadlineExceeded()
+        if self.reason is not None:
+            raise TaskCancelled(self.reason)
+
+    def timeout(self, default: float = None) -> float:
+        """Seconds a call made now may take: `default`, capped by the time left."""
+        self.check()
+        remaining = self.remaining()
+        timeout = remaining if default is None else min(default, remaining)
+        return max(MIN_CALL_TIMEOUT, timeout) if timeout != math.inf else None
+
+    def cancel(self, reason: str = CANCELLED):
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason or CANCELLED
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                log.warning(f"Cancel callback failed: {type(e).__name__}: {e}")
+
+    def on_cancel(self, callback):
+        """Runs `callback()` on cancellation (right away if already cancelled). Returns a remover."""
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def close(self):
+        """Detaches a child deadline from its parent once its stage is over."""
+        if self._detach is not None:
+            self._detach()
+            self._detach = None
+
+
+_current = contextvars.ContextVar("deadline", default=None)
+
+
+def current_deadline():
+    return _current.get()
+
+
+@contextmanager
+def use_deadline(deadline):
+    """Makes `deadline` current for this context (and threads started from it with to_thread)."""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def call_timeout(default: float) -> float:
+    """The timeout for a provider call: `default`, capped by the current deadline."""
+    deadline = _current.get()
+    return default if deadline is None else deadline.timeout(default)
+
+
+def deadline_reached() -> bool:
+    deadline = _current.get()
+    return deadline is not None and deadline.reached()
+
+
+@contextmanager
+def abort_on_cancel(abort):
+    """Calls `abort()` (e.g. a stream's `close`) if the current deadline is cancelled meanwhile."""
+    deadline = _current.get()
+    remove = deadline.on_cancel(abort) if deadline is not None else None
+    try:
+        yield
+    finally:
+        if remove is not None:
+            remove()
+
+
+async def guard(awaitable, deadline: Deadline, what: str = "Task"):
+    """
+    Awaits `awaitable` unless `deadline` passes or is cancelled first. In that
+    case the deadline is cancelled (running its abort callbacks), the awaitable
+    is cancelled and TaskCancelled / DeadlineExceeded is raised.
+    """
+    task = asyncio.ensure_future(awaitable)
+    if deadline is None:
+        return await task
+    loop = asyncio.get_running_loop()
+    fired = loop.create_future()
+
+    def wake():
+        loop.call_soon_threadsafe(lambda: fired.done() or fired.set_result(None))
+
+    remove = deadline.on_cancel(wake)
+    try:
+        remaining = deadline.remaining()
+        timeout = None if remaining == math.inf else max(0.0, remaining)
+        done, _ = await asyncio.wait({task, fired}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if task in done:
+            return task.result()
+        if deadline.reason is None or deadline.reason == TIMEOUT:
+            deadline.cancel(TIMEOUT)
+            raise DeadlineExceeded(f"{what} ran out of time")
+        raise TaskCancelled(deadline.reason)
+    finally:
+        remove()
+        if not fired.done():
+            fired.cancel()
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,102 @@
+"""
+NDJSON event stream with backpressure.
+
+On serverless hosts a pipeline can't run in the background and be polled: the
+poll may land on another instance, and the function is frozen once its response
+is sent. The streaming route (`/generate/stream`) therefore runs the whole
+pipeline inside one response and writes its progress as NDJSON, one event per
+line. Events go from the pipeline to the socket through an `EventStream`:
+
+- `send(event, **data)` queues an event that must be delivered (a stage
+  started, the words, the final image, an error). If `max_pending` of them are
+  still waiting because the client reads slowly, `send` waits. That pauses the
+  pipeline at its next publish instead of buffering without bound.
+- `update(event, **data)` is for progress that supersedes itself (the prompt
+  as it is written, image previews). An undelivered update of the same kind is
+  replaced, so a slow client gets the newest state rather than every step.
+  Updates never wait.
+- If nothing was written for `heartbeat` seconds, a heartbeat line is sent so
+  proxies don't close the idle connection while a provider call runs.
+- `close()` ends the stream once the queued events are written.
+
+Iterating the stream yields the encoded lines; the response writer only pulls
+the next one when the previous one has been handed to the transport.
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+HEARTBEAT = "heartbeat"
+
+
+class EventStream:
+    def __init__(self, max_pending: int = 16, heartbeat: float = 10.0):
+        self.max_pending = max(1, max_pending)
+        self.heartbeat = heartbeat
+        self.started = time.monotonic()
+        self.superseded = 0
+        # key -> (required, event); required events get a sequence key, updates their event name.
+        self._pending = OrderedDict()
+        self._seq = 0
+        self._required = 0
+        self._closed = False
+        self._changed = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def send(self, event: str, **data):
+        """Queues an event that must be delivered, waiting while the client is too far behind."""
+        while self._required >= self.max_pending and not self._closed:
+            self._space.clear()
+            await self._space.wait()
+        if self._closed:
+            return
+        self._seq += 1
+        self._pending[self._seq] = (True, self._event(event, data))
+        self._required += 1
+        self._changed.set()
+
+    def update(self, event: str, **data):
+        """Queues a progress event, replacing an undelivered one of the same kind. Never waits."""
+        if self._closed:
+            return
+        key = ("update", event)
+        if self._pending.pop(key, None) is not None:
+            self.superseded += 1
+        # Re-queued at the end, so it stays behind the events it follows from.
+        self._pending[key] = (False, self._event(event, data))
+        self._changed.set()
+
+    def close(self):
+        self._closed = True
+        self._changed.set()
+        self._space.set()
+
+    def _event(self, event: str, data: dict) -> dict:
+        return {"event": event, "elapsed": round(time.monotonic() - self.started, 3), **data}
+
+    @staticmethod
+    def encode(event: dict) -> bytes:
+        return (json.dumps(event, ensure_ascii=False, default=str) + "\n").encode()
+
+    async def __aiter__(self):
+        while True:
+            if not self._pending:
+                if self._closed:
+                    return
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield self.encode(self._event(HEARTBEAT, {}))
+                continue
+            _, (required, event) = self._pending.popitem(last=False)
+            if required:
+                self._required -= 1
+                self._space.set()
+            yield self.encode(event)
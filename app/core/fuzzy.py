@@ -0,0 +1,216 @@
+"""
+Fuzzy normalization and near-duplicate clustering of terms.
+
+OCR and scraping return the same thing spelled several ways: "Hazy IPA",
+"hazy ipa ", "Hazy I.P.A", "Other Hal" and "Stone Brewing Co…". Paying the
+LLM to spot those wastes tokens, and the variants make otherwise identical
+inputs look different to request coalescing. Before any LLM call the raw terms
+are collapsed locally:
+
+1. `fold()` reduces a term to a comparison key: Unicode compatibility folding,
+   accents and case removed, dots and apostrophes dropped ("I.P.A" -> "ipa"),
+   other punctuation turned into spaces, whitespace collapsed.
+2. Terms with the same key are merged and their counts summed.
+3. The keys are clustered by edit distance, most frequent first, so the most
+   common spelling becomes the canonical form. Keys under six characters only
+   merge when equal ("Stout" and "Scout", "Lager" and "Later" are different
+   words), up to eight within one edit, longer ones within two. Edits never
+   touch the first character or the numbers: "Brewery 1" and "Brewery 2" stay
+   apart.
+4. A term cut off with an ellipsis joins the cluster whose key it prefixes.
+
+Candidates come from a trigram index over the cluster heads: only heads that
+share enough trigrams to possibly be within the allowed distance (the q-gram
+count filter) are checked with a bounded Levenshtein distance, instead of
+comparing every pair.
+"""
+import bisect
+import re
+import unicodedata
+
+from app.config import env_flag
+from app.core.words import WordBag
+from app.core.logs import get_logger
+
+log = get_logger(__name__)
+
+# Dropped entirely, so abbreviations and possessives fold onto the bare word.
+_JOINERS = frozenset(".'’`´")
+_ELLIPSES = ("…", "...")
+# A truncated term must keep at least this much to be matched by prefix.
+MIN_PREFIX = 4
+Q = 3
+_DIGITS = re.compile(r"\d+")
+
+
+def fold(term: str) -> str:
+    """The comparison key of a term ("Hazy I.P.A " and "hazy ipa" both give "hazy ipa")."""
+    text = unicodedata.normalize("NFKD", str(term))
+    out = []
+    for ch in text:
+        if unicodedata.combining(ch) or ch in _JOINERS:
+            continue
+        category = unicodedata.category(ch)
+        out.append(" " if category[0] in "PSZC" else ch)
+    return " ".join("".join(out).casefold().split())
+
+
+def max_distance(length: int) -> int:
+    """Edits allowed between two keys, from the length of the shorter one."""
+    if length < 6:
+        return 0
+    return 1 if length <= 8 else 2
+
+
+def _compatible(a: str, b: str) -> bool:
+    """Whether two keys may merge at all: same first character and the same numbers."""
+    return a[0] == b[0] and _DIGITS.findall(a) == _DIGITS.findall(b)
+
+
+def _grams(key: str) -> set:
+    padded = " " * (Q - 1) + key + " "
+    return {padded[i:i + Q] for i in range(len(padded) - Q + 1)}
+
+
+def _within(a: str, b: str, limit: int) -> bool:
+    """Levenshtein(a, b) <= limit, giving up as soon as a row exceeds the limit."""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > limit:
+            return False
+        prev = cur
+    return prev[-1] <= limit
+
+
+def _truncated(term: str) -> bool:
+    return term.rstrip().endswith(_ELLIPSES)
+
+
+def cluster(terms, counts=None) -> list:
+    """
+    Groups near-duplicate terms. Returns `(canonical, total_count, members)`
+    tuples, most frequent cluster first; `members` keeps the original spellings.
+    """
+    counts = counts if counts is not None else [1] * len(terms)
+
+    # Same key: merge, keeping the most frequent spelling (first seen on a tie).
+    by_key = {}
+    truncated = set()
+    for term, count in zip(terms, counts):
+        key = fold(term)
+        if not key:
+            continue
+        if _truncated(term):
+            truncated.add(key)
+        group = by_key.get(key)
+        if group is None:
+            by_key[key] = group = {"spellings": {}, "count": 0}
+        group["count"] += count
+        group["spellings"][term] = group["spellings"].get(term, 0) + count
+
+    keys = sorted(by_key, key=lambda k: -by_key[k]["count"])
+    heads = []        # cluster head keys
+    head_grams = []   # head index -> number of distinct trigrams
+    members = []      # head index -> member keys
+    index = {}        # trigram -> head indexes
+    head_of = {}      # key -> head index
+    known = []        # the keys of head_of, sorted (for prefix lookups)
+
+    def join(key, head):
+        members[head].append(key)
+        head_of[key] = head
+        bisect.insort(known, key)
+
+    # Complete terms first, so truncated ones have something to attach to.
+    for key in [k for k in keys if k not in truncated] + [k for k in keys if k in truncated]:
+        if key in truncated:
+            head = _prefix_head(key, known, heads, head_of, by_key)
+            if head is not None:
+                join(key, head)
+                continue
+        grams = _grams(key)
+        shared = {}
+        for gram in grams:
+            for head in index.get(gram, ()):
+                shared[head] = shared.get(head, 0) + 1
+        match = None
+        for head, common in sorted(shared.items(), key=lambda item: -item[1]):
+            other = heads[head]
+            limit = max_distance(min(len(key), len(other)))
+            if not limit or abs(len(key) - len(other)) > limit or not _compatible(key, other):
+                continue
+            # An edit changes at most Q trigrams, so keys within `limit` edits share at least this many.
+            if common < max(len(grams), head_grams[head]) - limit * Q:
+                continue
+            if _within(key, other, limit):
+                match = head
+                break
+        if match is not None:
+            join(key, match)
+            continue
+        heads.append(key)
+        head_grams.append(len(grams))
+        members.append([])
+        join(key, len(heads) - 1)
+        for gram in grams:
+            index.setdefault(gram, []).append(len(heads) - 1)
+
+    result = []
+    for head, keys_in in zip(heads, members):
+        spellings = {}
+        for key in keys_in:
+            for term, count in by_key[key]["spellings"].items():
+                spellings[term] = spellings.get(term, 0) + count
+        head_spellings = by_key[head]["spellings"]
+        canonical = max(head_spellings, key=head_spellings.get).strip()
+        total = sum(by_key[k]["count"] for k in keys_in)
+        result.append((canonical, total, list(spellings)))
+    result.sort(key=lambda c: -c[1])
+    return result
+
+
+def _prefix_head(key: str, known: list, heads: list, head_of: dict, by_key: dict):
+    """The most frequent cluster with a key that starts with `key`, if any (`known` is sorted)."""
+    if len(key) < MIN_PREFIX:
+        return None
+    best = None
+    for i in range(bisect.bisect_left(known, key), len(known)):
+        other = known[i]
+        if not other.startswith(key):
+            break
+        if other == key:
+            continue
+        head = head_of[other]
+        if best is None or by_key[heads[head]]["count"] > by_key[heads[best]]["count"]:
+            best = head
+    return best
+
+
+def cluster_bag(bag: WordBag) -> WordBag:
+    """A bag with near-duplicates collapsed to their canonical form (within each category)."""
+    out = WordBag(categorized=bag.categorized)
+    by_category = {}
+    for term, category, count in bag.items():
+        terms, counts = by_category.setdefault(category, ([], []))
+        terms.append(term)
+        counts.append(count)
+    for category, (terms, counts) in by_category.items():
+        for canonical, total, _ in cluster(terms, counts):
+            out.add(canonical, category, total)
+    return out
+
+
+def compact_terms(raw_words, limit: int = 200) -> list:
+    """The terms worth sending to an LLM: near-duplicates collapsed, most frequent first."""
+    bag = WordBag.from_json(raw_words)
+    compact = cluster_bag(bag) if env_flag("WORD_CLUSTERING", True) else bag.dedupe()
+    if len(compact) < len(bag):
+        log.info(f"Collapsed {len(bag)} terms into {len(compact)} before the LLM call")
+    return compact.top_k(limit)
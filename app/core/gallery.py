@@ -0,0 +1,240 @@
+"""
+Persistent index of past generations.
+
+`static/generated/` used to be the only record of what we made: files with no
+metadata that could only be browsed by listing the directory. Every completed
+task is now written to a SQLite index with its prompt, reasoning, words, style,
+provider, stage timings and image variant URLs.
+
+Listing uses keyset (cursor) pagination on `(created_at, task_id)` backed by
+indexes, so fetching a page costs the same with 50 or 50,000 images.
+"""
+import base64
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from app.config import get_env
+from app.core.sqlite import ThreadLocalConnections, data_path
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# Legacy files written by earlier versions straight into static/generated/.
+LEGACY_PREFIXES = {
+    "google_nano_": "google",
+    "dalle_": "dalle",
+    "gen_": "pollinations",
+}
+LEGACY_FILE_RE = re.compile(r"^(google_nano_|dalle_|gen_)[0-9a-f-]+\.(png|jpe?g)$")
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: float, task_id: str) -> str:
+    raw = json.dumps([created_at, task_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, task_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(created_at), str(task_id)
+    except Exception:
+        raise InvalidCursor("Malformed cursor")
+
+
+class GalleryIndex:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS generations (
+        task_id TEXT PRIMARY KEY,
+        created_at REAL NOT NULL,
+        style TEXT,
+        provider TEXT,
+        theme TEXT,
+        prompt TEXT,
+        reasoning TEXT,
+        words TEXT,
+        timings TEXT,
+        image_id TEXT,
+        media TEXT,
+        pipeline_mode TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_generations_time ON generations(created_at DESC, task_id DESC);
+    CREATE INDEX IF NOT EXISTS idx_generations_style ON generations(style, created_at DESC, task_id DESC);
+    CREATE INDEX IF NOT EXISTS idx_generations_provider ON generations(provider, created_at DESC, task_id DESC);
+    """
+
+    # Columns returned by list() - the heavy ones (words, reasoning, timings) are left for get().
+    LIST_COLUMNS = "task_id, created_at, style, provider, theme, prompt, image_id, media"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conns = ThreadLocalConnections(path, self.SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Adds columns introduced after an index was first created."""
+        conn = self._conns.get()
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(generations)")}
+        if "pipeline_mode" not in columns:
+            try:
+                conn.execute("ALTER TABLE generations ADD COLUMN pipeline_mode TEXT")
+            except sqlite3.OperationalError:
+                pass  # Another process added it first
+
+    def record(self, task_id: str, *, style: str = None, provider: str = None, theme: str = None,
+               prompt: str = None, reasoning: str = None, words=None, timings: dict = None,
+               image_id: str = None, media: dict = None, created_at: float = None,
+               pipeline_mode: str = None):
+        """Adds (or replaces) the entry for a completed task."""
+        self._conns.get().execute(
+            "INSERT OR REPLACE INTO generations "
+            "(task_id, created_at, style, provider, theme, prompt, reasoning, words, timings, image_id, media, "
+            "pipeline_mode) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                task_id, created_at or time.time(), style, provider, theme, prompt, reasoning,
+                json.dumps(words) if words is not None else None,
+                json.dumps(timings or {}),
+                image_id,
+                json.dumps(media or {}),
+                pipeline_mode,
+            ),
+        )
+
+    @staticmethod
+    def _row_to_item(row, full: bool = False) -> dict:
+        media = json.loads(row["media"] or "{}")
+        item = {
+            "task_id": row["task_id"],
+            "created_at": row["created_at"],
+            "style": row["style"],
+            "provider": row["provider"],
+            "theme": row["theme"],
+            "prompt": row["prompt"],
+            "image_id": row["image_id"],
+            "thumbnail_url": media.get("thumbnail_url"),
+            "image_url": media.get("image_url"),
+            "srcset": media.get("srcset"),
+            "download_url": media.get("download_url"),
+        }
+        if full:
+            item["reasoning"] = row["reasoning"]
+            item["words"] = json.loads(row["words"]) if row["words"] else None
+            item["timings"] = json.loads(row["timings"] or "{}")
+            item["pipeline_mode"] = row["pipeline_mode"]
+        return item
+
+    def list(self, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE, style: str = None,
+             provider: str = None) -> dict:
+        """Newest first. Returns `{"items": [...], "next_cursor": str | None}`."""
+        limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+        where, args = [], []
+        if style:
+            where.append("style = ?")
+            args.append(style)
+        if provider:
+            where.append("provider = ?")
+            args.append(provider)
+        if cursor:
+            created_at, task_id = decode_cursor(cursor)
+            # Row-value comparison lets SQLite seek straight into the index.
+            where.append("(created_at, task_id) < (?, ?)")
+            args.extend([created_at, task_id])
+        sql = f"SELECT {self.LIST_COLUMNS} FROM generations"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, task_id DESC LIMIT ?"
+        rows = self._conns.get().execute(sql, args + [limit + 1]).fetchall()
+
+        items = [self._row_to_item(r) for r in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor(last["created_at"], last["task_id"])
+        return {"items": items, "next_cursor": next_cursor}
+
+    def get(self, task_id: str):
+        row = self._conns.get().execute("SELECT * FROM generations WHERE task_id = ?", (task_id,)).fetchone()
+        return self._row_to_item(row, full=True) if row else None
+
+    def count(self) -> int:
+        return self._conns.get().execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+
+    def latency_by_mode(self, limit: int = 500) -> dict:
+        """
+        End-to-end latency per pipeline mode over the most recent `limit`
+        generations: `{mode: {"count", "p50", "p95", "mean"}}` in seconds.
+        """
+        rows = self._conns.get().execute(
+            "SELECT pipeline_mode, timings FROM generations WHERE pipeline_mode IS NOT NULL "
+            "ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        totals = {}
+        for row in rows:
+            total = json.loads(row["timings"] or "{}").get("total")
+            if total is not None:
+                totals.setdefault(row["pipeline_mode"], []).append(float(total))
+
+        def percentile(values, q):
+            return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+        stats = {}
+        for mode, values in totals.items():
+            values.sort()
+            stats[mode] = {
+                "count": len(values),
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+                "mean": round(sum(values) / len(values), 3),
+            }
+        return stats
+
+    def backfill_legacy(self, directory: str = None) -> int:
+        """
+        Indexes the pre-gallery `gen_*`, `dalle_*` and `google_nano_*` files,
+        building their variants on the way. Already-indexed files are skipped.
+        Returns the number of files added.
+        """
+        from app.services.postprocess import build_variants, media_dir, variant_urls
+
+        directory = directory or media_dir()
+        added = 0
+        for name in sorted(os.listdir(directory)):
+            match = LEGACY_FILE_RE.match(name)
+            if not match:
+                continue
+            image_id = name.rsplit(".", 1)[0]
+            if self.get(image_id) is not None:
+                continue
+            path = os.path.join(directory, name)
+            with open(path, "rb") as f:
+                manifest = build_variants(f.read(), image_id, media_dir())
+            self.record(
+                image_id,
+                provider=LEGACY_PREFIXES[match.group(1)],
+                image_id=image_id,
+                media=variant_urls(manifest),
+                created_at=os.path.getmtime(path),
+            )
+            added += 1
+        return added
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_gallery() -> GalleryIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = GalleryIndex(get_env("GALLERY_DB_PATH") or data_path("gallery.db"))
+    return _index
@@ -0,0 +1,442 @@
+"""
+Durable job queue for generation work.
+
+Submissions used to exist only as `BackgroundTasks` closures, so a deploy or a
+crash mid-generation lost every running job. Jobs are now rows in a SQLite (WAL)
+database: the submitting route writes the job, a worker claims it under a lease
+and keeps the lease alive with heartbeats while it runs.
+
+After each completed stage (OCR words, cleaned words, enriched prompt) the
+worker stores a checkpoint on the job. If the worker dies, its lease expires
+and the next worker to claim the job starts from the last checkpoint instead of
+paying for OCR and enrichment again. Images are not checkpointed: they are
+megabytes each. Checkpoints are dropped when the job finishes, and the worker
+periodically deletes old finished jobs (`prune()`) and parked jobs nobody came
+back for (`expire_waiting()`).
+
+Every write made on behalf of a running job is fenced by `(job_id, lease_owner)`,
+so a worker that lost its lease (e.g. paused past expiry) can't overwrite the
+progress of the worker that took the job over.
+
+Jobs are claimed in weighted fair order across their owners (browser sessions)
+rather than first-come first-served, so one user's dozen uploads can't starve
+everyone else. This is self-clocked fair queueing: on submit, a job gets the
+virtual finish tag `max(V, owner's last tag) + cost / weight`, and claims take
+the smallest tag. V is the tag of the job claimed most recently.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from app.config import get_env, env_int
+from app.core.sqlite import ThreadLocalConnections, data_path, transaction
+
+DEFAULT_LEASE_SECONDS = 30
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+WAITING = "waiting"      # parked until the user supplies input (/resume_task)
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class LeaseLost(RuntimeError):
+    """Raised when a worker writes to a job it no longer holds the lease for."""
+
+
+def _to_json(value):
+    # Stage outputs such as a WordBag are checkpointed in their JSON shape.
+    if hasattr(value, "to_json"):
+        return value.to_json()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+@dataclass
+class Job:
+    job_id: str
+    kind: str
+    params: dict
+    payload: bytes = None
+    status: str = QUEUED
+    attempts: int = 0
+    lease_owner: str = None
+    lease_expires: float = 0.0
+    checkpoints: dict = field(default_factory=dict)
+    error: str = None
+    created_at: float = 0.0
+    owner: str = None
+    vfinish: float = 0.0
+
+    @classmethod
+    def from_row(cls, row) -> "Job":
+        return cls(
+            job_id=row["job_id"],
+            kind=row["kind"],
+            params=json.loads(row["params"]),
+            payload=row["payload"],
+            status=row["status"],
+            attempts=row["attempts"],
+            lease_owner=row["lease_owner"],
+            lease_expires=row["lease_expires"] or 0.0,
+            checkpoints=json.loads(row["checkpoints"]),
+            error=row["error"],
+            created_at=row["created_at"],
+            owner=row["owner"],
+            vfinish=row["vfinish"] or 0.0,
+        )
+
+
+class JobQueue:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL,
+        payload BLOB,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        lease_owner TEXT,
+        lease_expires REAL,
+        checkpoints TEXT NOT NULL DEFAULT '{}',
+        error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        owner TEXT,
+        vfinish REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at);
+    CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs(status, lease_expires);
+    -- Fair-queueing clock: the last finish tag per owner, and V under owner '*'.
+    CREATE TABLE IF NOT EXISTS fair_tags (
+        owner TEXT PRIMARY KEY,
+        last_finish REAL NOT NULL
+    );
+    -- Places held by admission control (app.core.admission): until the job is
+    -- submitted, or for the length of a stream. Expired ones don't count.
+    CREATE TABLE IF NOT EXISTS reservations (
+        reservation_id TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_reservations_owner ON reservations(owner, expires_at);
+    """
+
+    # Owner row holding the virtual time V.
+    CLOCK = "*"
+
+    def __init__(self, path: str, lease_seconds: int = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._conns = ThreadLocalConnections(path, self.SCHEMA)
+        self._migrate()
+
+    def _conn(self):
+        return self._conns.get()
+
+    def _migrate(self):
+        """Adds the fair-queueing columns to a queue created by an earlier version."""
+        conn = self._conn()
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for name, kind in (("owner", "TEXT"), ("vfinish", "REAL")):
+            if name not in columns:
+                try:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+                except sqlite3.OperationalError:
+                    pass  # Another process added it first
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_fair ON jobs(status, vfinish)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(owner, status)")
+
+    def submit(self, job_id: str, kind: str, params: dict, payload: bytes = None, owner: str = None,
+               cost: float = 1.0, weight: float = 1.0, reservation: str = None) -> Job:
+        """
+        Queues a job for `owner`. Its place in the fair order is `cost / weight`
+        after the later of the virtual time and the owner's previous job. The
+        admission `reservation` it was admitted with is consumed in the same
+        transaction, so the owner's count never drops in between.
+        """
+        now = time.time()
+        owner = owner or job_id
+        conn = self._conn()
+        with transaction(conn):
+            tags = {
+                row["owner"]: row["last_finish"]
+                for row in conn.execute(
+                    "SELECT owner, last_finish FROM fair_tags WHERE owner IN (?, ?)", (self.CLOCK, owner)
+                )
+            }
+            vfinish = max(tags.get(self.CLOCK, 0.0), tags.get(owner, 0.0)) + cost / max(weight, 1e-6)
+            conn.execute(
+                "INSERT OR REPLACE INTO fair_tags (owner, last_finish) VALUES (?, ?)", (owner, vfinish)
+            )
+            conn.execute(
+                "INSERT INTO jobs (job_id, kind, params, payload, status, created_at, updated_at, owner, vfinish) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params), payload, QUEUED, now, now, owner, vfinish),
+            )
+            if reservation:
+                conn.execute("DELETE FROM reservations WHERE reservation_id = ?", (reservation,))
+        return Job(job_id=job_id, kind=kind, params=params, payload=payload, created_at=now,
+                   owner=owner, vfinish=vfinish)
+
+    def get(self, job_id: str):
+        row = self._conn().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return Job.from_row(row) if row else None
+
+    def claim(self, worker_id: str, lease_seconds: int = None):
+        """
+        Leases the next runnable job in fair order to `worker_id`: either a queued
+        job or a running job whose lease has expired (its worker died). Returns the
+        Job or None. Jobs that used up their attempts are never claimed again; see
+        `reap_abandoned()`.
+        """
+        lease_seconds = lease_seconds or self.lease_seconds
+        now = time.time()
+        conn = self._conn()
+        with transaction(conn):
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (status = ? OR (status = ? AND lease_expires < ?)) "
+                "AND attempts < ? ORDER BY COALESCE(vfinish, 0), created_at LIMIT 1",
+                (QUEUED, RUNNING, now, self.max_attempts),
+            ).fetchone()
+            if row is None:
+                return None
+            # Advance the virtual time (never backwards: recovered jobs keep their old tags).
+            conn.execute(
+                "INSERT INTO fair_tags (owner, last_finish) VALUES (?, ?) "
+                "ON CONFLICT(owner) DO UPDATE SET last_finish = MAX(last_finish, excluded.last_finish)",
+                (self.CLOCK, row["vfinish"] or 0.0),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = ?, lease_owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE job_id = ?",
+                (RUNNING, worker_id, now + lease_seconds, now, row["job_id"]),
+            )
+        job = Job.from_row(row)
+        job.status, job.lease_owner, job.lease_expires = RUNNING, worker_id, now + lease_seconds
+        job.attempts += 1
+        return job
+
+    def reap_abandoned(self) -> list[Job]:
+        """Fails expired jobs that are out of attempts (they crashed their worker every time)."""
+        now = time.time()
+        conn = self._conn()
+        with transaction(conn):
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (RUNNING, now, self.max_attempts),
+            ).fetchall()
+            for row in rows:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, updated_at = ? WHERE job_id = ?",
+                    (FAILED, f"Abandoned after {row['attempts']} attempts", now, row["job_id"]),
+                )
+        return [Job.from_row(r) for r in rows]
+
+    def _fenced_update(self, job_id: str, worker_id: str, sql: str, args: tuple):
+        cur = self._conn().execute(
+            f"UPDATE jobs SET {sql}, updated_at = ? WHERE job_id = ? AND lease_owner = ? AND status = ?",
+            args + (time.time(), job_id, worker_id, RUNNING),
+        )
+        if cur.rowcount != 1:
+            raise LeaseLost(f"Worker {worker_id} no longer holds job {job_id}")
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: int = None) -> bool:
+        """Extends the lease. Returns False if the lease was lost to another worker."""
+        lease_seconds = lease_seconds or self.lease_seconds
+        try:
+            self._fenced_update(job_id, worker_id, "lease_expires = ?", (time.time() + lease_seconds,))
+            return True
+        except LeaseLost:
+            return False
+
+    def checkpoint(self, job_id: str, worker_id: str, stage: str, value):
+        """Records the output of a completed stage (read-modify-write inside one transaction)."""
+        conn = self._conn()
+        with transaction(conn):
+            row = conn.execute(
+                "SELECT checkpoints FROM jobs WHERE job_id = ? AND lease_owner = ? AND status = ?",
+                (job_id, worker_id, RUNNING),
+            ).fetchone()
+            if row is None:
+                raise LeaseLost(f"Worker {worker_id} no longer holds job {job_id}")
+            checkpoints = json.loads(row["checkpoints"])
+            checkpoints[stage] = value
+            conn.execute(
+                "UPDATE jobs SET checkpoints = ?, updated_at = ? WHERE job_id = ?",
+                (json.dumps(checkpoints, default=_to_json), time.time(), job_id),
+            )
+
+    def complete(self, job_id: str, worker_id: str):
+        # The input image and the checkpoints are no longer needed once the job is finished.
+        self._fenced_update(job_id, worker_id,
+                            "status = ?, payload = NULL, checkpoints = '{}', lease_owner = NULL", (DONE,))
+
+    def fail(self, job_id: str, worker_id: str, error: str):
+        self._fenced_update(job_id, worker_id,
+                            "status = ?, error = ?, payload = NULL, checkpoints = '{}', lease_owner = NULL",
+                            (FAILED, error))
+
+    def park(self, job_id: str, worker_id: str):
+        """Releases a job that is waiting for user input; `resume()` puts it back in the queue."""
+        self._fenced_update(job_id, worker_id, "status = ?, lease_owner = NULL", (WAITING,))
+
+    def release(self, job_id: str, worker_id: str):
+        """Hands a running job back to the queue on graceful shutdown (doesn't count as an attempt)."""
+        self._fenced_update(job_id, worker_id, "status = ?, lease_owner = NULL, attempts = attempts - 1",
+                            (QUEUED,))
+
+    def cancel(self, job_id: str):
+        """
+        Cancels a queued, parked or running job. Returns the status it had, or
+        None if it had already finished. A running job's worker loses its lease
+        and notices at its next heartbeat.
+        """
+        conn = self._conn()
+        with transaction(conn):
+            row = conn.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None or row["status"] not in (QUEUED, WAITING, RUNNING):
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, payload = NULL, checkpoints = '{}', lease_owner = NULL, updated_at = ? "
+                "WHERE job_id = ?",
+                (CANCELLED, time.time(), job_id),
+            )
+        return row["status"]
+
+    def resume(self, job_id: str, stage: str, value) -> bool:
+        """
+        Requeues a parked job with `value` recorded as the checkpoint for `stage`.
+        `created_at` restarts too: the job's deadline doesn't count the time spent
+        waiting for the user.
+        """
+        now = time.time()
+        conn = self._conn()
+        with transaction(conn):
+            row = conn.execute(
+                "SELECT checkpoints FROM jobs WHERE job_id = ? AND status = ?", (job_id, WAITING)
+            ).fetchone()
+            if row is None:
+                return False
+            checkpoints = json.loads(row["checkpoints"])
+            checkpoints[stage] = value
+            conn.execute(
+                "UPDATE jobs SET status = ?, checkpoints = ?, attempts = 0, created_at = ?, updated_at = ? "
+                "WHERE job_id = ?",
+                (QUEUED, json.dumps(checkpoints), now, now, job_id),
+            )
+        return True
+
+    def expire_waiting(self, older_than: float) -> list[str]:
+        """
+        Cancels parked jobs nobody resumed since `older_than` (the user never came
+        back for their draft or words). Returns their ids.
+        """
+        conn = self._conn()
+        with transaction(conn):
+            ids = [
+                row["job_id"]
+                for row in conn.execute(
+                    "SELECT job_id FROM jobs WHERE status = ? AND updated_at < ?", (WAITING, older_than)
+                )
+            ]
+            for job_id in ids:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, payload = NULL, checkpoints = '{}', updated_at = ? "
+                    "WHERE job_id = ?",
+                    (CANCELLED, "Expired while waiting for input", time.time(), job_id),
+                )
+        return ids
+
+    def counts(self) -> dict:
+        rows = self._conn().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    LOAD_SQL = (
+        "SELECT "
+        "  (SELECT COUNT(*) FROM jobs WHERE owner = ? AND status IN (?, ?)) "
+        "  + (SELECT COUNT(*) FROM reservations WHERE owner = ? AND expires_at >= ?) AS owner_active, "
+        "  (SELECT COUNT(*) FROM jobs WHERE status = ?) AS backlog, "
+        "  (SELECT COUNT(*) FROM jobs WHERE status = ?) AS running"
+    )
+
+    def load(self, owner: str, conn=None) -> dict:
+        """
+        `{"owner_active", "backlog", "running"}`: the owner's queued + running
+        jobs and live reservations, and the global queue. Pass `conn` to read
+        inside a caller's transaction.
+        """
+        row = (conn or self._conn()).execute(
+            self.LOAD_SQL, (owner, QUEUED, RUNNING, owner, time.time(), QUEUED, RUNNING)
+        ).fetchone()
+        return {"owner_active": row["owner_active"], "backlog": row["backlog"], "running": row["running"]}
+
+    def reserve(self, conn, owner: str, kind: str, seconds: float) -> str:
+        """Holds a place for `owner` for `seconds`, inside the caller's transaction on `conn`. Returns its id."""
+        now = time.time()
+        reservation = uuid.uuid4().hex
+        conn.execute("DELETE FROM reservations WHERE expires_at < ?", (now,))
+        conn.execute("INSERT INTO reservations (reservation_id, owner, kind, expires_at) VALUES (?, ?, ?, ?)",
+                     (reservation, owner, kind, now + seconds))
+        return reservation
+
+    def release_reservation(self, reservation: str):
+        self._conn().execute("DELETE FROM reservations WHERE reservation_id = ?", (reservation,))
+
+    def reservations(self, kind: str) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) AS n FROM reservations WHERE kind = ? AND expires_at >= ?", (kind, time.time())
+        ).fetchone()["n"]
+
+    def recent_duration(self, window: float = 3600.0):
+        """Mean seconds from submission to completion of the jobs finished in the last `window`, or None."""
+        row = self._conn().execute(
+            "SELECT AVG(updated_at - created_at) AS d FROM jobs WHERE status = ? AND updated_at > ?",
+            (DONE, time.time() - window),
+        ).fetchone()
+        return row["d"]
+
+    def prune(self, older_than: float) -> int:
+        """Deletes finished jobs last updated before `older_than`. Returns how many."""
+        conn = self._conn()
+        cur = conn.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?", (DONE, FAILED, CANCELLED, older_than)
+        )
+        # Owners whose last tag is behind the clock start from V anyway.
+        conn.execute(
+            "DELETE FROM fair_tags WHERE owner != ? AND last_finish < "
+            "(SELECT COALESCE(MAX(last_finish), 0) FROM fair_tags WHERE owner = ?)",
+            (self.CLOCK, self.CLOCK),
+        )
+        return cur.rowcount
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Process-wide queue backed by JOB_QUEUE_PATH (default `$DATA_DIR/jobs.db`)."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(
+                    get_env("JOB_QUEUE_PATH") or data_path("jobs.db"),
+                    lease_seconds=env_int("JOB_LEASE_SECONDS", DEFAULT_LEASE_SECONDS),
+                    max_attempts=env_int("JOB_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS),
+                )
+    return _queue
+
+
+def set_job_queue(queue: JobQueue):
+    global _queue
+    _queue = queue
@@ -0,0 +1,160 @@
+"""
+Incremental parser for a streamed JSON object.
+
+When an LLM streams `{"visual_prompt": "...", "reasoning": "..."}` token by
+token, `json.loads` can only run once the final brace arrives. `PartialJSONObject`
+consumes the chunks as they come and tracks the top-level string fields: the
+text received so far, and whether the closing quote has been seen. Nested values
+and non-string values are skipped. Escapes, including `\\uXXXX` surrogate
+pairs, are decoded even when split across chunks.
+
+    parser = PartialJSONObject()
+    for chunk in stream:
+        for key in parser.feed(chunk):
+            print(key, parser.fields[key], key in parser.closed)
+
+`JSONArrayItems` does the same for a large top-level array, such as an Untappd
+export of tens of thousands of check-ins. Each element is returned as soon as
+the delimiter after it has arrived, so only one element is held in memory:
+
+    items = JSONArrayItems()
+    for chunk in chunks:
+        for checkin in items.feed(chunk):
+            ...
+    items.close()   # raises ValueError if the document ended early
+"""
+import json
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class PartialJSONObject:
+    def __init__(self):
+        self.fields = {}      # top-level key -> string value (partial until closed)
+        self.closed = set()   # keys whose string value is complete
+        self.done = False     # the outer object has been closed
+        self._depth = 0
+        self._expect_value = False
+        self._key = None
+        self._in_string = False
+        self._role = None     # "key", "value" or None (a string we don't keep)
+        self._buf = []
+        self._escape = None   # None, "" right after a backslash, or "uXXXX" being read
+        self._high_surrogate = None
+
+    def feed(self, chunk: str) -> set:
+        """Consumes the next chunk. Returns the top-level keys whose value changed."""
+        changed = set()
+        for c in chunk:
+            if self._in_string:
+                self._string_char(c, changed)
+            elif c == '"':
+                self._in_string = True
+                self._buf = []
+                if self._depth == 1:
+                    self._role = "value" if self._expect_value else "key"
+                    if self._role == "value":
+                        self.fields[self._key] = ""
+                        changed.add(self._key)
+                else:
+                    self._role = None
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.done = True
+            elif self._depth == 1 and c == ":":
+                self._expect_value = True
+            elif self._depth == 1 and c == ",":
+                self._expect_value = False
+        if self._in_string and self._role == "value" and self._buf:
+            self.fields[self._key] = "".join(self._buf)
+            changed.add(self._key)
+        return changed
+
+    def _string_char(self, c: str, changed: set):
+        if self._escape is not None:
+            if self._escape == "" and c != "u":
+                self._append(_ESCAPES.get(c, c))
+                self._escape = None
+            else:
+                self._escape += c
+                if len(self._escape) == 5:
+                    self._append_codepoint(int(self._escape[1:], 16))
+                    self._escape = None
+        elif c == "\\":
+            self._escape = ""
+        elif c == '"':
+            self._in_string = False
+            text = "".join(self._buf)
+            if self._role == "key":
+                self._key = text
+            elif self._role == "value":
+                self.fields[self._key] = text
+                self.closed.add(self._key)
+                changed.add(self._key)
+        else:
+            self._append(c)
+
+    def _append(self, text: str):
+        if self._role is not None:
+            self._buf.append(text)
+
+    def _append_codepoint(self, code: int):
+        if 0xD800 <= code <= 0xDBFF:
+            self._high_surrogate = code
+            return
+        if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        self._append(chr(code))
+
+
+class JSONArrayItems:
+    # An element this large is more likely a broken document than a check-in.
+    MAX_ITEM_CHARS = 1 << 20
+
+    def __init__(self):
+        self.started = False
+        self.done = False
+        self._buf = ""
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, chunk: str) -> list:
+        """Consumes the next chunk. Returns the elements it completed."""
+        buf = self._buf + chunk
+        items = []
+        pos = 0
+        while not self.done:
+            while pos < len(buf) and (buf[pos].isspace() or (self.started and buf[pos] == ",")):
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not self.started:
+                if buf[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                self.started = True
+                pos += 1
+            elif buf[pos] == "]":
+                self.done = True
+                pos += 1
+            else:
+                try:
+                    item, end = self._decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    end = None
+                # A number cut by the chunk boundary ("12" of "1234", "1." of "1.5") decodes too early:
+                # only take an element once the delimiter after it has arrived.
+                if end is None or end == len(buf) or not (buf[end] in ",]" or buf[end].isspace()):
+                    if len(buf) - pos > self.MAX_ITEM_CHARS:
+                        raise ValueError("Malformed JSON array element")
+                    break
+                items.append(item)
+                pos = end
+        self._buf = buf[pos:]
+        return items
+
+    def close(self):
+        if not self.done:
+            raise ValueError("The JSON array is truncated or malformed")
@@ -0,0 +1,199 @@
+"""
+Structured, non-blocking logging.
+
+Every request and service used to `print`: the request middleware wrote two
+lines per request (including every `/status` poll), and the services printed
+whole LLM responses. Under load the stdout writes blocked the event loop, and
+the volume inflated the log bill.
+
+Loggers under `wordcloud.*` now hand records to a bounded queue. A listener
+thread formats them and writes them to stdout. If the queue is full, records
+are dropped and counted, so logging never blocks the caller. Records are JSON
+lines by default:
+
+    {"ts": "...", "level": "INFO", "logger": "wordcloud.pipeline", "msg": "...",
+     "task_id": "...", "stage": "image", "event": "...", ...extra fields}
+
+- `task_id` and `stage` come from context variables. The pipeline sets them
+  around each job and stage (`log_context`), and they follow the work into
+  executor threads.
+- `extra={"event": "request.poll"}` names a message type. `LOG_SAMPLE` keeps a
+  fraction of each type (`request.poll=0.05,llm.raw=0.2`). Warnings and
+  errors are never sampled out.
+- String fields longer than `LOG_MAX_FIELD_CHARS` are truncated, with the
+  original length noted.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app.config import get_env, env_int
+
+ROOT = "wordcloud"
+DEFAULT_SAMPLE = "request.poll=0.1"
+
+_task_id = ContextVar("log_task_id", default=None)
+_stage = ContextVar("log_stage", default=None)
+_setup_lock = threading.Lock()
+_listener = None
+_handler = None
+
+# Attributes every LogRecord has; anything else on a record came from `extra`.
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "task_id", "stage"}
+
+
+def get_logger(name: str) -> logging.Logger:
+    """A logger under the app's root (`app.services.beercloud` -> `wordcloud.services.beercloud`)."""
+    if name.startswith("app."):
+        name = name[len("app."):]
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+@contextmanager
+def log_context(task_id: str = None, stage: str = None):
+    """Tags records logged inside the block (and in work it hands to threads) with a task and stage."""
+    tokens = []
+    if task_id is not None:
+        tokens.append((_task_id, _task_id.set(task_id)))
+    if stage is not None:
+        tokens.append((_stage, _stage.set(stage)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def truncate(value: str, limit: int) -> str:
+    if limit and len(value) > limit:
+        return f"{value[:limit]}… (+{len(value) - limit} chars)"
+    return value
+
+
+def parse_sample(spec: str) -> dict:
+    """"request.poll=0.1,llm.raw=0.5" -> {"request.poll": 0.1, "llm.raw": 0.5}"""
+    rates = {}
+    for part in (spec or "").split(","):
+        name, _, rate = part.partition("=")
+        if not name.strip():
+            continue
+        try:
+            rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            print(f"WARNING: Ignoring bad LOG_SAMPLE entry {part!r}", file=sys.stderr)
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """Runs in the caller's thread: adds the task/stage context and applies sampling."""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, "event", None)
+        if event is not None and record.levelno < logging.WARNING:
+            rate = self.rates.get(event)
+            if rate is not None and random.random() >= rate:
+                return False
+        record.task_id = _task_id.get()
+        record.stage = _stage.get()
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks: a record that doesn't fit in the queue is counted and dropped."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+    def __init__(self, max_field: int):
+        super().__init__()
+        self.max_field = max_field
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": truncate(record.getMessage(), self.max_field if record.levelno < logging.ERROR else 0),
+        }
+        if getattr(record, "task_id", None):
+            entry["task_id"] = record.task_id
+        if getattr(record, "stage", None):
+            entry["stage"] = record.stage
+        for key, value in vars(record).items():
+            if key in _RESERVED or key.startswith("_"):
+                continue
+            if isinstance(value, str):
+                value = truncate(value, self.max_field)
+            elif not isinstance(value, (int, float, bool, type(None), list, dict)):
+                value = truncate(str(value), self.max_field)
+            entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, max_field: int):
+        super().__init__("%(asctime)s %(levelname)s %(name)s%(context)s: %(message)s")
+        self.max_field = max_field
+
+    def format(self, record: logging.LogRecord) -> str:
+        context = [v for v in (getattr(record, "task_id", None), getattr(record, "stage", None)) if v]
+        record.context = f" [{' '.join(context)}]" if context else ""
+        record.msg = truncate(record.getMessage(), self.max_field if record.levelno < logging.ERROR else 0)
+        record.args = None
+        text = super().format(record)
+        # Extra fields follow the message; multi-line ones (stacks) on their own lines.
+        for key, value in vars(record).items():
+            if key in _RESERVED or key in ("context", "event") or key.startswith("_"):
+                continue
+            value = truncate(str(value), self.max_field)
+            text += f"\n{value.rstrip()}" if "\n" in value else f" {key}={value}"
+        return text
+
+
+def setup_logging():
+    """Routes the `wordcloud.*` loggers through the queue (only the first call does any work)."""
+    global _listener, _handler
+    with _setup_lock:
+        if _handler is not None:
+            return
+        max_field = env_int("LOG_MAX_FIELD_CHARS", 1000)
+        formatter = TextFormatter(max_field) if get_env("LOG_FORMAT", "json").lower() == "text" else JSONFormatter(max_field)
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(formatter)
+
+        _handler = DroppingQueueHandler(queue.Queue(maxsize=env_int("LOG_QUEUE_SIZE", 10000)))
+        _handler.addFilter(ContextFilter(parse_sample(get_env("LOG_SAMPLE", DEFAULT_SAMPLE))))
+        root = logging.getLogger(ROOT)
+        root.setLevel((get_env("LOG_LEVEL", "INFO") or "INFO").upper())
+        root.addHandler(_handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(_handler.queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def dropped() -> int:
+    """Records dropped because the log queue was full."""
+    return _handler.dropped if _handler is not None else 0
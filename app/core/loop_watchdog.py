@@ -0,0 +1,131 @@
+"""
+Event-loop lag watchdog.
+
+Every route, `/status` poll and worker slot shares one event loop per process.
+A synchronous call made from async code (the Untappd token exchange used to do
+a blocking `requests.post`) freezes all of them until it returns. Nothing in
+the request logs points at the culprit, because each request just looks slow.
+
+`LoopWatchdog` measures this from two sides:
+
+- A heartbeat task on the loop sleeps for `interval` and records how late it
+  wakes up. That is the loop lag, kept in a rolling window for `/stats/loop`.
+- A sentinel thread checks when the loop last ticked. If the loop is stuck
+  longer than `threshold`, the sentinel logs the loop thread's stack while it
+  is still blocked, so the log names the blocking call. When the loop recovers,
+  the total stall time is logged and counted.
+
+Each of these runs about ten times a second and does very little work.
+"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from app.config import env_float
+from app.core.logs import get_logger
+
+log = get_logger(__name__)
+
+WINDOW = 600  # lag samples kept (one minute at the default interval)
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25):
+        self.interval = interval
+        self.threshold = threshold
+        self._loop = None
+        self._loop_thread = None
+        self._task = None
+        self._sentinel = None
+        self._stop = threading.Event()
+        self._last_beat = time.monotonic()
+        self._lags = deque(maxlen=WINDOW)
+        self._lock = threading.Lock()
+        self._reported_beat = None
+        self.stalls = 0
+        self.stalled_seconds = 0.0
+        self.max_lag = 0.0
+
+    def start(self):
+        """Starts the heartbeat on the running loop and the sentinel thread."""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        self._sentinel = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._sentinel.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - before - self.interval)
+            with self._lock:
+                self._lags.append(lag)
+                self.max_lag = max(self.max_lag, lag)
+                blocked = self._reported_beat is not None or lag >= self.threshold
+                self._reported_beat = None
+                self._last_beat = now
+            if blocked:
+                self.stalls += 1
+                self.stalled_seconds += lag
+                log.warning(f"Event loop was blocked for {lag:.2f}s", extra={"event": "loop.lag", "lag_ms": round(lag * 1000)})
+
+    def _watch(self):
+        while not self._stop.wait(self.interval / 2):
+            with self._lock:
+                stuck = time.monotonic() - self._last_beat - self.interval
+                if stuck < self.threshold or self._reported_beat == self._last_beat:
+                    continue
+                self._reported_beat = self._last_beat
+            frame = sys._current_frames().get(self._loop_thread)
+            # Innermost frame first, so truncation keeps the blocking call.
+            stack = "".join(reversed(traceback.format_stack(frame))) if frame is not None else "(no frame)"
+            log.warning(f"Event loop blocked for {stuck:.2f}s so far; loop thread is at:",
+                        extra={"event": "loop.blocked", "stack": stack})
+
+    def stats(self) -> dict:
+        with self._lock:
+            lags = sorted(self._lags)
+        def pct(p):
+            return round(lags[min(len(lags) - 1, int(p * len(lags)))] * 1000, 1) if lags else None
+        return {
+            "interval_ms": round(self.interval * 1000),
+            "threshold_ms": round(self.threshold * 1000),
+            "lag_ms": round(self._lags[-1] * 1000, 1) if self._lags else None,
+            "lag_p50_ms": pct(0.50),
+            "lag_p99_ms": pct(0.99),
+            "lag_max_ms": round(self.max_lag * 1000, 1),
+            "stalls": self.stalls,
+            "stalled_seconds": round(self.stalled_seconds, 3),
+        }
+
+
+_watchdog = None
+_watchdog_lock = threading.Lock()
+
+
+def get_loop_watchdog() -> LoopWatchdog:
+    global _watchdog
+    if _watchdog is None:
+        with _watchdog_lock:
+            if _watchdog is None:
+                _watchdog = LoopWatchdog(
+                    interval=env_float("LOOP_WATCHDOG_INTERVAL_MS", 100) / 1000,
+                    threshold=env_float("LOOP_LAG_THRESHOLD_MS", 250) / 1000,
+                )
+    return _watchdog
@@ -0,0 +1,421 @@
+"""
+On-demand profiling for live requests and background jobs.
+
+When a job is slow in production, the task timings say which stage took the
+time but not whether it was spent on CPU (base64, JSON parsing, resizing) or
+waiting on a provider. This module lets an admin capture what a running
+process is doing without restarting it:
+
+- A sampling profiler. A capture targets one task id (the job may already be
+  running) or the next N HTTP requests. A background thread reads every
+  thread's stack with `sys._current_frames()` every few milliseconds and keeps
+  the samples that belong to the target. When a tick finds the target neither
+  on the event loop nor on an executor thread, a `<waiting>` sample is counted,
+  so the flamegraph also shows the share of wall time spent awaiting I/O. The
+  result is written in the collapsed-stack format read by `flamegraph.pl`,
+  speedscope and inferno.
+- tracemalloc snapshots and diffs, for example to see what holds memory in
+  the task store.
+
+Attribution works through a context variable set around each job
+(`task_scope`) and each sampled request (`request_scope`). Tasks created inside
+the scope are tagged by a loop task factory. Executor calls (`asyncio.to_thread`,
+`run_in_executor`) are tagged by the default executor while they run. Both are
+installed by `install()` only when the admin surface is enabled, so without it
+the hooks cost one global check. While no capture is armed they cost a
+context-variable read per task or executor call, and the sampler thread only
+runs during a capture.
+"""
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+import weakref
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from app.config import get_env
+from app.core.sqlite import data_path
+from app.core.logs import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_INTERVAL = 0.005
+MAX_SECONDS = 300
+MAX_DEPTH = 128
+# Captures and snapshots kept in memory (the folded files stay on disk).
+KEEP = 20
+WAITING = "<waiting>"
+
+_scope = contextvars.ContextVar("profiling_scope", default=None)
+_installed = False
+_loop = None
+_loop_thread = None
+_task_scopes = weakref.WeakKeyDictionary()   # asyncio task -> scope
+_thread_scopes = {}                          # thread ident -> scope
+_live_tasks = Counter()                      # task ids currently inside task_scope
+_captures = OrderedDict()                    # capture id -> Capture
+_lock = threading.Lock()
+_sampler = None
+
+
+class Capture:
+    def __init__(self, task_id: str = None, requests: int = 0, seconds: float = 30.0,
+                 interval: float = DEFAULT_INTERVAL):
+        self.capture_id = uuid.uuid4().hex[:12]
+        self.task_id = task_id
+        self.requests = requests
+        self.requests_done = 0
+        self.inflight = 0
+        self.interval = interval
+        self.created_at = time.time()
+        self.expires = time.monotonic() + min(seconds, MAX_SECONDS)
+        self.started = False
+        self.ended = None       # reason, once finished
+        self.written = False
+        self.path = None
+        self.stacks = Counter()
+        self.samples = 0
+
+    @property
+    def active(self) -> bool:
+        return self.ended is None
+
+    def add(self, stack: tuple):
+        self.stacks[stack] += 1
+        self.samples += 1
+
+    def finish(self, reason: str):
+        if self.ended is None:
+            self.ended = reason
+
+    def summary(self) -> dict:
+        waiting = self.stacks.get((WAITING,), 0)
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            if stack != (WAITING,):
+                leaves[stack[-1]] += count
+        return {
+            "capture_id": self.capture_id,
+            "task_id": self.task_id,
+            "requests": self.requests,
+            "requests_done": self.requests_done,
+            "status": "done" if self.written else ("finishing" if self.ended else "running"),
+            "ended": self.ended,
+            "samples": self.samples,
+            "interval_ms": round(self.interval * 1000, 2),
+            "waiting_share": round(waiting / self.samples, 3) if self.samples else None,
+            "top_frames": [{"frame": f, "samples": n} for f, n in leaves.most_common(15)],
+            "folded": f"/admin/profile/{self.capture_id}/folded" if self.written else None,
+        }
+
+
+# --- Hooks ----------------------------------------------------------------------
+
+def _task_factory(previous):
+    def factory(loop, coro, **kwargs):
+        task = previous(loop, coro, **kwargs) if previous else asyncio.Task(coro, loop=loop, **kwargs)
+        context = kwargs.get("context")
+        scope = context.get(_scope) if context is not None else _scope.get()
+        if scope is not None:
+            _task_scopes[task] = scope
+        return task
+    return factory
+
+
+class _ScopedExecutor(ThreadPoolExecutor):
+    """Default executor that tags its thread with the caller's scope while a call runs."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        scope = _scope.get()
+        if scope is None:
+            return super().submit(fn, *args, **kwargs)
+
+        def run():
+            ident = threading.get_ident()
+            _thread_scopes[ident] = scope
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _thread_scopes.pop(ident, None)
+        return super().submit(run)
+
+
+def install(loop: asyncio.AbstractEventLoop):
+    """Enables the profiling hooks on `loop` (called from the lifespan when the admin surface is on)."""
+    global _installed, _loop, _loop_thread
+    if _installed and _loop is loop:
+        return
+    _loop = loop
+    _loop_thread = threading.get_ident()
+    loop.set_task_factory(_task_factory(loop.get_task_factory()))
+    loop.set_default_executor(_ScopedExecutor(thread_name_prefix="asyncio"))
+    _installed = True
+
+
+@contextmanager
+def task_scope(task_id: str):
+    """Marks the current asyncio task (and what it spawns) as working on `task_id`."""
+    if not _installed:
+        yield
+        return
+    token = _scope.set(task_id)
+    task = asyncio.current_task()
+    if task is not None:
+        _task_scopes[task] = task_id
+    _live_tasks[task_id] += 1
+    with _lock:
+        for capture in _captures.values():
+            if capture.active and capture.task_id == task_id:
+                capture.started = True
+    try:
+        yield
+    finally:
+        _live_tasks[task_id] -= 1
+        if _live_tasks[task_id] <= 0:
+            del _live_tasks[task_id]
+            with _lock:
+                for capture in _captures.values():
+                    if capture.active and capture.task_id == task_id:
+                        capture.finish("task finished")
+        if task is not None:
+            _task_scopes.pop(task, None)
+        _scope.reset(token)
+
+
+@contextmanager
+def request_scope():
+    """Samples this request if a capture is waiting for requests."""
+    capture = None
+    if _installed and _captures:
+        with _lock:
+            for c in _captures.values():
+                if c.active and c.requests and c.requests_done + c.inflight < c.requests:
+                    capture = c
+                    capture.inflight += 1
+                    capture.started = True
+                    break
+    if capture is None:
+        yield
+        return
+    token = _scope.set(capture)
+    task = asyncio.current_task()
+    if task is not None:
+        _task_scopes[task] = capture
+    try:
+        yield
+    finally:
+        if task is not None:
+            _task_scopes.pop(task, None)
+        _scope.reset(token)
+        with _lock:
+            capture.inflight -= 1
+            capture.requests_done += 1
+            if capture.requests_done >= capture.requests:
+                capture.finish("requests done")
+
+
+# --- Sampler ----------------------------------------------------------------------
+
+def _frame_name(code) -> str:
+    parts = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    return f"{code.co_name} ({'/'.join(parts[-2:])}:{code.co_firstlineno})"
+
+
+def _stack(frame) -> tuple:
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return tuple(reversed(names))
+
+
+def _resolve(scope, by_task: dict):
+    if scope is None:
+        return None
+    if isinstance(scope, Capture):
+        return scope if scope.active else None
+    return by_task.get(scope)
+
+
+def _sample_loop():
+    global _sampler
+    me = threading.get_ident()
+    current_tasks = getattr(asyncio.tasks, "_current_tasks", {})
+    while True:
+        with _lock:
+            now = time.monotonic()
+            for capture in _captures.values():
+                if capture.active and now >= capture.expires:
+                    capture.finish("time limit")
+            pending = [c for c in _captures.values() if not c.written]
+            running = [c for c in pending if c.active]
+            if not running and all(c.ended for c in pending):
+                for capture in pending:
+                    _write(capture)
+                _sampler = None
+                return
+        for capture in pending:
+            if capture.ended:
+                _write(capture)
+        by_task = {c.task_id: c for c in running if c.task_id}
+        if running:
+            if any(c.task_id in _live_tasks for c in running if c.task_id):
+                for capture in running:
+                    if capture.task_id in _live_tasks:
+                        capture.started = True
+            hit = set()
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident == _loop_thread:
+                    task = current_tasks.get(_loop)
+                    scope = _task_scopes.get(task) if task is not None else None
+                else:
+                    scope = _thread_scopes.get(ident)
+                capture = _resolve(scope, by_task)
+                if capture is not None:
+                    capture.add(_stack(frame))
+                    hit.add(capture.capture_id)
+            for capture in running:
+                busy = capture.inflight if capture.requests else capture.task_id in _live_tasks
+                if capture.started and busy and capture.capture_id not in hit:
+                    capture.add((WAITING,))
+        time.sleep(min((c.interval for c in running), default=DEFAULT_INTERVAL))
+
+
+def _write(capture: Capture):
+    if capture.written:
+        return
+    directory = get_env("PROFILE_DIR") or data_path("profiles")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{capture.capture_id}.folded")
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in capture.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+        capture.path = path
+    except OSError as e:
+        log.warning(f"Could not write profile {capture.capture_id}: {e}")
+    capture.written = True
+    log.info(f"Profile {capture.capture_id} finished ({capture.ended}, {capture.samples} samples)")
+
+
+def start_capture(task_id: str = None, requests: int = 0, seconds: float = 30.0,
+                  interval: float = DEFAULT_INTERVAL) -> Capture:
+    """Arms a capture for `task_id` or for the next `requests` HTTP requests."""
+    global _sampler
+    if not _installed:
+        raise RuntimeError("Profiling hooks are not installed")
+    if not task_id and requests <= 0:
+        raise ValueError("Give a task_id or a number of requests")
+    capture = Capture(task_id=task_id, requests=requests, seconds=seconds, interval=max(0.001, interval))
+    with _lock:
+        if task_id and task_id in _live_tasks:
+            capture.started = True
+        _captures[capture.capture_id] = capture
+        while len(_captures) > KEEP:
+            _captures.popitem(last=False)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_loop, name="profiler", daemon=True)
+            _sampler.start()
+    return capture
+
+
+def stop_capture(capture_id: str) -> Capture:
+    capture = _captures.get(capture_id)
+    if capture is not None:
+        capture.finish("stopped")
+    return capture
+
+
+def get_capture(capture_id: str) -> Capture:
+    return _captures.get(capture_id)
+
+
+def list_captures() -> list:
+    return [c.summary() for c in reversed(_captures.values())]
+
+
+# --- Memory -----------------------------------------------------------------------
+
+_snapshots = OrderedDict()   # snapshot id -> (taken_at, Snapshot)
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def _filtered(snapshot, pattern: str = None):
+    if pattern:
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(True, f"*{pattern}*", all_frames=True),))
+    return snapshot
+
+
+def _stat(stat, diff: bool) -> dict:
+    # Most recent frame first.
+    entry = {"where": [f"{frame.filename}:{frame.lineno}" for frame in reversed(stat.traceback)][:5],
+             "size_kib": round(stat.size / 1024, 1), "count": stat.count}
+    if diff:
+        entry["size_diff_kib"] = round(stat.size_diff / 1024, 1)
+        entry["count_diff"] = stat.count_diff
+    return entry
+
+
+def memory_snapshot(group_by: str = "lineno", limit: int = 20, pattern: str = None, frames: int = 25) -> dict:
+    """
+    Takes a tracemalloc snapshot, starting tracing first if needed (the first
+    snapshot only sees allocations made from then on). `pattern` keeps traces
+    with a frame in matching files, e.g. "task_store".
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(frames)
+    snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+    snapshot_id = uuid.uuid4().hex[:12]
+    _snapshots[snapshot_id] = (time.time(), snapshot)
+    while len(_snapshots) > KEEP:
+        _snapshots.popitem(last=False)
+    current, peak = tracemalloc.get_traced_memory()
+    stats = _filtered(snapshot, pattern).statistics(group_by)
+    return {
+        "snapshot_id": snapshot_id,
+        "tracing_started": started,
+        "traced_kib": round(current / 1024, 1),
+        "peak_kib": round(peak / 1024, 1),
+        "top": [_stat(s, False) for s in stats[:limit]],
+    }
+
+
+def memory_diff(base_id: str, target_id: str = None, group_by: str = "lineno", limit: int = 20,
+                pattern: str = None) -> dict:
+    """What grew between two snapshots (the target defaults to a fresh one)."""
+    if base_id not in _snapshots:
+        raise KeyError(base_id)
+    if target_id is None:
+        target_id = memory_snapshot(limit=0)["snapshot_id"]
+    if target_id not in _snapshots:
+        raise KeyError(target_id)
+    base = _filtered(_snapshots[base_id][1], pattern)
+    target = _filtered(_snapshots[target_id][1], pattern)
+    stats = target.compare_to(base, group_by)
+    return {
+        "base": base_id,
+        "target": target_id,
+        "seconds": round(_snapshots[target_id][0] - _snapshots[base_id][0], 1),
+        "size_diff_kib": round(sum(s.size_diff for s in stats) / 1024, 1),
+        "top": [_stat(s, True) for s in stats[:limit]],
+    }
+
+
+def memory_stop():
+    """Stops tracing and drops the snapshots (tracemalloc slows every allocation while on)."""
+    _snapshots.clear()
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
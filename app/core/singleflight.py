@@ -0,0 +1,169 @@
+"""
+Single-flight coalescing for identical generations.
+
+When a table of friends uploads the same menu, or someone double-clicks
+Generate, every submission used to start its own OCR -> enrich -> image
+pipeline. Submissions are now reduced to a canonical key (image hash or
+normalized words, plus style, theme and provider). The first submission for a
+key becomes the *leader* and runs the pipeline; later identical submissions
+become *followers* of the in-flight leader.
+
+Followers still get their own `task_id`. Their task record only points at the
+leader (`coalesced_with`), and `/status` serves the leader's progress under the
+follower's id, so every caller sees every stage and the shared result.
+
+Flights are kept in SQLite (next to the job queue) so coalescing works across
+all workers on the host. A flight ends when its leader finishes, fails or is
+abandoned; later submissions with the same key start a fresh pipeline.
+"""
+import hashlib
+import json
+import threading
+import time
+
+from app.config import get_env, env_int
+from app.core.sqlite import ThreadLocalConnections, data_path, transaction
+from app.core.fuzzy import fold
+
+# A leader that hasn't landed after this long is assumed stuck and stops attracting followers.
+DEFAULT_FLIGHT_TTL_SECONDS = 15 * 60
+
+
+def _normalize_words(words) -> list:
+    # fold() makes "Hazy I.P.A" and "hazy ipa" the same submission.
+    if isinstance(words, dict):
+        return sorted(
+            (str(category), sorted({fold(w) for w in items if fold(w)}))
+            for category, items in words.items() if isinstance(items, list)
+        )
+    return sorted({fold(w) for w in (words or []) if fold(w)})
+
+
+def canonical_key(kind: str, style: str = "", theme: str = "", model_provider: str = "",
+                  image_bytes: bytes = None, words=None, extra: str = None) -> str:
+    """Hashes the inputs that determine a pipeline's result into a flight key."""
+    h = hashlib.sha256()
+    h.update(json.dumps([kind, style or "", (theme or "").strip().lower(), model_provider or ""]).encode())
+    if image_bytes is not None:
+        h.update(b"image:")
+        h.update(hashlib.sha256(image_bytes).digest())
+    if words is not None:
+        h.update(b"words:")
+        h.update(json.dumps(_normalize_words(words)).encode())
+    if extra is not None:
+        h.update(b"extra:")
+        h.update(hashlib.sha256(extra.encode()).digest())
+    return h.hexdigest()
+
+
+class FlightRegistry:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS flights (
+        flight_key TEXT PRIMARY KEY,
+        leader_id TEXT NOT NULL,
+        followers INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_flights_leader ON flights(leader_id);
+    CREATE TABLE IF NOT EXISTS flight_stats (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    """
+
+    def __init__(self, path: str, ttl_seconds: int = DEFAULT_FLIGHT_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._conns = ThreadLocalConnections(path, self.SCHEMA)
+
+    @staticmethod
+    def _bump(conn, name: str, by: int = 1):
+        conn.execute(
+            "INSERT INTO flight_stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, by),
+        )
+
+    def join_or_lead(self, flight_key: str, task_id: str):
+        """
+        Atomically either registers `task_id` as the leader for `flight_key`
+        (returns None) or attaches it to the in-flight leader (returns leader_id).
+        """
+        now = time.time()
+        conn = self._conns.get()
+        with transaction(conn):
+            row = conn.execute(
+                "SELECT leader_id, created_at FROM flights WHERE flight_key = ?", (flight_key,)
+            ).fetchone()
+            if row is not None and now - row["created_at"] < self.ttl_seconds:
+                conn.execute("UPDATE flights SET followers = followers + 1 WHERE flight_key = ?", (flight_key,))
+                self._bump(conn, "followers")
+                return row["leader_id"]
+            conn.execute(
+                "INSERT OR REPLACE INTO flights (flight_key, leader_id, followers, created_at) VALUES (?, ?, 0, ?)",
+                (flight_key, task_id, now),
+            )
+            self._bump(conn, "leaders")
+            return None
+
+    def land(self, leader_id: str) -> int:
+        """Ends the leader's flight. Returns how many followers shared it."""
+        conn = self._conns.get()
+        with transaction(conn):
+            row = conn.execute("SELECT followers FROM flights WHERE leader_id = ?", (leader_id,)).fetchone()
+            if row is None:
+                return 0
+            conn.execute("DELETE FROM flights WHERE leader_id = ?", (leader_id,))
+            return row["followers"]
+
+    def followers(self, leader_id: str) -> int:
+        """How many followers are still attached to the leader's flight."""
+        row = self._conns.get().execute("SELECT followers FROM flights WHERE leader_id = ?", (leader_id,)).fetchone()
+        return row["followers"] if row else 0
+
+    def leave(self, leader_id: str):
+        """Detaches one follower (it was cancelled) from the leader's flight."""
+        self._conns.get().execute(
+            "UPDATE flights SET followers = MAX(followers - 1, 0) WHERE leader_id = ?", (leader_id,)
+        )
+
+    def stats(self) -> dict:
+        conn = self._conns.get()
+        totals = {r["name"]: r["value"] for r in conn.execute("SELECT name, value FROM flight_stats")}
+        in_flight = conn.execute(
+            "SELECT COUNT(*) AS n, COALESCE(SUM(followers), 0) AS f FROM flights WHERE created_at > ?",
+            (time.time() - self.ttl_seconds,),
+        ).fetchone()
+        leaders = totals.get("leaders", 0)
+        followers = totals.get("followers", 0)
+        return {
+            "leaders": leaders,
+            "followers": followers,
+            "coalesced_ratio": round(followers / (leaders + followers), 4) if leaders + followers else 0.0,
+            "in_flight": in_flight["n"],
+            "in_flight_followers": in_flight["f"],
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_flight_registry() -> FlightRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = FlightRegistry(
+                    get_env("SINGLEFLIGHT_PATH") or data_path("singleflight.db"),
+                    ttl_seconds=env_int("SINGLEFLIGHT_TTL_SECONDS", DEFAULT_FLIGHT_TTL_SECONDS),
+                )
+    return _registry
+
+
+def resolve_status(record: dict, leader_record: dict, task_id: str) -> dict:
+    """The status a follower sees: the leader's record under the follower's own id."""
+    mirrored = dict(leader_record)
+    mirrored["task_id"] = task_id
+    mirrored["coalesced_with"] = record["coalesced_with"]
+    return mirrored
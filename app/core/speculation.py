@@ -0,0 +1,237 @@
+"""
+State for speculative Untappd pre-generation.
+
+The slow part of `/generate_untappd` is fetching the feed, categorizing it
+(`clean_words_with_llm`) and enriching the prompt. All of it depends only on
+the friends feed, which changes when someone checks in. Users who opt in
+(`POST /speculation`) leave their Untappd token and favourite styles here. The
+pipeline's `SpeculationScheduler` then refreshes their feeds in the background
+when the workers have spare capacity:
+
+- `subscribers` holds one row per session: the token, the styles, and the hash
+  of the last feed seen (`feed_hash`). `checked_at` is when that feed was
+  last confirmed, and `next_check` is when to look again. `claim_due` moves
+  `next_check` forward in the same transaction that selects the row, so two
+  processes never refresh the same user. `last_seen` is when the session last
+  used Untappd generation or `/speculation`. Subscribers idle for longer than
+  the idle TTL are no longer refreshed, and `prune_idle` deletes them with
+  their results.
+- `results` holds the precomputed words, venue description, prompt and
+  optionally a draft, per (session, style). Each row records the feed hash it
+  was computed from.
+- `budget` counts the LLM and image calls spent on speculation per UTC day.
+  `try_spend` reserves a refresh's calls all at once, or none if that would
+  pass the cap.
+
+A precomputed result is only used while it matches the latest feed hash and
+that feed was confirmed within `max_age`. Anything older counts as stale and
+the generation runs normally.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from app.config import get_env
+from app.core.sqlite import ThreadLocalConnections, data_path, transaction
+
+
+def _today() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+class SpeculationStore:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS subscribers (
+        owner TEXT PRIMARY KEY,
+        token TEXT NOT NULL,
+        styles TEXT NOT NULL,
+        model_provider TEXT NOT NULL,
+        drafts INTEGER NOT NULL DEFAULT 0,
+        feed_hash TEXT,
+        checked_at REAL,
+        next_check REAL NOT NULL,
+        created_at REAL NOT NULL,
+        last_seen REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_subscribers_due ON subscribers(next_check);
+    CREATE TABLE IF NOT EXISTS results (
+        owner TEXT NOT NULL,
+        style TEXT NOT NULL,
+        feed_hash TEXT NOT NULL,
+        model_provider TEXT NOT NULL,
+        result TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (owner, style)
+    );
+    CREATE TABLE IF NOT EXISTS budget (
+        day TEXT PRIMARY KEY,
+        spent INTEGER NOT NULL
+    );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conns = ThreadLocalConnections(path, self.SCHEMA)
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "stale": 0, "misses": 0}
+        self._migrate()
+
+    def _conn(self):
+        return self._conns.get()
+
+    def _migrate(self):
+        """Adds `last_seen` to a store created by an earlier version (existing rows count from `created_at`)."""
+        conn = self._conn()
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(subscribers)")}
+        if "last_seen" not in columns:
+            try:
+                conn.execute("ALTER TABLE subscribers ADD COLUMN last_seen REAL")
+            except sqlite3.OperationalError:
+                pass  # Another process added it first
+        conn.execute("UPDATE subscribers SET last_seen = created_at WHERE last_seen IS NULL")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_subscribers_seen ON subscribers(last_seen)")
+
+    def subscribe(self, owner: str, token: str, styles: list, model_provider: str, drafts: bool = False):
+        """Opts a session in (or updates its token and styles). Its first refresh is due at once."""
+        now = time.time()
+        conn = self._conn()
+        with transaction(conn):
+            conn.execute(
+                "INSERT INTO subscribers (owner, token, styles, model_provider, drafts, next_check, created_at, "
+                "last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(owner) DO UPDATE SET token = excluded.token, "
+                "styles = excluded.styles, model_provider = excluded.model_provider, drafts = excluded.drafts, "
+                "next_check = excluded.next_check, last_seen = excluded.last_seen",
+                (owner, token, json.dumps(styles), model_provider, int(drafts), now, now, now),
+            )
+            # Results for styles no longer wanted are dropped.
+            conn.execute(f"DELETE FROM results WHERE owner = ? AND style NOT IN ({','.join('?' * len(styles))})",
+                         (owner, *styles))
+
+    def unsubscribe(self, owner: str) -> bool:
+        """Forgets the session's token and everything computed for it."""
+        conn = self._conn()
+        with transaction(conn):
+            cur = conn.execute("DELETE FROM subscribers WHERE owner = ?", (owner,))
+            conn.execute("DELETE FROM results WHERE owner = ?", (owner,))
+        return cur.rowcount > 0
+
+    def touch(self, owner: str):
+        """Records that the session is still around (no-op for sessions that aren't subscribed)."""
+        self._conn().execute("UPDATE subscribers SET last_seen = ? WHERE owner = ?", (time.time(), owner))
+
+    def prune_idle(self, idle_ttl: float) -> int:
+        """Deletes subscribers idle for longer than `idle_ttl`, with their results. Returns how many."""
+        cutoff = time.time() - idle_ttl
+        conn = self._conn()
+        with transaction(conn):
+            conn.execute("DELETE FROM results WHERE owner IN (SELECT owner FROM subscribers WHERE last_seen < ?)",
+                         (cutoff,))
+            cur = conn.execute("DELETE FROM subscribers WHERE last_seen < ?", (cutoff,))
+        return cur.rowcount
+
+    def subscriber(self, owner: str) -> dict:
+        row = self._conn().execute("SELECT * FROM subscribers WHERE owner = ?", (owner,)).fetchone()
+        if row is None:
+            return None
+        sub = dict(row)
+        sub["styles"] = json.loads(sub["styles"])
+        sub["drafts"] = bool(sub["drafts"])
+        return sub
+
+    def claim_due(self, limit: int, interval: float, idle_ttl: float = None) -> list:
+        """
+        Owners whose refresh is due, at most `limit`; their next check moves
+        `interval` ahead. Owners not seen within `idle_ttl` are skipped.
+        """
+        now = time.time()
+        seen_after = now - idle_ttl if idle_ttl else 0
+        conn = self._conn()
+        with transaction(conn):
+            rows = conn.execute(
+                "SELECT owner FROM subscribers WHERE next_check <= ? AND last_seen >= ? ORDER BY next_check LIMIT ?",
+                (now, seen_after, limit),
+            ).fetchall()
+            owners = [row["owner"] for row in rows]
+            conn.executemany("UPDATE subscribers SET next_check = ? WHERE owner = ?",
+                             [(now + interval, owner) for owner in owners])
+        return owners
+
+    def mark_checked(self, owner: str, feed_hash: str):
+        """Records the feed just seen for `owner`."""
+        self._conn().execute("UPDATE subscribers SET feed_hash = ?, checked_at = ? WHERE owner = ?",
+                             (feed_hash, time.time(), owner))
+
+    def put_result(self, owner: str, style: str, feed_hash: str, model_provider: str, result: dict):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO results (owner, style, feed_hash, model_provider, result, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (owner, style, feed_hash, model_provider, json.dumps(result), time.time()),
+        )
+
+    def current_styles(self, owner: str, feed_hash: str) -> set:
+        """The styles whose result was computed from `feed_hash`."""
+        rows = self._conn().execute("SELECT style FROM results WHERE owner = ? AND feed_hash = ?",
+                                    (owner, feed_hash)).fetchall()
+        return {row["style"] for row in rows}
+
+    def fresh(self, owner: str, style: str, model_provider: str, max_age: float) -> dict:
+        """
+        The precomputed result for `owner` and `style` if it is still current, else None.
+        A draft rendered by another provider is left out.
+        """
+        row = self._conn().execute(
+            "SELECT r.result, r.model_provider, r.feed_hash = s.feed_hash AS current, s.checked_at "
+            "FROM results r JOIN subscribers s ON s.owner = r.owner WHERE r.owner = ? AND r.style = ?",
+            (owner, style),
+        ).fetchone()
+        if row is None:
+            outcome, result = "misses", None
+        elif not row["current"] or (row["checked_at"] or 0) < time.time() - max_age:
+            outcome, result = "stale", None
+        else:
+            outcome, result = "hits", json.loads(row["result"])
+            if row["model_provider"] != model_provider:
+                result.pop("draft", None)
+        with self._stats_lock:
+            self._stats[outcome] += 1
+        return result
+
+    def try_spend(self, units: int, daily_cap: int) -> bool:
+        """Reserves `units` calls from today's budget; False (and nothing spent) if they don't fit."""
+        day = _today()
+        conn = self._conn()
+        with transaction(conn):
+            row = conn.execute("SELECT spent FROM budget WHERE day = ?", (day,)).fetchone()
+            spent = row["spent"] if row else 0
+            if spent + units > daily_cap:
+                return False
+            conn.execute("INSERT OR REPLACE INTO budget (day, spent) VALUES (?, ?)", (day, spent + units))
+        return True
+
+    def spent_today(self) -> int:
+        row = self._conn().execute("SELECT spent FROM budget WHERE day = ?", (_today(),)).fetchone()
+        return row["spent"] if row else 0
+
+    def stats(self) -> dict:
+        """Lookups by `/generate_untappd` in this process, plus the stored subscribers and results."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        conn = self._conn()
+        stats["subscribers"] = conn.execute("SELECT COUNT(*) FROM subscribers").fetchone()[0]
+        stats["results"] = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        stats["spent_today"] = self.spent_today()
+        return stats
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_speculation_store() -> SpeculationStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SpeculationStore(get_env("SPECULATION_DB_PATH") or data_path("speculation.db"))
+    return _store
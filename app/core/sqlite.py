@@ -0,0 +1,108 @@
+"""
+Small helpers for the SQLite databases the app keeps on local disk.
+
+Every store opens one connection per thread (sqlite3 connections must not be
+shared across threads) in WAL mode, so several uvicorn workers on the same host
+can read while one of them writes.
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+
+from app.config import get_env
+from app.core.logs import get_logger
+
+log = get_logger(__name__)
+
+
+_data_dir = None
+
+
+def _writable(directory: str) -> bool:
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        return False
+    return os.access(directory, os.W_OK)
+
+
+def data_dir() -> str:
+    """
+    DATA_DIR, created if needed. Without DATA_DIR, `data/` in the working
+    directory, or `<tmp>/wordcloud` where that isn't writable (read-only
+    serverless file systems, where the databases then only last as long as
+    the instance).
+    """
+    global _data_dir
+    if _data_dir is None:
+        configured = get_env("DATA_DIR")
+        if configured:
+            os.makedirs(configured, exist_ok=True)
+            _data_dir = configured
+        elif _writable("data"):
+            _data_dir = "data"
+        else:
+            _data_dir = os.path.join(tempfile.gettempdir(), "wordcloud")
+            os.makedirs(_data_dir, exist_ok=True)
+            log.warning(f"Working directory is read-only; keeping databases in {_data_dir}")
+    return _data_dir
+
+
+def data_path(filename: str) -> str:
+    """Resolves `filename` inside the data directory (see `data_dir()`)."""
+    return os.path.join(data_dir(), filename)
+
+
+def connect(path: str, timeout: float = 10.0) -> sqlite3.Connection:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # isolation_level=None: we issue BEGIN IMMEDIATE ourselves where atomicity matters.
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(timeout * 1000)}")
+    return conn
+
+
+class ThreadLocalConnections:
+    """Hands out one connection per thread for a database file, running `schema` on first open."""
+
+    def __init__(self, path: str, schema: str = ""):
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.path)
+            if self.schema and not self._schema_ready:
+                with self._schema_lock:
+                    if not self._schema_ready:
+                        conn.executescript(self.schema)
+                        self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+
+class transaction:
+    """`with transaction(conn):` runs the block inside BEGIN IMMEDIATE ... COMMIT/ROLLBACK."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
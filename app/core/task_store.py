@@ -0,0 +1,364 @@
+"""
+Shared task-state backends.
+
+`/status/{task_id}` and `/resume_task` must see the same task record no matter
+which uvicorn worker (or instance) serves the poll, so task records live behind
+a `TaskStore` instead of a per-process dict.
+
+Every record carries a `version` that increases on each write. Writers never
+blindly overwrite: `update()` merges fields with a compare-and-set retry loop and
+`transition()` only moves a task out of an expected status, so two workers can't
+both resume the same task or clobber each other's progress.
+
+Backends (selected with TASK_STORE):
+- `memory`  single process only (the default, same behaviour as before)
+- `sqlite`  WAL database file shared by all workers on one host (TASK_STORE_PATH)
+- `redis`   any Redis-protocol server shared by all instances (REDIS_URL)
+"""
+import asyncio
+import json
+import threading
+import time
+
+from app.config import get_env, env_int
+from app.core.sqlite import ThreadLocalConnections, data_path
+from app.core.logs import get_logger
+
+log = get_logger(__name__)
+
+# Records untouched for this long are dropped by prune() / Redis expiry.
+DEFAULT_TTL_SECONDS = 24 * 3600
+
+# How many times update()/transition() retry after losing a version race.
+MAX_CAS_RETRIES = 50
+
+# create() prunes expired records at most this often.
+PRUNE_INTERVAL_SECONDS = 300
+
+
+class TaskNotFound(KeyError):
+    pass
+
+
+class TaskStore:
+    """
+    Base class: backends implement `_read`, `_insert` and `_cas`; the merge,
+    transition and retry logic is shared.
+    """
+
+    # True when calls do network or disk I/O and should be kept off the event loop.
+    blocking = False
+
+    def __init__(self, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._next_prune = 0.0
+
+    # --- backend primitives -------------------------------------------------
+
+    def _read(self, task_id: str):
+        """Returns `(record, version)` or `(None, 0)`."""
+        raise NotImplementedError
+
+    def _insert(self, task_id: str, record: dict) -> bool:
+        """Stores a new record with version 1. Returns False if the id already exists."""
+        raise NotImplementedError
+
+    def _cas(self, task_id: str, expected_version: int, record: dict) -> bool:
+        """Replaces the record only if it is still at `expected_version`."""
+        raise NotImplementedError
+
+    def delete(self, task_id: str):
+        raise NotImplementedError
+
+    def prune(self, older_than: float = None) -> int:
+        """Deletes records untouched since `older_than` (default: the TTL). Redis expires keys itself."""
+        return 0
+
+    def _maybe_prune(self):
+        """Called on create(): prunes at most every PRUNE_INTERVAL_SECONDS, so records can't pile up."""
+        now = time.time()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + PRUNE_INTERVAL_SECONDS
+        try:
+            pruned = self.prune()
+        except Exception as e:
+            log.warning(f"Could not prune task records: {type(e).__name__}: {e}")
+            return
+        if pruned:
+            log.info(f"Pruned {pruned} expired task record(s)")
+
+    # --- public API ---------------------------------------------------------
+
+    def get(self, task_id: str):
+        record, _ = self._read(task_id)
+        return record
+
+    def create(self, task_id: str, record: dict) -> dict:
+        self._maybe_prune()
+        record = self._stamp(dict(record), 1)
+        if not self._insert(task_id, record):
+            raise ValueError(f"Task {task_id} already exists")
+        return record
+
+    def update(self, task_id: str, **fields) -> dict:
+        """Merges `fields` into the record atomically and returns the new record."""
+        return self._modify(task_id, lambda current: {**current, **fields})
+
+    def put(self, task_id: str, record: dict) -> dict:
+        """Replaces the whole record (still versioned, so concurrent writers are detected and retried)."""
+        return self._modify(task_id, lambda current: dict(record), create=True)
+
+    def transition(self, task_id: str, from_status, to_status: str, **fields):
+        """
+        Moves the task to `to_status` only if its current status is one of
+        `from_status`. Returns the new record, or None if the task was in
+        another status (someone else got there first).
+        """
+        allowed = (from_status,) if isinstance(from_status, str) else tuple(from_status)
+        for _ in range(MAX_CAS_RETRIES):
+            current, version = self._read(task_id)
+            if current is None:
+                raise TaskNotFound(task_id)
+            if current.get("status") not in allowed:
+                return None
+            new_record = self._stamp({**current, **fields, "status": to_status}, version + 1)
+            if self._cas(task_id, version, new_record):
+                return new_record
+        raise RuntimeError(f"Task {task_id}: too much contention on transition")
+
+    def _modify(self, task_id: str, change, create: bool = False) -> dict:
+        for _ in range(MAX_CAS_RETRIES):
+            current, version = self._read(task_id)
+            if current is None:
+                if not create:
+                    raise TaskNotFound(task_id)
+                record = self._stamp(change({}), 1)
+                if self._insert(task_id, record):
+                    return record
+                continue
+            new_record = self._stamp(change(current), version + 1)
+            if self._cas(task_id, version, new_record):
+                return new_record
+        raise RuntimeError(f"Task {task_id}: too much contention on update")
+
+    @staticmethod
+    def _stamp(record: dict, version: int) -> dict:
+        record["version"] = version
+        record["updated_at"] = time.time()
+        return record
+
+    # --- async helpers (keep blocking backends off the event loop) ---------
+
+    async def _acall(self, fn, *args, **kwargs):
+        if self.blocking:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    async def aget(self, task_id: str):
+        return await self._acall(self.get, task_id)
+
+    async def acreate(self, task_id: str, record: dict) -> dict:
+        return await self._acall(self.create, task_id, record)
+
+    async def aupdate(self, task_id: str, **fields) -> dict:
+        return await self._acall(self.update, task_id, **fields)
+
+    async def aput(self, task_id: str, record: dict) -> dict:
+        return await self._acall(self.put, task_id, record)
+
+    async def atransition(self, task_id: str, from_status, to_status: str, **fields):
+        return await self._acall(self.transition, task_id, from_status, to_status, **fields)
+
+
+class MemoryTaskStore(TaskStore):
+    """Per-process dict. Only correct with a single worker."""
+
+    def __init__(self, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def _read(self, task_id):
+        with self._lock:
+            record = self._records.get(task_id)
+            if record is None:
+                return None, 0
+            return dict(record), record["version"]
+
+    def _insert(self, task_id, record):
+        with self._lock:
+            if task_id in self._records:
+                return False
+            self._records[task_id] = dict(record)
+            return True
+
+    def _cas(self, task_id, expected_version, record):
+        with self._lock:
+            current = self._records.get(task_id)
+            if current is None or current["version"] != expected_version:
+                return False
+            self._records[task_id] = dict(record)
+            return True
+
+    def delete(self, task_id):
+        with self._lock:
+            self._records.pop(task_id, None)
+
+    def prune(self, older_than: float = None) -> int:
+        cutoff = older_than if older_than is not None else time.time() - self.ttl_seconds
+        with self._lock:
+            stale = [k for k, r in self._records.items() if r.get("updated_at", 0) < cutoff]
+            for k in stale:
+                del self._records[k]
+        return len(stale)
+
+    def __len__(self):
+        return len(self._records)
+
+
+class SqliteTaskStore(TaskStore):
+    """WAL-mode SQLite file shared by every worker process on the host."""
+
+    blocking = True
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tasks (
+        task_id TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        record TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_tasks_updated_at ON tasks(updated_at);
+    """
+
+    def __init__(self, path: str, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        self.path = path
+        self._conns = ThreadLocalConnections(path, self.SCHEMA)
+
+    def _read(self, task_id):
+        row = self._conns.get().execute(
+            "SELECT version, record FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        if row is None:
+            return None, 0
+        return json.loads(row["record"]), row["version"]
+
+    def _insert(self, task_id, record):
+        cur = self._conns.get().execute(
+            "INSERT OR IGNORE INTO tasks (task_id, version, record, updated_at) VALUES (?, ?, ?, ?)",
+            (task_id, record["version"], json.dumps(record), record["updated_at"]),
+        )
+        return cur.rowcount == 1
+
+    def _cas(self, task_id, expected_version, record):
+        # A single UPDATE ... WHERE version = ? is atomic in SQLite, no explicit transaction needed.
+        cur = self._conns.get().execute(
+            "UPDATE tasks SET version = ?, record = ?, updated_at = ? WHERE task_id = ? AND version = ?",
+            (record["version"], json.dumps(record), record["updated_at"], task_id, expected_version),
+        )
+        return cur.rowcount == 1
+
+    def delete(self, task_id):
+        self._conns.get().execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+
+    def prune(self, older_than: float = None) -> int:
+        cutoff = older_than if older_than is not None else time.time() - self.ttl_seconds
+        cur = self._conns.get().execute("DELETE FROM tasks WHERE updated_at < ?", (cutoff,))
+        return cur.rowcount
+
+
+class RedisTaskStore(TaskStore):
+    """
+    One JSON string per task (the record, including its version). New records
+    use `SET NX`; updates use WATCH/MULTI so a write only lands if nobody else
+    wrote the key in between.
+
+    Works with any client exposing redis-py's API, so tests can pass a local
+    stand-in such as `fakeredis.FakeRedis()` instead of a real server.
+    """
+
+    blocking = True
+
+    def __init__(self, client=None, url: str = None, prefix: str = "wordcloud:task:",
+                 ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("TASK_STORE=redis requires the 'redis' package (pip install redis).")
+            client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, task_id):
+        return f"{self.prefix}{task_id}"
+
+    @staticmethod
+    def _parse(raw):
+        if raw is None:
+            return None, 0
+        record = json.loads(raw)
+        return record, record["version"]
+
+    def _read(self, task_id):
+        return self._parse(self.client.get(self._key(task_id)))
+
+    def _insert(self, task_id, record):
+        return bool(self.client.set(self._key(task_id), json.dumps(record), nx=True, ex=self.ttl_seconds))
+
+    def _cas(self, task_id, expected_version, record):
+        key = self._key(task_id)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                _, version = self._parse(pipe.get(key))
+                if version != expected_version:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.set(key, json.dumps(record), ex=self.ttl_seconds)
+                pipe.execute()
+                return True
+            except Exception as e:
+                # redis.WatchError: somebody else wrote first; let the caller retry.
+                if type(e).__name__ == "WatchError":
+                    return False
+                raise
+
+    def delete(self, task_id):
+        self.client.delete(self._key(task_id))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def create_task_store(backend: str = None) -> TaskStore:
+    backend = (backend or get_env("TASK_STORE", "memory")).strip().lower()
+    ttl = env_int("TASK_TTL_SECONDS", DEFAULT_TTL_SECONDS)
+    if backend == "sqlite":
+        return SqliteTaskStore(get_env("TASK_STORE_PATH") or data_path("tasks.db"), ttl_seconds=ttl)
+    if backend == "redis":
+        return RedisTaskStore(url=get_env("REDIS_URL"), ttl_seconds=ttl)
+    if backend != "memory":
+        log.warning(f"Unknown TASK_STORE={backend!r}, falling back to in-memory tasks.")
+    return MemoryTaskStore(ttl_seconds=ttl)
+
+
+def get_task_store() -> TaskStore:
+    """Process-wide task store, created from the environment on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_task_store()
+    return _store
+
+
+def set_task_store(store: TaskStore):
+    """Swaps the process-wide store (tests, or an app factory with explicit config)."""
+    global _store
+    _store = store
@@ -0,0 +1,117 @@
+"""
+Persistent cache of venue vibes.
+
+`describe_venue` asked GPT-4o to imagine a venue's atmosphere on every
+generation. Our users drink at the same few hundred places, so the answers are
+effectively static. Descriptions are now kept in SQLite and reused for
+VENUE_CACHE_TTL_DAYS (90 by default). They are keyed by the venue's name and
+city, normalized with `fuzzy.fold` (`venue_key`), so "The Old Fox, London" and
+"the old  fox / london" share an entry, while two "Brewery Tap"s in different
+cities don't.
+
+Looking up and storing work on batches: `beercloud.describe_venues` reads every
+venue it needs in one query and describes all the misses in a single LLM call.
+"""
+import threading
+import time
+
+from app.config import get_env, env_float
+from app.core.fuzzy import fold
+from app.core.sqlite import ThreadLocalConnections, data_path, transaction
+
+DEFAULT_TTL_DAYS = 90
+
+
+def venue_key(name: str, city: str = None) -> str:
+    return f"{fold(name)}|{fold(city or '')}"
+
+
+class VenueCache:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS venues (
+        venue_key TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        city TEXT,
+        description TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_venues_created ON venues(created_at);
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = DEFAULT_TTL_DAYS * 86400):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._conns = ThreadLocalConnections(path, self.SCHEMA)
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stored": 0}
+
+    def _conn(self):
+        return self._conns.get()
+
+    def get_many(self, keys) -> dict:
+        """key -> description for the keys with a fresh entry."""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        conn = self._conn()
+        placeholders = ",".join("?" * len(keys))
+        rows = conn.execute(
+            f"SELECT venue_key, description FROM venues WHERE venue_key IN ({placeholders}) AND created_at >= ?",
+            (*keys, time.time() - self.ttl_seconds),
+        ).fetchall()
+        found = {row["venue_key"]: row["description"] for row in rows}
+        if found:
+            conn.execute(f"UPDATE venues SET hits = hits + 1 WHERE venue_key IN ({','.join('?' * len(found))})",
+                         tuple(found))
+        with self._stats_lock:
+            self._stats["hits"] += len(found)
+            self._stats["misses"] += len(keys) - len(found)
+        return found
+
+    def put_many(self, entries):
+        """Stores `(name, city, description)` triples; empty descriptions are skipped."""
+        now = time.time()
+        rows = [(venue_key(name, city), name, city, description, now)
+                for name, city, description in entries if description]
+        if not rows:
+            return
+        conn = self._conn()
+        with transaction(conn):
+            conn.executemany(
+                "INSERT INTO venues (venue_key, name, city, description, created_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(venue_key) DO UPDATE SET description = excluded.description, "
+                "created_at = excluded.created_at",
+                rows,
+            )
+        with self._stats_lock:
+            self._stats["stored"] += len(rows)
+
+    def prune(self) -> int:
+        """Deletes expired entries; returns how many."""
+        cur = self._conn().execute("DELETE FROM venues WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        return cur.rowcount
+
+    def stats(self) -> dict:
+        """Hits, misses and stores in this process, plus the number of cached venues."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["entries"] = self._conn().execute("SELECT COUNT(*) FROM venues").fetchone()[0]
+        stats["ttl_days"] = round(self.ttl_seconds / 86400, 1)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_venue_cache() -> VenueCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = VenueCache(
+                    get_env("VENUE_CACHE_DB_PATH") or data_path("venues.db"),
+                    ttl_seconds=env_float("VENUE_CACHE_TTL_DAYS", DEFAULT_TTL_DAYS) * 86400,
+                )
+    return _cache
@@ -0,0 +1,147 @@
+"""
+Stored word profiles.
+
+An imported Untappd export (see app.services.untappd_import) is reduced to the
+most frequent beers, styles, breweries, venues, cities and flavors, with their
+counts. The result is kept here under a `profile_id`, so any later generation
+can use it (`/generate_manual` with `profile_id=...`) without uploading the
+export again. A profile belongs to the session that imported it, and other
+sessions can't read or delete it.
+
+Profiles are deleted when their session logs out, and otherwise expire
+`WORD_PROFILES_TTL_SECONDS` after the import (by default the lifetime of the
+session cookie, after which nobody can reach them).
+"""
+import json
+import threading
+import time
+import uuid
+
+from app.config import get_env, env_int
+from app.core.sqlite import ThreadLocalConnections, data_path, transaction
+from app.core.logs import get_logger
+
+log = get_logger(__name__)
+
+# Profiles older than this are dropped by prune(); matches the session cookie's max_age.
+DEFAULT_TTL_SECONDS = 14 * 24 * 3600
+
+# put() prunes expired profiles at most this often.
+PRUNE_INTERVAL_SECONDS = 300
+
+
+class WordProfileStore:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS profiles (
+        profile_id TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        name TEXT NOT NULL,
+        source TEXT NOT NULL,
+        checkins INTEGER NOT NULL,
+        counts TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_profiles_owner ON profiles(owner, created_at);
+    """
+
+    def __init__(self, path: str, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._next_prune = 0.0
+        self._conns = ThreadLocalConnections(path, self.SCHEMA)
+
+    def _conn(self):
+        return self._conns.get()
+
+    def put(self, owner: str, name: str, source: str, checkins: int, counts: dict) -> str:
+        """Stores a profile (`counts`: field -> [[term, count], ...], most frequent first); returns its id."""
+        self._maybe_prune()
+        profile_id = uuid.uuid4().hex
+        conn = self._conn()
+        with transaction(conn):
+            conn.execute(
+                "INSERT INTO profiles (profile_id, owner, name, source, checkins, counts, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (profile_id, owner, name, source, checkins, json.dumps(counts), time.time()),
+            )
+        return profile_id
+
+    def get(self, profile_id: str, owner: str) -> dict:
+        row = self._conn().execute("SELECT * FROM profiles WHERE profile_id = ? AND owner = ?",
+                                   (profile_id, owner)).fetchone()
+        if row is None:
+            return None
+        profile = self._summary(row)
+        profile["counts"] = json.loads(row["counts"])
+        return profile
+
+    def list(self, owner: str) -> list:
+        rows = self._conn().execute(
+            "SELECT profile_id, name, source, checkins, created_at FROM profiles WHERE owner = ? ORDER BY created_at DESC",
+            (owner,),
+        ).fetchall()
+        return [self._summary(row) for row in rows]
+
+    def delete(self, profile_id: str, owner: str) -> bool:
+        conn = self._conn()
+        with transaction(conn):
+            cur = conn.execute("DELETE FROM profiles WHERE profile_id = ? AND owner = ?", (profile_id, owner))
+        return cur.rowcount > 0
+
+    def delete_owner(self, owner: str) -> int:
+        """Deletes every profile of a session (on logout). Returns how many were removed."""
+        conn = self._conn()
+        with transaction(conn):
+            cur = conn.execute("DELETE FROM profiles WHERE owner = ?", (owner,))
+        return cur.rowcount
+
+    def prune(self, older_than: float = None) -> int:
+        """Deletes profiles imported before `older_than` (default: the TTL; 0 keeps them forever)."""
+        if older_than is None:
+            if not self.ttl_seconds:
+                return 0
+            older_than = time.time() - self.ttl_seconds
+        conn = self._conn()
+        with transaction(conn):
+            cur = conn.execute("DELETE FROM profiles WHERE created_at < ?", (older_than,))
+        return cur.rowcount
+
+    def _maybe_prune(self):
+        """Called on put(): prunes at most every PRUNE_INTERVAL_SECONDS, so profiles can't pile up."""
+        now = time.time()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + PRUNE_INTERVAL_SECONDS
+        try:
+            pruned = self.prune()
+        except Exception as e:
+            log.warning(f"Could not prune word profiles: {type(e).__name__}: {e}")
+            return
+        if pruned:
+            log.info(f"Pruned {pruned} expired word profile(s)")
+
+    @staticmethod
+    def _summary(row) -> dict:
+        return {
+            "profile_id": row["profile_id"],
+            "name": row["name"],
+            "source": row["source"],
+            "checkins": row["checkins"],
+            "created_at": row["created_at"],
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_word_profiles() -> WordProfileStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = WordProfileStore(
+                    get_env("WORD_PROFILES_DB_PATH") or data_path("profiles.db"),
+                    ttl_seconds=env_int("WORD_PROFILES_TTL_SECONDS", DEFAULT_TTL_SECONDS),
+                )
+    return _store
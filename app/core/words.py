@@ -0,0 +1,173 @@
+"""
+Compact word bags.
+
+Words travel through the pipelines either as a plain `list[str]` (manual input,
+the scraper, raw Untappd terms) or as a dict of the six categories produced by
+the LLM cleaning step. Every consumer used to branch on `isinstance`, copy the
+lists and re-join the strings. `WordBag` is the one shape the services work on:
+
+    bag = WordBag.from_json(words)      # list, dict of categories, or a bag
+    bag.categorized, len(bag)
+    bag.flatten()                       # unique terms, insertion order
+    bag.top_k(20)                       # most frequent first
+    bag.category("venues")
+    bag.dedupe()                        # merges case/whitespace variants
+    bag.to_json()                       # back to a list, or a dict of all six
+
+Terms are interned and stored once per bag. The category and occurrence count of
+each term live in parallel `array` columns, so a bag of a few hundred terms is
+a handful of compact objects rather than a dict of lists of copies.
+
+The services return bags and the stages pass them along as is. Only the
+boundaries (task records, job checkpoints, the gallery, streamed events)
+serialize them with `to_json()`; a bag is built where words are read, and a
+term belongs to the first category it was seen in.
+"""
+import random
+import sys
+from array import array
+
+CATEGORIES = ("beer_styles", "breweries", "venues", "friends", "flavors", "miscellaneous")
+MISC = CATEGORIES.index("miscellaneous")
+# Category code of a term from a plain list.
+UNCATEGORIZED = 255
+
+_CODES = {name: code for code, name in enumerate(CATEGORIES)}
+
+
+def _fold(term: str) -> str:
+    return " ".join(term.split()).casefold()
+
+
+class WordBag:
+    __slots__ = ("_terms", "_cats", "_counts", "_index", "categorized")
+
+    def __init__(self, categorized: bool = False):
+        self._terms = []              # interned terms, insertion order
+        self._cats = array("B")       # category code per term
+        self._counts = array("I")     # occurrences per term
+        self._index = {}              # term -> position
+        self.categorized = categorized
+
+    @classmethod
+    def from_json(cls, data) -> "WordBag":
+        """Builds a bag from a list of terms or a dict of category -> terms (a bag is returned as is)."""
+        if isinstance(data, WordBag):
+            return data
+        if isinstance(data, dict):
+            bag = cls(categorized=True)
+            for category, items in data.items():
+                if isinstance(items, str):
+                    items = [items]
+                if isinstance(items, (list, tuple)):
+                    for term in items:
+                        bag.add(term, category)
+            return bag
+        bag = cls()
+        if isinstance(data, str):
+            data = [data]
+        for term in data or ():
+            bag.add(term)
+        return bag
+
+    def add(self, term, category: str = None, count: int = 1):
+        """Adds `count` occurrences of `term`. Unknown categories go to miscellaneous."""
+        if term is None:
+            return
+        term = str(term).strip()
+        if not term:
+            return
+        pos = self._index.get(term)
+        if pos is not None:
+            self._counts[pos] += count
+            return
+        code = UNCATEGORIZED
+        if category is not None:
+            code = _CODES.get(category, MISC)
+            self.categorized = True
+        term = sys.intern(term)
+        self._index[term] = len(self._terms)
+        self._terms.append(term)
+        self._cats.append(code)
+        self._counts.append(count)
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def __iter__(self):
+        return iter(self._terms)
+
+    def __contains__(self, term) -> bool:
+        return term in self._index
+
+    def __repr__(self) -> str:
+        return f"WordBag({len(self)} terms, categorized={self.categorized})"
+
+    def count(self, term: str) -> int:
+        pos = self._index.get(term)
+        return 0 if pos is None else self._counts[pos]
+
+    def items(self):
+        """(term, category, count) triples; the category is None for terms from a plain list."""
+        for term, code, count in zip(self._terms, self._cats, self._counts):
+            yield term, None if code == UNCATEGORIZED else CATEGORIES[code], count
+
+    def flatten(self) -> list:
+        """Every term once, in the order first seen."""
+        return list(self._terms)
+
+    def category(self, name: str) -> list:
+        """The terms of one category; like groups(), miscellaneous includes the uncategorized terms."""
+        code = _CODES.get(name, MISC)
+        codes = (MISC, UNCATEGORIZED) if code == MISC else (code,)
+        cats = self._cats
+        return [t for i, t in enumerate(self._terms) if cats[i] in codes]
+
+    def groups(self) -> dict:
+        """The non-empty categories in canonical order (terms from a plain list count as miscellaneous)."""
+        buckets = [[] for _ in CATEGORIES]
+        for term, code in zip(self._terms, self._cats):
+            buckets[MISC if code == UNCATEGORIZED else code].append(term)
+        return {name: terms for name, terms in zip(CATEGORIES, buckets) if terms}
+
+    def top_k(self, k: int = None) -> list:
+        """The `k` most frequent terms (all of them if k is None); ties keep insertion order."""
+        counts = self._counts
+        order = sorted(range(len(self._terms)), key=lambda i: -counts[i])
+        if k is not None:
+            order = order[:k]
+        return [self._terms[i] for i in order]
+
+    def shuffled(self, limit: int = None, rng=random) -> list:
+        terms = list(self._terms)
+        rng.shuffle(terms)
+        return terms if limit is None else terms[:limit]
+
+    def dedupe(self) -> "WordBag":
+        """A new bag where terms differing only in case or spacing are merged (first spelling wins)."""
+        bag = WordBag(categorized=self.categorized)
+        first = {}
+        for term, code, count in zip(self._terms, self._cats, self._counts):
+            key = _fold(term)
+            pos = first.get(key)
+            if pos is not None:
+                bag._counts[pos] += count
+                continue
+            first[key] = len(bag._terms)
+            bag._index[term] = len(bag._terms)
+            bag._terms.append(term)
+            bag._cats.append(code)
+            bag._counts.append(count)
+        return bag
+
+    def to_json(self):
+        """A list of terms, or for a categorized bag a dict with all six categories."""
+        if not self.categorized:
+            return list(self._terms)
+        groups = self.groups()
+        return {name: groups.get(name, []) for name in CATEGORIES}
+
+
+def as_json(words):
+    """The JSON shape of `words`: a bag is serialized, a list or dict is returned as is."""
+    return words.to_json() if isinstance(words, WordBag) else words
@@ -0,0 +1,233 @@
+"""
+In-process worker that drains the durable job queue.
+
+Each web process runs a few worker slots on its event loop. A slot claims a job,
+keeps its lease alive with heartbeats and hands it to the pipeline handler with
+a `JobContext` for checkpointing. Jobs orphaned by a crashed process are picked
+up by whichever worker claims them after their lease expires.
+
+Each job runs under a `Deadline` (`app.core.deadline`) counted from its
+submission. The heartbeat also watches for cancellation: a job cancelled
+through the queue (possibly by another process), a lost lease, or a `watchdog`
+verdict such as "nobody is polling this task" cancels the deadline, which stops
+the pipeline's in-flight stages.
+"""
+import asyncio
+import os
+import socket
+import time
+import uuid
+
+from app.core.job_queue import JobQueue, Job, LeaseLost, CANCELLED as JOB_CANCELLED
+from app.core.deadline import Deadline, CANCELLED, LEASE_LOST
+from app.core.logs import get_logger
+
+log = get_logger(__name__)
+
+
+class JobContext:
+    """What a pipeline needs to know about the job it is running."""
+
+    def __init__(self, queue: JobQueue, job: Job, worker_id: str, deadline_seconds: float = None):
+        self.queue = queue
+        self.job = job
+        self.worker_id = worker_id
+        self.lease_lost = False
+        # stage -> seconds spent in this attempt (checkpointed stages are not re-timed)
+        self.timings = {}
+        # Counted from submission, so a recovered job doesn't get a fresh budget. 0/None: no limit.
+        budget = job.params.get("deadline_seconds", deadline_seconds)
+        remaining = None
+        if budget:
+            remaining = max(0.0, job.created_at + budget - time.time()) if job.created_at else budget
+        self.deadline = Deadline(remaining)
+
+    @property
+    def job_id(self) -> str:
+        return self.job.job_id
+
+    def has_checkpoint(self, stage: str) -> bool:
+        return stage in self.job.checkpoints
+
+    def get_checkpoint(self, stage: str, default=None):
+        return self.job.checkpoints.get(stage, default)
+
+    def cancel(self, reason: str = CANCELLED):
+        """Stops the job's in-flight stages (see `app.core.deadline`)."""
+        self.deadline.cancel(reason)
+
+    async def checkpoint(self, stage: str, value):
+        self.job.checkpoints[stage] = value
+        try:
+            await asyncio.to_thread(self.queue.checkpoint, self.job_id, self.worker_id, stage, value)
+        except LeaseLost:
+            self.lease_lost = True
+            raise
+
+
+class JobWorker:
+    def __init__(self, queue: JobQueue, handler, concurrency: int = 4, poll_interval: float = 2.0,
+                 on_abandoned=None, deadline_seconds: float = None, watchdog=None,
+                 housekeeping=None, housekeeping_interval: float = 300.0):
+        """
+        `handler(job, ctx)` is awaited for every claimed job and returns the final
+        queue status ("done", "failed", "waiting" or "cancelled"). `on_abandoned(job)`
+        is awaited for jobs that ran out of attempts. `deadline_seconds` is the
+        default time budget of a job (a job's `deadline_seconds` param overrides
+        it). `watchdog(ctx)` is awaited on every heartbeat and returns a reason to
+        cancel the job, or None. `housekeeping()` is awaited every
+        `housekeeping_interval` seconds (pruning old jobs and records).
+        """
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.on_abandoned = on_abandoned
+        self.deadline_seconds = deadline_seconds
+        self.watchdog = watchdog
+        self.housekeeping = housekeeping
+        self.housekeeping_interval = housekeeping_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = None
+        self._tasks = []
+        self._running_jobs = {}
+
+    @property
+    def running(self) -> bool:
+        return any(not t.done() for t in self._tasks)
+
+    def start(self):
+        """Starts the worker slots on the current event loop (no-op if already running)."""
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._slot_loop(), name=f"job-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        if self.housekeeping is not None and self.housekeeping_interval > 0:
+            self._tasks.append(asyncio.create_task(self._housekeeping_loop(), name="job-housekeeping"))
+        log.info(f"Job worker {self.worker_id} started with {self.concurrency} slots")
+
+    def cancel(self, job_id: str, reason: str = CANCELLED) -> bool:
+        """Cancels a job running on this worker. Returns False if it isn't running here."""
+        ctx = self._running_jobs.get(job_id)
+        if ctx is None:
+            return False
+        ctx.cancel(reason)
+        return True
+
+    def notify(self):
+        """Wakes idle slots right away (called after a submit in this process)."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Give unfinished jobs straight back so a restarted worker doesn't wait for lease expiry.
+        for job_id in list(self._running_jobs):
+            try:
+                await asyncio.to_thread(self.queue.release, job_id, self.worker_id)
+            except LeaseLost:
+                pass
+        self._running_jobs.clear()
+
+    async def _slot_loop(self):
+        while True:
+            try:
+                for job in await asyncio.to_thread(self.queue.reap_abandoned):
+                    if self.on_abandoned:
+                        await self.on_abandoned(job)
+                job = await asyncio.to_thread(self.queue.claim, self.worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Job queue unavailable: {type(e).__name__}: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job)
+
+    async def _housekeeping_loop(self):
+        while True:
+            try:
+                await self.housekeeping()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(f"Job housekeeping failed: {type(e).__name__}: {e}")
+            await asyncio.sleep(self.housekeeping_interval)
+
+    async def _heartbeat(self, ctx: JobContext):
+        interval = max(1.0, self.queue.lease_seconds / 3)
+        while True:
+            await asyncio.sleep(interval)
+            ok = await asyncio.to_thread(self.queue.heartbeat, ctx.job_id, self.worker_id)
+            if not ok:
+                job = await asyncio.to_thread(self.queue.get, ctx.job_id)
+                if job is not None and job.status == JOB_CANCELLED:
+                    log.info(f"Job {ctx.job_id} was cancelled")
+                    ctx.cancel(CANCELLED)
+                else:
+                    ctx.lease_lost = True
+                    log.warning(f"Lost lease on job {ctx.job_id}")
+                    ctx.cancel(LEASE_LOST)
+                return
+            if self.watchdog is not None:
+                try:
+                    reason = await self.watchdog(ctx)
+                except Exception as e:
+                    log.warning(f"Job watchdog failed: {type(e).__name__}: {e}")
+                    reason = None
+                if reason:
+                    log.info(f"Job {ctx.job_id} stopped by watchdog: {reason}")
+                    ctx.cancel(reason)
+                    return
+
+    async def _run(self, job: Job):
+        ctx = JobContext(self.queue, job, self.worker_id, self.deadline_seconds)
+        self._running_jobs[job.job_id] = ctx
+        heartbeat = asyncio.create_task(self._heartbeat(ctx))
+        cancelled = False
+        try:
+            if job.attempts > 1:
+                log.info(f"Recovering job {job.job_id} (attempt {job.attempts}, "
+                         f"checkpoints: {sorted(job.checkpoints)})")
+            outcome = await self.handler(job, ctx)
+            if ctx.lease_lost:
+                return
+            if outcome == "waiting":
+                await asyncio.to_thread(self.queue.park, job.job_id, self.worker_id)
+            elif outcome == "cancelled":
+                # Usually already cancelled by /cancel; abandoned jobs are cancelled here.
+                await asyncio.to_thread(self.queue.cancel, job.job_id)
+            elif outcome == "failed":
+                await asyncio.to_thread(self.queue.fail, job.job_id, self.worker_id, "pipeline failed")
+            else:
+                await asyncio.to_thread(self.queue.complete, job.job_id, self.worker_id)
+        except asyncio.CancelledError:
+            # Shutdown: stop() releases the job.
+            cancelled = True
+            raise
+        except LeaseLost:
+            log.warning(f"Job {job.job_id} was taken over by another worker")
+        except Exception as e:
+            log.error(f"Job {job.job_id} crashed: {type(e).__name__}: {e}")
+            try:
+                await asyncio.to_thread(self.queue.fail, job.job_id, self.worker_id, f"{type(e).__name__}: {e}")
+            except LeaseLost:
+                pass
+        finally:
+            heartbeat.cancel()
+            if not cancelled:
+                self._running_jobs.pop(job.job_id, None)
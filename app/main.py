@@ -1,56 +1,165 @@
-from fastapi import FastAPI, BackgroundTasks, Request, HTTPException, File, UploadFile, Form
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+"""
+FastAPI application factory and HTTP routes.
+
+`create_app()` is the single entry point used by uvicorn, Vercel and the
+legacy `app.main_v2` module. Heavy SDKs are not imported here; the services
+fetch them from `app.services.registry` on first use.
+"""
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, APIRouter, Request, HTTPException, File, UploadFile, Form
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
 from pydantic import BaseModel
+import hmac
 import uuid
 import asyncio
-import random
-import os
-import requests
-from typing import Optional
-from app.services.beercloud import get_wordcloud_data, get_untappd_friends_words
-from app.services.image_gen import enrich_prompt, generate_image_dalle, generate_image_google
-from app.services.ocr_service import get_ocr_words
-from dotenv import load_dotenv
+from typing import List, Optional
+from app.config import get_env, env_flag, env_int, env_float, load_env
+from app.pipeline import (
+    submit_job, pack_images, resume_job, accept_draft, cancel_task, note_poll, get_worker, get_speculation_scheduler,
+    JOB_WORDCLOUD, JOB_OCR, JOB_MANUAL, JOB_UNTAPPD, FINAL_ACCEPTED,
+    stream_generation, STREAM_SOURCES, STREAM_MANUAL, STREAM_OCR, STREAM_UNTAPPD
+)
+from app.services import registry
+from app.services import postprocess
+from app.core import assets
+from app.core.task_store import get_task_store
+from app.core.singleflight import canonical_key, get_flight_registry, resolve_status
+from app.core.gallery import get_gallery, InvalidCursor, DEFAULT_PAGE_SIZE
+from app.core.admission import get_admission, Rejected
+from app.core import profiling
+from app.core.logs import get_logger, setup_logging
+from app.core.loop_watchdog import get_loop_watchdog
+from app.core.event_stream import EventStream
+from app.core.venue_cache import get_venue_cache
+from app.core.word_profiles import get_word_profiles
+from app.core.speculation import get_speculation_store
+from app.services.untappd_import import import_export, profile_words
 import time
 
-load_dotenv()
-
-app = FastAPI()
-app.add_middleware(SessionMiddleware, secret_key="wardy-secret-key-12345")
+log = get_logger(__name__)
+router = APIRouter()
+templates = Jinja2Templates(directory="templates")
+templates.env.globals["asset_url"] = assets.asset_url
+templates.env.globals["asset_urls"] = assets.asset_urls
 
-# Middleware for logging
-@app.middleware("http")
+# Middleware for logging. /status polls are their own message type so they can be sampled (LOG_SAMPLE).
 async def log_requests(request: Request, call_next):
     start_time = time.time()
-    print(f"REQUEST START: {request.method} {request.url}")
+    path = request.url.path
+    event = "request.poll" if path.startswith("/status/") else "request"
     try:
-        response = await call_next(request)
+        if request.url.path.startswith("/admin/"):
+            response = await call_next(request)
+        else:
+            with profiling.request_scope():
+                response = await call_next(request)
         process_time = time.time() - start_time
-        print(f"REQUEST END: {request.method} {request.url} - Status: {response.status_code} - Time: {process_time:.4f}s")
+        log.info(f"{request.method} {path} {response.status_code} {process_time * 1000:.1f}ms", extra={
+            "event": event, "method": request.method, "path": path,
+            "status": response.status_code, "ms": round(process_time * 1000, 1),
+        })
         return response
     except Exception as e:
-        print(f"REQUEST ERROR: {request.method} {request.url} - Exception: {e}")
+        log.exception(f"{request.method} {path} failed: {e}", extra={"event": event, "method": request.method, "path": path})
         raise e
 
-@app.on_event("startup")
-async def startup_event():
-    print("Startup: Registered routes:")
+def print_routes(app: FastAPI):
+    routes = []
     for route in app.routes:
         if hasattr(route, "methods"):
-             print(f" - {route.path} {route.methods}")
+             routes.append(f"{route.path} {sorted(route.methods)}")
+        else:
+             routes.append(f"{route.path} [Mount]")
+    log.info(f"Registered routes: {len(routes)}", extra={"routes": routes})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The route dump is noisy in serverless logs, so it is opt-in.
+    if env_flag("LOG_ROUTES"):
+        print_routes(app)
+    # Import the SDKs in the background once we're serving, so the first
+    # generation doesn't pay for it. Off by default on serverless, where the
+    # instance may be frozen right after the response.
+    if env_flag("PREWARM_SERVICES"):
+        targets = get_env("PREWARM_TARGETS", ",".join(registry.PREWARM_TARGETS))
+        registry.start_prewarm_thread([t.strip() for t in targets.split(",") if t.strip()])
+    # Assets are normally built at deploy time (app/tools/build_assets.py). Building them here
+    # is opt-in; pages use the original URLs until it's done.
+    if env_flag("ASSET_BUILD_ON_STARTUP", False):
+        assets.start_build_thread()
+    else:
+        assets.load_manifest()
+    # Logs a stack trace whenever something blocks the loop (see /stats/loop).
+    if env_flag("LOOP_WATCHDOG", True):
+        get_loop_watchdog().start()
+    # The profiling hooks are only installed when the admin surface is enabled.
+    if get_env("ADMIN_TOKEN"):
+        profiling.install(asyncio.get_running_loop())
+    # Drain the durable job queue, including jobs orphaned by a previous crash or deploy.
+    if env_flag("JOB_WORKER_ENABLED", True):
+        get_worker().start()
+    # Opt-in background refresh of connected Untappd users' words and prompts.
+    if env_flag("SPECULATION_ENABLED", False):
+        get_speculation_scheduler().start()
+    yield
+    await get_speculation_scheduler().stop()
+    await get_worker().stop()
+    await get_loop_watchdog().stop()
+
+def session_id(request: Request) -> str:
+    """Stable id for this browser session (the session cookie is signed), used for fairness and limits."""
+    sid = request.session.get("sid")
+    if not sid:
+        sid = uuid.uuid4().hex
+        request.session["sid"] = sid
+    return sid
+
+async def admit(request: Request, kind: str = "job", hold_seconds: float = None) -> tuple:
+    """
+    Admission control for the generation routes: a fast 429 with Retry-After,
+    or `(session id, reservation)`. The reservation holds the session's place
+    until `submit_job(reservation=...)` consumes it or `release()` gives it back
+    (None when admission is off).
+    """
+    owner = session_id(request)
+    if not env_flag("ADMISSION_ENABLED", True):
+        return owner, None
+    try:
+        if kind == "stream":
+            reservation = await asyncio.to_thread(get_admission().admit_stream, owner, hold_seconds)
         else:
-             print(f" - {route.path} [Mount]")
+            reservation = await asyncio.to_thread(get_admission().admit, owner)
+    except Rejected as e:
+        log.info(f"Rejected {kind} from session {owner[:8]} ({e.reason}, retry in {e.retry_after}s)",
+                 extra={"event": "admission.rejected"})
+        raise HTTPException(status_code=429, detail=e.message, headers={"Retry-After": str(e.retry_after)})
+    return owner, reservation
+
+async def release(reservation):
+    """Gives back a reservation no job consumed (a stream ended, a submission failed)."""
+    if reservation is None:
+        return
+    try:
+        await asyncio.to_thread(get_admission().release, reservation)
+    except Exception as e:
+        log.warning(f"Could not release reservation {reservation}: {type(e).__name__}: {e}")
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/images", StaticFiles(directory="images"), name="images")
-templates = Jinja2Templates(directory="templates")
+def require_admin(request: Request):
+    """The admin routes need a logged-in session plus the ADMIN_TOKEN header; without a token they don't exist."""
+    token = get_env("ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token):
+        raise HTTPException(status_code=403, detail="Forbidden")
 
-# Simple in-memory storage for task status
-# In production, use Redis or a database
-tasks = {}
+def flight_kind(kind: str, draft: bool) -> str:
+    """Draft-first requests only coalesce with each other: their tasks stop at a different point."""
+    return f"{kind}:draft" if draft else kind
 
 class GenerateRequest(BaseModel):
     cookie: Optional[str] = None
@@ -59,166 +168,17 @@ class ResumeRequest(BaseModel):
     task_id: str
     words: str
 
-# Kept for backward compatibility if needed
-async def process_wordcloud(task_id: str, cookie: str):
-    tasks[task_id] = {"status": "extracting_words", "progress": 10}
-    loop = asyncio.get_running_loop()
-
-    # Step 1: Extract words
-    try:
-        words = await loop.run_in_executor(None, get_wordcloud_data, cookie)
-        if not words:
-             tasks[task_id] = {"status": "failed", "error": "Could not extract words", "progress": 100}
-             return
-             
-        tasks[task_id] = {"status": "generating_art", "progress": 40, "words": words, "word_count": len(words)}
-        
-        # Step 2: Enrich Prompt
-        # Pass the structured dictionary directly to enrich_prompt
-        rich_data = await loop.run_in_executor(None, enrich_prompt, words, "dali")
-        
-        prompt = ""
-        reasoning = ""
-        
-        if rich_data and isinstance(rich_data, dict):
-             prompt = rich_data.get("visual_prompt", "")
-             reasoning = rich_data.get("reasoning", "")
-        elif rich_data and isinstance(rich_data, str):
-             prompt = rich_data
-        
-        if not prompt:
-             # Fallback logic handling both dict and list
-             if isinstance(words, dict):
-                 flat = []
-                 for k, v in words.items():
-                     if isinstance(v, list): flat.extend(v)
-                 fallback_snippet = ", ".join(flat[:10])
-             else:
-                 fallback_snippet = ", ".join(words[:10])
-             prompt = f"A surrealist masterpiece with {fallback_snippet}"
-
-        # Update task status with prompt info so frontend can see it immediately
-        tasks[task_id] = {
-            "status": "generating_art", 
-            "progress": 60, 
-            "words": words, 
-            "word_count": len(words),
-            "generated_prompt": prompt,
-            "reasoning": reasoning
-        }
-
-        # Step 3: Generate Image (Defaulting to Google)
-        image_url = await loop.run_in_executor(None, generate_image_google, prompt)
-        
-        if image_url:
-            tasks[task_id] = {
-                "status": "completed", 
-                "progress": 100, 
-                "image_url": image_url, 
-                "words": words,
-                "generated_prompt": prompt,
-                "reasoning": reasoning
-            }
-        else:
-            tasks[task_id] = {"status": "failed", "error": "Image generation failed", "progress": 100}
-            
-    except Exception as e:
-        import traceback
-        print(f"TASK FAILED: {task_id}")
-        traceback.print_exc()
-        error_msg = f"{type(e).__name__}: {str(e)}"
-        tasks[task_id] = {"status": "failed", "error": error_msg, "progress": 100}
-
-async def continue_generation_task(task_id: str, words: list[str], style: str, model_provider: str, theme: str = "Beer"):
-    tasks[task_id]["status"] = "enriching_prompt"
-    tasks[task_id]["progress"] = 40
-    
-    loop = asyncio.get_running_loop()
-    try:
-        # Step 2: Enrich Prompt (GPT-4o)
-        
-        # Prepare data for enrichment
-        enrichment_input = words
-        
-        if isinstance(words, list):
-            # Shuffle words to ensure variety if the list is long, avoiding "header bias"
-            shuffled_words = words.copy()
-            random.shuffle(shuffled_words)
-            enrichment_input = shuffled_words[:500]
-        elif isinstance(words, dict):
-            # For structured data, we don't shuffle categories, 
-            # but we could shuffle items within categories if needed. 
-            # For now, pass as is.
-            enrichment_input = words
-
-        # Pass to enrich_prompt
-        rich_data = await loop.run_in_executor(None, enrich_prompt, enrichment_input, style, theme)
-        
-        prompt = ""
-        reasoning = ""
-        
-        if rich_data and isinstance(rich_data, dict):
-             prompt = rich_data.get("visual_prompt", "")
-             reasoning = rich_data.get("reasoning", "")
-        elif rich_data and isinstance(rich_data, str):
-             prompt = rich_data
-
-        if not prompt:
-             # Fallback
-             if isinstance(words, dict):
-                 flat = []
-                 for k, v in words.items():
-                     if isinstance(v, list): flat.extend(v)
-                 fallback_snippet = ", ".join(flat[:20])
-             else:
-                 fallback_snippet = ", ".join(words[:20])
-             prompt = f"A list of items: {fallback_snippet}"
-
-        # Update task with prompt info
-        tasks[task_id] = {
-            "status": "generating_art", 
-            "progress": 70, 
-            "words": words, 
-            "word_count": len(words),
-            "generated_prompt": prompt, 
-            "reasoning": reasoning
-        }
-        
-        # Step 3: Generate Image based on Provider
-        image_url = None
-        if model_provider == "dalle":
-             image_url = await loop.run_in_executor(None, generate_image_dalle, prompt)
-        elif model_provider == "google":
-             from app.services.image_gen import generate_image_google
-             image_url = await loop.run_in_executor(None, generate_image_google, prompt)
-        else:
-             # Default to Google if unknown
-             from app.services.image_gen import generate_image_google
-             image_url = await loop.run_in_executor(None, generate_image_google, prompt)
-        
-        if image_url:
-            tasks[task_id] = {
-                "status": "completed", 
-                "progress": 100, 
-                "image_url": image_url, 
-                "words": words, 
-                "generated_prompt": prompt, 
-                "reasoning": reasoning
-            }
-        else:
-            tasks[task_id] = {"status": "failed", "error": "Image generation failed", "progress": 100}
-
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        error_msg = f"{type(e).__name__}: {str(e)}"
-        tasks[task_id] = {"status": "failed", "error": error_msg, "progress": 100}
+class ProfileRequest(BaseModel):
+    task_id: Optional[str] = None
+    requests: int = 0
+    seconds: float = 30
+    interval_ms: float = 5
 
 # Untappd OAuth Routes (Delegated to utpd-oauth service)
-@app.get("/auth/untappd/login")
+@router.get("/auth/untappd/login")
 async def untappd_login(request: Request):
     # Service handling the client secret securely
-    auth_service_url = os.getenv("AUTH_SERVICE_URL", "https://utpd-oauth.craftbeers.app")
+    auth_service_url = get_env("AUTH_SERVICE_URL", "https://utpd-oauth.craftbeers.app")
     
     # Construct callback URL
     base_url = str(request.base_url).rstrip("/")
@@ -232,22 +192,25 @@ async def untappd_login(request: Request):
     
     return RedirectResponse(login_url)
 
-@app.get("/auth/untappd/callback")
+@router.get("/auth/untappd/callback")
 async def untappd_callback(request: Request, token_code: str = None, error: str = None):
     if error:
-         print(f"Auth Service reported error: {error}")
+         log.warning(f"Auth Service reported error: {error}")
          return RedirectResponse(url=f"/?error={error}")
 
     if not token_code:
          return RedirectResponse(url="/?error=no_token_code")
 
-    auth_service_url = os.getenv("AUTH_SERVICE_URL", "https://utpd-oauth.craftbeers.app")
+    auth_service_url = get_env("AUTH_SERVICE_URL", "https://utpd-oauth.craftbeers.app")
     get_token_url = f"{auth_service_url}/get-token"
     
     try:
         # Exchange the one-time token_code for the real access_token
-        # acting as a server-to-server call.
-        response = requests.post(get_token_url, json={"token_code": token_code})
+        # acting as a server-to-server call. requests is blocking, so it runs
+        # in a thread; otherwise every other request on this worker would wait.
+        response = await asyncio.to_thread(
+            lambda: registry.get_requests().post(get_token_url, json={"token_code": token_code}, timeout=15)
+        )
         
         if response.status_code == 200:
             data = response.json()
@@ -258,127 +221,179 @@ async def untappd_callback(request: Request, token_code: str = None, error: str
                 return RedirectResponse(url="/?untappd_connected=true")
         
         # If we got here, something failed
-        print(f"Token Exchange Failed: {response.text}")
+        log.error(f"Token Exchange Failed: HTTP {response.status_code}", extra={"body": response.text})
         return RedirectResponse(url="/?error=token_exchange_failed")
             
     except Exception as e:
-        print(f"Untappd Exception: {e}")
+        log.error(f"Untappd Exception: {e}")
         return RedirectResponse(url="/?error=untappd_exception")
 
 
-async def process_ocr_task(task_id: str, image_bytes: bytes, style: str, model_provider: str, theme: str = "Beer"):
-    tasks[task_id] = {"status": "analyzing_image", "progress": 10}
-    loop = asyncio.get_running_loop()
-    
-    try:
-        # Step 1: OCR (GPT-4o Vision)
-        words = await loop.run_in_executor(None, get_ocr_words, image_bytes)
-        
-        if not words:
-             # If no words found, wait for manual input
-             tasks[task_id] = {
-                 "status": "waiting_for_input", 
-                 "progress": 20, 
-                 "style": style, 
-                 "model_provider": model_provider,
-                 "theme": theme,
-                 "error": "No text detected. Please enter words manually."
-             }
-             return
-
-        # Proceed to generation if words found
-        await continue_generation_task(task_id, words, style, model_provider, theme)
-
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        error_msg = f"{type(e).__name__}: {str(e)}"
-        tasks[task_id] = {"status": "failed", "error": error_msg, "progress": 100}
-
-
-@app.get("/login", response_class=HTMLResponse)
+@router.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
-@app.post("/login")
+@router.post("/login")
 async def login(request: Request, password: str = Form(...)):
     if password == "Wardy123":
         request.session["authenticated"] = True
         return RedirectResponse(url="/", status_code=303)
     return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid Password"})
 
-@app.get("/logout")
+@router.get("/logout")
 async def logout(request: Request):
+    # Imported word profiles belong to the session and can't be reached once it ends.
+    sid = request.session.get("sid")
+    if sid:
+        await asyncio.to_thread(get_word_profiles().delete_owner, sid)
     request.session.clear()
     return RedirectResponse(url="/login")
 
-@app.get("/", response_class=HTMLResponse)
+@router.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     if not request.session.get("authenticated"):
         return RedirectResponse(url="/login")
     return templates.TemplateResponse("index.html", {"request": request})
 
-@app.post("/generate")
-async def generate(request: Request, request_body: GenerateRequest, background_tasks: BackgroundTasks):
+@router.post("/generate")
+async def generate(request: Request, request_body: GenerateRequest):
     if not request.session.get("authenticated"):
         raise HTTPException(status_code=401, detail="Unauthorized")
+    owner, reservation = await admit(request)
     task_id = str(uuid.uuid4())
-    tasks[task_id] = {"status": "queued", "progress": 0}
-    background_tasks.add_task(process_wordcloud, task_id, request_body.cookie)
+    await get_task_store().acreate(task_id, {"status": "queued", "progress": 0})
+    flight_key = canonical_key(JOB_WORDCLOUD, "dali", "Beer", "google", extra=request_body.cookie or "")
+    await submit_job(task_id, JOB_WORDCLOUD, {"cookie": request_body.cookie}, flight_key=flight_key, owner=owner,
+                     reservation=reservation)
     return {"task_id": task_id}
 
-@app.post("/upload")
-async def upload_image(request: Request, background_tasks: BackgroundTasks, file: UploadFile = File(...), style: str = Form("dali"), model_provider: str = Form("google"), theme: str = Form("Beer")):
+def check_photo_count(files: list):
+    limit = env_int("OCR_MAX_IMAGES", 6)
+    if len(files) > limit:
+        raise HTTPException(status_code=400, detail=f"Please upload at most {limit} photos.")
+
+
+@router.post("/upload")
+async def upload_image(request: Request, file: List[UploadFile] = File(...), style: str = Form("dali"), model_provider: str = Form("google"), theme: str = Form("Beer"),
+                       draft: bool = Form(False)):
     if not request.session.get("authenticated"):
         raise HTTPException(status_code=401, detail="Unauthorized")
-    print(f"Received upload: {file.filename}, content_type={file.content_type}, style={style}, model_provider={model_provider}, theme={theme}")
+    check_photo_count(file)
+    log.info(f"Received upload: {len(file)} photo(s) ({', '.join(f.filename or '?' for f in file)}), style={style}, model_provider={model_provider}, theme={theme}")
+    # Before reading the upload, so a rejection stays cheap.
+    owner, reservation = await admit(request)
     try:
         task_id = str(uuid.uuid4())
-        tasks[task_id] = {"status": "queued", "progress": 0}
+        await get_task_store().acreate(task_id, {"status": "queued", "progress": 0})
         
-        # Read file content
-        content = await file.read()
-        print(f"Read {len(content)} bytes")
+        # Several photos of one menu become one job; the worker packs them into contact sheets.
+        content, sizes = pack_images([await f.read() for f in file])
+        log.debug(f"Read {len(content)} bytes")
         
-        background_tasks.add_task(process_ocr_task, task_id, content, style, model_provider, theme)
+        # Hashing multi-megabyte photos is better kept off the loop.
+        flight_key = await asyncio.to_thread(canonical_key, flight_kind(JOB_OCR, draft), style, theme, model_provider,
+                                             image_bytes=content, extra=str(sizes))
+        params = {"style": style, "model_provider": model_provider, "theme": theme, "draft": draft}
+        if len(sizes) > 1:
+            params["image_sizes"] = sizes
+        await submit_job(task_id, JOB_OCR, params, content, flight_key=flight_key, owner=owner,
+                         reservation=reservation)
         return {"task_id": task_id}
     except Exception as e:
-        print(f"UPLOAD ERROR: {e}")
+        await release(reservation)
+        log.exception(f"Upload failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/generate_manual")
-async def generate_manual(request: Request, background_tasks: BackgroundTasks, 
-                          words: str = Form(...), 
+@router.post("/generate_manual")
+async def generate_manual(request: Request,
+                          words: str = Form(None), 
                           style: str = Form("dali"), 
                           model_provider: str = Form("google"), 
-                          theme: str = Form("Beer")):
+                          theme: str = Form("Beer"),
+                          draft: bool = Form(False),
+                          profile_id: str = Form(None)):
     if not request.session.get("authenticated"):
         raise HTTPException(status_code=401, detail="Unauthorized")
     
-    print(f"Received manual generation request: {len(words)} chars, style={style}, theme={theme}")
+    log.info(f"Received manual generation request: {len(words or '')} chars, profile={profile_id}, style={style}, theme={theme}")
     
     # Process words
-    words_list = [w.strip() for w in words.split(",")]
+    words_list = [w.strip() for w in (words or "").split(",")]
     # Remove empty
     words_list = [w for w in words_list if w]
 
+    if profile_id:
+        # A stored Untappd import; typed words are added to it.
+        profile = await asyncio.to_thread(get_word_profiles().get, profile_id, session_id(request))
+        if profile is None:
+            raise HTTPException(status_code=404, detail="Profile not found")
+        profile_terms = profile_words(profile["counts"])
+        profile_terms["miscellaneous"] += words_list
+        words_list = profile_terms
+
     if not words_list or len(words_list) < 1:
         raise HTTPException(status_code=400, detail="Please provide at least one word.")
 
+    owner, reservation = await admit(request)
     try:
         task_id = str(uuid.uuid4())
-        tasks[task_id] = {"status": "queued", "progress": 0}
+        await get_task_store().acreate(task_id, {"status": "queued", "progress": 0})
         
         # Start generation directly, skipping OCR
-        background_tasks.add_task(continue_generation_task, task_id, words_list, style, model_provider, theme)
+        flight_key = canonical_key(flight_kind(JOB_MANUAL, draft), style, theme, model_provider, words=words_list)
+        await submit_job(task_id, JOB_MANUAL, {"words": words_list, "style": style, "model_provider": model_provider, "theme": theme,
+                                               "draft": draft},
+                         flight_key=flight_key, owner=owner, reservation=reservation)
         
         return {"task_id": task_id}
     except Exception as e:
-        print(f"MANUAL GEN ERROR: {e}")
+        await release(reservation)
+        log.exception(f"Manual generation failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/generate_untappd")
-async def generate_untappd(request: Request, background_tasks: BackgroundTasks, style: str = Form("dali"), model_provider: str = Form("google")):
+@router.post("/import/untappd")
+async def import_untappd(request: Request, file: UploadFile = File(...), name: str = Form(None)):
+    """
+    Imports an Untappd CSV/JSON export as a word profile (see app.services.untappd_import).
+    Returns the `profile_id` that /generate_manual accepts, with the top terms.
+    """
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    log.info(f"Importing Untappd export: {file.filename}")
+    # The upload is already spooled to disk; it is parsed from there in chunks, off the loop.
+    try:
+        source, checkins, counts = await asyncio.to_thread(import_export, file.file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Could not read the export: {e}")
+    if not checkins:
+        raise HTTPException(status_code=400, detail="No check-ins found in the export.")
+    name = (name or "").strip() or file.filename or "Untappd export"
+    profile_id = await asyncio.to_thread(get_word_profiles().put, session_id(request), name, source, checkins, counts)
+    return {
+        "profile_id": profile_id,
+        "name": name,
+        "source": source,
+        "checkins": checkins,
+        "top": {field: [term for term, _ in terms[:5]] for field, terms in counts.items()},
+    }
+
+@router.get("/word_profiles")
+async def list_word_profiles(request: Request):
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return {"profiles": await asyncio.to_thread(get_word_profiles().list, session_id(request))}
+
+@router.delete("/word_profiles/{profile_id}")
+async def delete_word_profile(request: Request, profile_id: str):
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if not await asyncio.to_thread(get_word_profiles().delete, profile_id, session_id(request)):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return {"deleted": profile_id}
+
+@router.post("/generate_untappd")
+async def generate_untappd(request: Request, style: str = Form("dali"), model_provider: str = Form("google"),
+                           draft: bool = Form(False)):
     if not request.session.get("authenticated"):
         raise HTTPException(status_code=401, detail="Unauthorized")
         
@@ -386,38 +401,143 @@ async def generate_untappd(request: Request, background_tasks: BackgroundTasks,
     if not token:
         raise HTTPException(status_code=401, detail="Not connected to Untappd")
         
+    owner, reservation = await admit(request)
     task_id = str(uuid.uuid4())
-    tasks[task_id] = {"status": "queued", "progress": 0}
+    await get_task_store().acreate(task_id, {"status": "queued", "progress": 0})
     
-    # Background task wrapper
-    async def process_untappd(tid, tkn, sty, prov):
-        loop = asyncio.get_running_loop()
-        tasks[tid] = {"status": "fetching_untappd", "progress": 10}
-        try:
-            words = await loop.run_in_executor(None, get_untappd_friends_words, tkn)
-            if not words:
-                 tasks[tid] = {"status": "failed", "error": "No words found from Untappd.", "progress": 100}
-                 return
-            
-            # Continue with generation
-            await continue_generation_task(tid, words, sty, prov, "Beer")
-            
-        except Exception as e:
-             tasks[tid] = {"status": "failed", "error": f"{type(e).__name__}: {str(e)}", "progress": 100}
+    params = {"token": token, "style": style, "model_provider": model_provider, "draft": draft}
+    if env_flag("SPECULATION_ENABLED", False):
+        # Words and prompt precomputed from the current feed skip straight to the image.
+        store = get_speculation_store()
+        await asyncio.to_thread(store.touch, owner)
+        speculated = await asyncio.to_thread(store.fresh, owner, style, model_provider,
+                                             env_float("SPECULATION_MAX_AGE_SECONDS", 3600))
+        if speculated:
+            params["speculated"] = speculated
+    flight_key = canonical_key(flight_kind(JOB_UNTAPPD, draft), style, "Beer", model_provider, extra=token)
+    await submit_job(task_id, JOB_UNTAPPD, params, flight_key=flight_key, owner=owner, reservation=reservation)
+    return {"task_id": task_id, "speculated": "speculated" in params}
+
+@router.get("/speculation")
+async def speculation_status(request: Request):
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    owner = session_id(request)
+    store = get_speculation_store()
+    await asyncio.to_thread(store.touch, owner)
+    sub = await asyncio.to_thread(store.subscriber, owner)
+    if sub is None:
+        return {"subscribed": False}
+    return {"subscribed": True, "styles": sub["styles"], "model_provider": sub["model_provider"],
+            "drafts": sub["drafts"], "checked_at": sub["checked_at"], "next_check": sub["next_check"]}
+
+@router.post("/speculation")
+async def speculation_subscribe(request: Request, styles: str = Form("dali"), model_provider: str = Form("google"),
+                                drafts: bool = Form(False)):
+    """Opts this session in to background pre-generation for its favourite styles (see app.core.speculation)."""
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if not env_flag("SPECULATION_ENABLED", False):
+        raise HTTPException(status_code=404, detail="Speculative generation is not enabled")
+    token = request.session.get("untappd_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not connected to Untappd")
+    style_list = list(dict.fromkeys(s.strip() for s in styles.split(",") if s.strip()))
+    limit = env_int("SPECULATION_MAX_STYLES", 3)
+    if not style_list or len(style_list) > limit:
+        raise HTTPException(status_code=400, detail=f"Please choose between 1 and {limit} styles.")
+    await asyncio.to_thread(get_speculation_store().subscribe, session_id(request), token, style_list,
+                            model_provider, drafts)
+    return {"subscribed": True, "styles": style_list}
+
+@router.delete("/speculation")
+async def speculation_unsubscribe(request: Request):
+    """Opts out; the stored token and precomputed results are deleted."""
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return {"unsubscribed": await asyncio.to_thread(get_speculation_store().unsubscribe, session_id(request))}
+
+@router.post("/generate/stream")
+async def generate_stream(request: Request,
+                          source: str = Form(STREAM_MANUAL),
+                          words: str = Form(None),
+                          file: List[UploadFile] = File(None),
+                          style: str = Form("dali"),
+                          model_provider: str = Form("google"),
+                          theme: str = Form("Beer"),
+                          deadline_seconds: float = Form(None)):
+    """
+    Runs the whole pipeline inside this response and streams NDJSON progress,
+    ending with the image itself (see `pipeline.stream_generation`). For
+    serverless hosts, where a background job and /status polls can't be relied on.
+    """
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if source not in STREAM_SOURCES:
+        raise HTTPException(status_code=400, detail=f"source must be one of {', '.join(STREAM_SOURCES)}")
+    words_list = [w.strip() for w in (words or "").split(",") if w.strip()]
+    if source == STREAM_MANUAL and not words_list:
+        raise HTTPException(status_code=400, detail="Please provide at least one word.")
+    if source == STREAM_OCR and not file:
+        raise HTTPException(status_code=400, detail="Please upload an image.")
+    if source == STREAM_OCR:
+        check_photo_count(file)
+    token = request.session.get("untappd_token")
+    if source == STREAM_UNTAPPD and not token:
+        raise HTTPException(status_code=401, detail="Not connected to Untappd")
 
-    background_tasks.add_task(process_untappd, task_id, token, style, model_provider)
-    return {"task_id": task_id}
+    # The client may ask for less time than the host allows, never more.
+    limit = env_float("STREAM_DEADLINE_SECONDS", 240)
+    if deadline_seconds is not None and deadline_seconds > 0:
+        limit = min(limit, deadline_seconds) if limit else deadline_seconds
 
-@app.post("/resume_task")
-async def resume_task(request: Request, body: ResumeRequest, background_tasks: BackgroundTasks):
+    # Counted until body() ends. If it never starts, the registration lapses after the deadline
+    # (an hour without one).
+    _, reservation = await admit(request, kind="stream", hold_seconds=(limit or 3600) + 60)
+    try:
+        images = [await f.read() for f in file] if source == STREAM_OCR else None
+    except BaseException:
+        await release(reservation)
+        raise
+    log.info(f"Streaming generation: source={source}, style={style}, model_provider={model_provider}, deadline={limit}s")
+
+    stream = EventStream(max_pending=env_int("STREAM_MAX_PENDING", 16),
+                         heartbeat=env_float("STREAM_HEARTBEAT_SECONDS", 10))
+
+    async def body():
+        run = asyncio.create_task(stream_generation(
+            stream, source, style, model_provider, theme, words=words_list, images=images,
+            token=token, deadline_seconds=limit, accept=request.headers.get("accept", ""),
+        ))
+        try:
+            async for line in stream:
+                yield line
+        finally:
+            # Also reached when the client disconnects mid-stream: stop the run.
+            stream.close()
+            if not run.done():
+                run.cancel()
+                await asyncio.gather(run, return_exceptions=True)
+            await release(reservation)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
+@router.post("/resume_task")
+async def resume_task(request: Request, body: ResumeRequest):
     if not request.session.get("authenticated"):
          raise HTTPException(status_code=401, detail="Unauthorized")
     
     task_id = body.task_id
-    if task_id not in tasks:
+    store = get_task_store()
+    task_state = await store.aget(task_id)
+    if task_state is None:
          raise HTTPException(status_code=404, detail="Task not found")
+    if task_state.get("coalesced_with"):
+         # Followers share their leader's job, so resuming either resumes both.
+         task_id = task_state["coalesced_with"]
+         task_state = await store.aget(task_id) or {}
     
-    task_state = tasks[task_id]
     if task_state.get("status") != "waiting_for_input":
          return {"message": "Task is not waiting for input", "status": task_state.get("status")}
     
@@ -428,23 +548,268 @@ async def resume_task(request: Request, body: ResumeRequest, background_tasks: B
     
     if not words_list:
         raise HTTPException(status_code=400, detail="No valid words provided")
-        
-    # Get previous context
-    style = task_state.get("style", "dali")
-    model_provider = task_state.get("model_provider", "google")
-    theme = task_state.get("theme", "Beer")
     
-    # Update status immediately
-    tasks[task_id]["status"] = "resuming"
-    tasks[task_id]["progress"] = 30
+    # Claim the task atomically: with several workers, a double-submitted resume
+    # must only start one generation.
+    task_state = await store.atransition(task_id, "waiting_for_input", "resuming", progress=30, error=None)
+    if task_state is None:
+         current = await store.aget(task_id) or {}
+         return {"message": "Task is not waiting for input", "status": current.get("status")}
     
-    # Launch background task
-    background_tasks.add_task(continue_generation_task, task_id, words_list, style, model_provider, theme)
+    # Requeue the parked job with the manual words standing in for the OCR result.
+    # Style, provider and theme travel with the job itself.
+    if not await resume_job(task_id, words_list):
+         await store.aupdate(task_id, status="failed", error="Task can no longer be resumed", progress=100)
+         raise HTTPException(status_code=409, detail="Task can no longer be resumed")
     
     return {"status": "ok", "message": "Resuming generation"}
 
-@app.get("/status/{task_id}")
+@router.post("/accept_draft/{task_id}")
+async def accept_draft_route(request: Request, task_id: str):
+    """Renders the full-quality image of a task parked at draft_ready."""
+    if not request.session.get("authenticated"):
+         raise HTTPException(status_code=401, detail="Unauthorized")
+    store = get_task_store()
+    task_state = await store.aget(task_id)
+    if task_state is None:
+         raise HTTPException(status_code=404, detail="Task not found")
+    if task_state.get("coalesced_with"):
+         # Followers share their leader's job, so accepting either accepts both.
+         task_id = task_state["coalesced_with"]
+    
+    # Claimed atomically, like /resume_task, so a double click starts one render.
+    task_state = await store.atransition(task_id, "draft_ready", "queued", progress=65, final_mode=FINAL_ACCEPTED)
+    if task_state is None:
+         current = await store.aget(task_id) or {}
+         return {"message": "Task has no draft waiting", "status": current.get("status")}
+    if not await accept_draft(task_id):
+         await store.aupdate(task_id, status="failed", error="Draft can no longer be accepted", progress=100)
+         raise HTTPException(status_code=409, detail="Draft can no longer be accepted")
+    return {"status": "ok", "message": "Rendering full quality"}
+
+@router.get("/status/{task_id}")
 async def get_status(task_id: str):
-    if task_id not in tasks:
+    store = get_task_store()
+    task_state = await store.aget(task_id)
+    if task_state is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    # Polls keep the job alive; unwatched jobs are cancelled (TASK_ABANDON_SECONDS).
+    if task_state.get("coalesced_with"):
+        leader_state = await store.aget(task_state["coalesced_with"])
+        if leader_state is not None:
+            await note_poll(task_state["coalesced_with"], leader_state)
+            return resolve_status(task_state, leader_state, task_id)
+    await note_poll(task_id, task_state)
+    return task_state
+
+@router.post("/cancel/{task_id}")
+async def cancel(request: Request, task_id: str):
+    """Stops a task's generation. Also sent by the page (sendBeacon) when the tab is closed."""
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    task_state = await cancel_task(task_id)
+    if task_state is None:
         raise HTTPException(status_code=404, detail="Task not found")
-    return tasks[task_id]
+    return {"task_id": task_id, "status": task_state.get("status")}
+
+# Variants never change once written, so they can be cached forever.
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@router.get("/media/{image_id}")
+async def get_media(request: Request, image_id: str, w: Optional[int] = None):
+    """Serves the smallest variant the client accepts (Accept header) at or above width `w`."""
+    manifest = await asyncio.to_thread(postprocess.load_manifest, image_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    variant = postprocess.choose_variant(manifest, request.headers.get("accept", ""), w)
+    return FileResponse(
+        postprocess.file_path(image_id, variant["file"]),
+        media_type=variant["mime"],
+        headers={"Cache-Control": MEDIA_CACHE_CONTROL, "Vary": "Accept"},
+    )
+
+@router.get("/media/{image_id}/original")
+async def get_media_original(image_id: str):
+    manifest = await asyncio.to_thread(postprocess.load_manifest, image_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    original = manifest["original"]
+    return FileResponse(
+        postprocess.file_path(image_id, original["file"]),
+        media_type=original["mime"],
+        filename=f"masterpiece.{original['file'].rsplit('.', 1)[-1]}",
+        headers={"Cache-Control": MEDIA_CACHE_CONTROL},
+    )
+
+@router.get("/assets/{filename}")
+async def get_asset(request: Request, filename: str):
+    """Serves a fingerprinted asset, precompressed if the client accepts br/gzip."""
+    resolved = assets.resolve(filename, request.headers.get("accept-encoding", ""))
+    if resolved is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    path, media_type, encoding = resolved
+    headers = {"Cache-Control": MEDIA_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+@router.get("/stats/coalescing")
+async def coalescing_stats(request: Request):
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return await asyncio.to_thread(get_flight_registry().stats)
+
+
+@router.get("/stats/admission")
+async def admission_stats(request: Request):
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return await asyncio.to_thread(get_admission().stats)
+
+
+@router.get("/stats/loop")
+async def loop_stats(request: Request):
+    """Event-loop lag: last sample, p50/p99 over the last minute, and stalls past the threshold."""
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return get_loop_watchdog().stats()
+
+
+@router.get("/stats/pipeline")
+async def pipeline_stats(request: Request):
+    """Latency of the multi-call vs fused clean + enrich modes (see PIPELINE_MODE)."""
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return await asyncio.to_thread(get_gallery().latency_by_mode)
+
+
+@router.get("/stats/speculation")
+async def speculation_stats(request: Request):
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return await get_speculation_scheduler().stats()
+
+@router.get("/stats/venues")
+async def venue_stats(request: Request):
+    """Venue-vibe cache: hits, misses and stores in this process, and the cached venue count."""
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return await asyncio.to_thread(get_venue_cache().stats)
+
+
+@router.post("/admin/profile")
+async def start_profile(request: Request, body: ProfileRequest):
+    """Samples a task (running or not yet started) or the next N requests; see app.core.profiling."""
+    require_admin(request)
+    try:
+        capture = profiling.start_capture(body.task_id, body.requests, body.seconds, body.interval_ms / 1000)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return capture.summary()
+
+
+@router.get("/admin/profile")
+async def list_profiles(request: Request):
+    require_admin(request)
+    return profiling.list_captures()
+
+
+@router.get("/admin/profile/{capture_id}")
+async def get_profile(request: Request, capture_id: str):
+    require_admin(request)
+    capture = profiling.get_capture(capture_id)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return capture.summary()
+
+
+@router.post("/admin/profile/{capture_id}/stop")
+async def stop_profile(request: Request, capture_id: str):
+    require_admin(request)
+    capture = profiling.stop_capture(capture_id)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return capture.summary()
+
+
+@router.get("/admin/profile/{capture_id}/folded")
+async def get_profile_folded(request: Request, capture_id: str):
+    """Collapsed stacks, for flamegraph.pl, inferno or speedscope."""
+    require_admin(request)
+    capture = profiling.get_capture(capture_id)
+    if capture is None or not capture.path:
+        raise HTTPException(status_code=404, detail="Not found (or still running)")
+    return FileResponse(capture.path, media_type="text/plain", filename=f"profile-{capture_id}.folded")
+
+
+@router.post("/admin/memory/snapshot")
+async def memory_snapshot(request: Request, group_by: str = "lineno", limit: int = 20, filter: Optional[str] = None):
+    require_admin(request)
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    return await asyncio.to_thread(profiling.memory_snapshot, group_by, limit, filter)
+
+
+@router.get("/admin/memory/diff")
+async def memory_diff(request: Request, base: str, target: Optional[str] = None, group_by: str = "lineno",
+                      limit: int = 20, filter: Optional[str] = None):
+    require_admin(request)
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    try:
+        return await asyncio.to_thread(profiling.memory_diff, base, target, group_by, limit, filter)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Unknown snapshot {e}")
+
+
+@router.post("/admin/memory/stop")
+async def memory_stop(request: Request):
+    require_admin(request)
+    await asyncio.to_thread(profiling.memory_stop)
+    return {"tracing": False}
+
+
+@router.get("/gallery", response_class=HTMLResponse)
+async def gallery_page(request: Request):
+    if not request.session.get("authenticated"):
+        return RedirectResponse(url="/login")
+    return templates.TemplateResponse("gallery.html", {"request": request})
+
+
+@router.get("/api/gallery")
+async def list_gallery(request: Request, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                       style: Optional[str] = None, provider: Optional[str] = None):
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    try:
+        return await asyncio.to_thread(get_gallery().list, cursor, limit, style, provider)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/api/gallery/{task_id}")
+async def get_gallery_item(request: Request, task_id: str):
+    if not request.session.get("authenticated"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    item = await asyncio.to_thread(get_gallery().get, task_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return item
+
+
+def create_app() -> FastAPI:
+    """Builds the application: middleware, static mounts and all routes."""
+    load_env()
+    setup_logging()
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(SessionMiddleware, secret_key="wardy-secret-key-12345")
+    app.middleware("http")(log_requests)
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+    app.mount("/images", StaticFiles(directory="images"), name="images")
+    app.include_router(router)
+    return app
+
+
+app = create_app()
@@ -0,0 +1,1253 @@
+"""
+Background generation pipelines (scrape/OCR/Untappd -> enrich -> image).
+
+The routes in `app.main` create a task record and submit a job to the durable
+queue (`app.core.job_queue`); the in-process `JobWorker` claims it and calls
+`run_job()`. Progress is merged into the shared task store (see
+`app.core.task_store`) for `/status/{task_id}` polls on any worker.
+
+Each pipeline is a graph of stages (`app.core.dag`): a source stage produces
+the words (scraping, Untappd, or the words given by the caller) and the shared
+generation stages turn them into a prompt, an image and its variants. Stages
+whose inputs are ready run concurrently, and every stage output is checkpointed
+on the job, so a job recovered after a crash or deploy skips finished stages.
+New stages are added with `register_stage()`.
+
+Jobs run under a deadline (JOB_DEADLINE_SECONDS) that the graph splits across
+the stages by `weight`. They stop early when the task is cancelled
+(`cancel_task()`) or when nobody has polled it for TASK_ABANDON_SECONDS.
+
+`stream_generation()` runs the same graph inside a single request for
+serverless hosts. It keeps no task record and no job, and writes progress to
+an NDJSON `EventStream` instead of the task store. Stages report partial
+results through `report(kind, **fields)`, so they work the same way in both
+modes.
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+import random
+import time
+import uuid
+from app.config import get_env, env_flag, env_int, env_float
+from app.services.beercloud import get_wordcloud_data, fetch_untappd_feed, clean_words_with_llm, describe_venues
+from app.services.image_gen import (
+    enrich_prompt, enrich_prompt_stream, clean_and_enrich, generate_image_dalle, generate_image_google,
+    generate_draft_image
+)
+from app.services.ocr_service import get_menu_words
+from app.services.postprocess import (
+    postprocess_image, load_manifest, variant_urls, make_preview, transcode_data_uri, decode_image_url
+)
+from app.core.task_store import get_task_store, TaskNotFound
+from app.core.job_queue import get_job_queue, LeaseLost, QUEUED, RUNNING
+from app.core.worker import JobWorker, JobContext
+from app.core.singleflight import get_flight_registry
+from app.core.gallery import get_gallery
+from app.core.dag import Stage, StageFailed, run_graph
+from app.core.deadline import (
+    Deadline, TaskCancelled, guard, use_deadline, CANCELLED, ABANDONED, LEASE_LOST, TIMEOUT
+)
+from app.core.event_stream import EventStream
+from app.core.speculation import get_speculation_store
+from app.core.words import WordBag, as_json
+from app.core.profiling import task_scope
+from app.core.logs import get_logger, log_context
+
+log = get_logger(__name__)
+
+# Values passed between stages. These are also the checkpoint names.
+STAGE_OCR_WORDS = "ocr_words"
+STAGE_RAW_WORDS = "raw_words"
+STAGE_VENUE_NAMES = "venue_names"
+STAGE_VENUES = "venues"
+STAGE_WORDS = "words"
+STAGE_VENUE_DESCRIPTION = "venue_description"
+STAGE_ENRICHED_PROMPT = "enriched_prompt"
+STAGE_PROMPT = "prompt"
+STAGE_IMAGE = "image"
+STAGE_VARIANTS = "variants"
+STAGE_MEDIA = "media"
+STAGE_PIPELINE_MODE = "pipeline_mode"
+STAGE_DRAFT = "draft"
+STAGE_DRAFT_ACCEPTED = "draft_accepted"
+
+# Task statuses after which nothing runs any more
+FINAL_STATUSES = ("completed", "failed", "cancelled")
+# Task statuses whose job is parked until the user acts
+WAITING_STATUSES = ("waiting_for_input", "draft_ready")
+
+# Draft mode: a cheap low-res render first. When the full-quality render runs:
+FINAL_SPECULATIVE = "speculative"  # right away, next to the draft (a worker slot was free)
+FINAL_ON_ACCEPT = "on_accept"      # after the user accepts the draft (/accept_draft)
+FINAL_ACCEPTED = "accepted"        # the draft was accepted; rendering now
+
+# How raw terms (Untappd, scraping) become a prompt:
+#   multi - clean_words_with_llm + describe_venues (concurrently), then enrich_prompt
+#   fused - one structured-output call doing all three, falling back to multi if invalid
+#   ab    - picks one of the two at random per job, to compare their latency
+PIPELINE_MODES = ("multi", "fused", "ab")
+
+
+def choose_pipeline_mode() -> str:
+    mode = get_env("PIPELINE_MODE", "multi").strip().lower()
+    if mode not in PIPELINE_MODES:
+        log.warning(f"Unknown PIPELINE_MODE '{mode}', using 'multi'")
+        mode = "multi"
+    if mode == "ab":
+        mode = random.choice(("multi", "fused"))
+    return mode
+
+
+async def run_stage(ctx: JobContext, stage: str, fn, *args):
+    """Runs a blocking stage in the executor, or returns its checkpoint if the job already has one."""
+    if ctx is not None and ctx.has_checkpoint(stage):
+        log.debug(f"Job {ctx.job_id}: reusing checkpoint '{stage}'")
+        return ctx.get_checkpoint(stage)
+    deadline = ctx.deadline if ctx is not None else None
+    started = time.perf_counter()
+    with use_deadline(deadline), log_context(stage=stage):
+        result = await guard(asyncio.to_thread(fn, *args), deadline, f"Stage '{stage}'")
+    if ctx is not None:
+        ctx.timings[stage] = round(time.perf_counter() - started, 3)
+        if result:
+            await ctx.checkpoint(stage, result)
+    return result
+
+
+async def postprocess_stage(ctx: JobContext, task_id: str, image_url: str, model_provider: str) -> dict:
+    """
+    Transcodes the generated image into WebP/AVIF size variants and returns the
+    task fields pointing at them. Falls back to `{"image_url": <original data URI>}`
+    when post-processing is disabled or fails (Pillow missing, read-only disk...).
+    """
+    original = {"image_url": image_url}
+    if not env_flag("IMAGE_POSTPROCESS", True) or not image_url.startswith("data:"):
+        return original
+    await get_task_store().aupdate(task_id, status="optimizing_image", progress=90)
+    try:
+        manifest = ctx.get_checkpoint(STAGE_VARIANTS) if ctx is not None else None
+        # The checkpoint is only useful if the files are on this host's disk.
+        if not manifest or load_manifest(manifest["image_id"]) is None:
+            started = time.perf_counter()
+            manifest = await postprocess_image(image_url, f"{model_provider}_{task_id}")
+            if ctx is not None:
+                ctx.timings[STAGE_VARIANTS] = round(time.perf_counter() - started, 3)
+                await ctx.checkpoint(STAGE_VARIANTS, manifest)
+        return {"image_id": manifest["image_id"], **variant_urls(manifest)}
+    except LeaseLost:
+        raise
+    except Exception as e:
+        log.warning(f"Image post-processing failed, serving original: {type(e).__name__}: {e}")
+        return original
+
+
+async def record_in_gallery(task_id: str, ctx: JobContext, media: dict, **details):
+    """Adds a completed task to the gallery index. Never fails the task."""
+    timings = dict(ctx.timings) if ctx is not None else {}
+    if ctx is not None and ctx.job.created_at:
+        timings["total"] = round(time.time() - ctx.job.created_at, 3)
+    # The data-URI fallback is far too heavy for the index; only variant URLs are kept.
+    stored_media = {k: v for k, v in media.items() if not str(v).startswith("data:")}
+    try:
+        await asyncio.to_thread(
+            get_gallery().record, task_id,
+            timings=timings, image_id=media.get("image_id"), media=stored_media, **details
+        )
+    except Exception as e:
+        log.warning(f"Could not record task {task_id} in gallery: {type(e).__name__}: {e}")
+
+
+# --- Stage functions ----------------------------------------------------------
+
+def _provider(model_provider: str) -> str:
+    # Google, and the default if unknown
+    return "dalle" if model_provider == "dalle" else "google"
+
+
+def _reasoning(rich_data) -> str:
+    return rich_data.get("reasoning", "") if isinstance(rich_data, dict) else ""
+
+
+def scrape_words(cookie: str):
+    words = get_wordcloud_data(cookie)
+    if not words:
+        raise StageFailed("Could not extract words")
+    return words
+
+
+def scrape_raw_words(cookie: str) -> list:
+    words = get_wordcloud_data(cookie, clean=False)
+    if not words:
+        raise StageFailed("Could not extract words")
+    # The simulation hook and the fallback return plain lists; anything else is already categorized.
+    return WordBag.from_json(words).flatten()
+
+
+def fetch_untappd(token: str) -> dict:
+    feed = fetch_untappd_feed(token)
+    if not feed["raw_words"]:
+        raise StageFailed("No words found from Untappd.")
+    return feed
+
+
+def read_image_words(images: list):
+    """OCR as a graph stage. There is no one to ask for words here, so finding none fails the run."""
+    words = get_menu_words(images)
+    if not WordBag.from_json(words):
+        raise StageFailed("No text detected. Please enter words manually.")
+    return words
+
+
+def describe_top_venues(venues: list) -> str:
+    """
+    The vibe of the most checked-in venue sets the scene's atmosphere. The next
+    few (VENUE_VIBES in all) are added as other haunts. The vibes come from the
+    venue cache, and the missing ones from one batched LLM call.
+    """
+    top = list(venues or ())[:max(1, env_int("VENUE_VIBES", 3))]
+    if not top:
+        return ""
+    names = [v.get("name", "") if isinstance(v, dict) else v for v in top]
+    log.info(f"Found venue: {names[0]} (+{len(top) - 1} more). Asking for descriptions...")
+    vibes = describe_venues(top)
+    lines = [vibes[0]] if vibes[0] else []
+    others = [f"- {name}: {vibe}" for name, vibe in zip(names[1:], vibes[1:]) if vibe]
+    if others:
+        lines += ["Also frequented:", *others]
+    return "\n".join(lines)
+
+
+async def _stream_enrichment(report, enrichment_input, style: str, theme: str, venue_description: str, emit):
+    """
+    Streams the enrichment, reporting the partial `visual_prompt` and `reasoning`
+    while they are generated, and emits the prompt as soon as it is complete so
+    the image stage can start before the reasoning is written.
+    """
+    loop = asyncio.get_running_loop()
+    updates = asyncio.Queue()
+
+    def on_update(fields, closed):
+        # Called on the executor thread for every token that changes a field.
+        loop.call_soon_threadsafe(updates.put_nowait, (fields, closed))
+
+    def run():
+        try:
+            return enrich_prompt_stream(enrichment_input, style, theme, venue_description, on_update=on_update)
+        finally:
+            loop.call_soon_threadsafe(updates.put_nowait, None)
+
+    # Copy the context so the stream sees the stage's deadline.
+    enrichment = loop.run_in_executor(None, contextvars.copy_context().run, run)
+    prompt_emitted = False
+    while True:
+        event = await updates.get()
+        # Coalesce updates that queued up while the last store write was in flight.
+        finished = event is None
+        while not finished and not updates.empty():
+            latest = updates.get_nowait()
+            if latest is None:
+                finished = True
+            else:
+                event = latest
+        if event is not None:
+            fields, closed = event
+            prompt = fields.get("visual_prompt", "")
+            await report("prompt", generated_prompt=prompt, reasoning=fields.get("reasoning", ""))
+            if not prompt_emitted and "visual_prompt" in closed and prompt.strip():
+                emit(STAGE_PROMPT, prompt)
+                prompt_emitted = True
+        if finished:
+            break
+    return await enrichment
+
+
+async def enrich_words(report, words, style: str, theme: str, venue_description: str,
+                       prompt_fallback: tuple, emit) -> dict:
+    # Shuffle long word lists to ensure variety, avoiding "header bias".
+    # Structured data is passed as is.
+    bag = WordBag.from_json(words)
+    enrichment_input = bag if bag.categorized else bag.shuffled(500)
+
+    if env_flag("ENRICH_STREAMING", True):
+        rich_data = await _stream_enrichment(report, enrichment_input, style, theme, venue_description or "", emit)
+    else:
+        rich_data = await asyncio.to_thread(enrich_prompt, enrichment_input, style, theme, venue_description or "")
+
+    prompt = ""
+    if rich_data and isinstance(rich_data, dict):
+        prompt = rich_data.get("visual_prompt", "")
+    elif rich_data and isinstance(rich_data, str):
+        prompt = rich_data
+    if not prompt:
+        prefix, limit = prompt_fallback
+        prompt = prefix + ", ".join(bag.top_k(limit))
+    return {STAGE_ENRICHED_PROMPT: rich_data, STAGE_PROMPT: prompt}
+
+
+async def clean_and_enrich_words(report, raw_words: list, venue_names: list, style: str, theme: str,
+                                 prompt_fallback: tuple, emit) -> dict:
+    """Fused mode: one LLM call for categories, venue vibe and prompt."""
+    fused = await asyncio.to_thread(clean_and_enrich, raw_words, style, theme, venue_names)
+    if fused is not None:
+        return {
+            STAGE_WORDS: fused["categories"],
+            STAGE_VENUE_DESCRIPTION: fused["venue_vibe"],
+            STAGE_ENRICHED_PROMPT: {"visual_prompt": fused["visual_prompt"], "reasoning": fused["reasoning"]},
+            STAGE_PROMPT: fused["visual_prompt"],
+            STAGE_PIPELINE_MODE: "fused",
+        }
+
+    # Multi-call fallback: categorize and describe the venue concurrently, then enrich.
+    words, venue_description = await asyncio.gather(
+        asyncio.to_thread(clean_words_with_llm, raw_words),
+        asyncio.to_thread(describe_top_venues, venue_names),
+    )
+    emit(STAGE_WORDS, words)
+    enriched = await enrich_words(report, words, style, theme, venue_description, prompt_fallback, emit)
+    return {
+        STAGE_WORDS: words,
+        STAGE_VENUE_DESCRIPTION: venue_description,
+        **enriched,
+        STAGE_PIPELINE_MODE: "fused_fallback",
+    }
+
+
+async def _generate_with_previews(report, prompt: str) -> str:
+    """
+    Streams the Gemini generation and reports every image it renders on the way
+    (the model's intermediate "thinking" images) as a low-resolution
+    `preview_url`, so the progress screen shows a picture long before the final
+    image is done. The final image replaces the preview when the task completes.
+    """
+    loop = asyncio.get_running_loop()
+    previews = asyncio.Queue()
+
+    def on_image(image_bytes):
+        # Called on the executor thread, so the downscale stays off the loop.
+        loop.call_soon_threadsafe(previews.put_nowait, make_preview(image_bytes))
+
+    def run():
+        try:
+            return generate_image_google(prompt, on_image=on_image)
+        finally:
+            loop.call_soon_threadsafe(previews.put_nowait, None)
+
+    # Copy the context so the generation sees the stage's deadline.
+    generation = loop.run_in_executor(None, contextvars.copy_context().run, run)
+    count = 0
+    finished = False
+    while not finished:
+        # Only the newest of the previews that queued up during the last write is published.
+        preview = None
+        item = await previews.get()
+        while True:
+            if item is None:
+                finished = True
+                break
+            preview = item
+            count += 1
+            if previews.empty():
+                break
+            item = previews.get_nowait()
+        if preview is not None:
+            await report("preview", preview_url=preview, preview_count=count)
+    return await generation
+
+
+async def make_image(report, prompt: str, model_provider: str) -> str:
+    if _provider(model_provider) == "dalle":
+        image_url = await asyncio.to_thread(generate_image_dalle, prompt)
+    elif env_flag("IMAGE_PREVIEWS", True):
+        image_url = await _generate_with_previews(report, prompt)
+    else:
+        image_url = await asyncio.to_thread(generate_image_google, prompt)
+    if not image_url:
+        raise StageFailed("Image generation failed")
+    return image_url
+
+
+def make_draft(prompt: str, model_provider: str) -> str:
+    image_url = generate_draft_image(prompt, _provider(model_provider))
+    if not image_url:
+        raise StageFailed("Draft generation failed")
+    # Drafts are kept on the task record, so they stay small.
+    return make_preview(decode_image_url(image_url), edge=env_int("DRAFT_EDGE", 512))
+
+
+async def make_media(task_id: str, image: str, model_provider: str, ctx) -> dict:
+    return await postprocess_stage(ctx, task_id, image, _provider(model_provider))
+
+
+async def embed_media(image: str, accept: str) -> dict:
+    """
+    For stateless runs: no files are written, so the image travels in the
+    response, re-encoded to WebP/AVIF if the client accepts it.
+    """
+    if not env_flag("IMAGE_POSTPROCESS", True) or not image.startswith("data:"):
+        return {"image_url": image}
+    try:
+        return {"image_url": await asyncio.to_thread(transcode_data_uri, image, accept)}
+    except Exception as e:
+        log.warning(f"Could not re-encode the image, sending the original: {type(e).__name__}: {e}")
+        return {"image_url": image}
+
+
+# Task fields published when a value becomes available: name -> fn(value) -> dict
+PUBLISHED = {
+    STAGE_WORDS: lambda words: {"words": as_json(words), "word_count": len(WordBag.from_json(words))},
+    STAGE_PROMPT: lambda prompt: {"generated_prompt": prompt},
+    STAGE_ENRICHED_PROMPT: lambda rich_data: {"reasoning": _reasoning(rich_data)},
+    STAGE_VENUE_DESCRIPTION: lambda description: {"venue_description": description} if description else {},
+    STAGE_DRAFT: lambda draft: {"draft_url": draft, "draft_status": "ready"} if draft else {"draft_status": "failed"},
+}
+
+# Stages added by register_stage(), run in every generation graph.
+EXTRA_STAGES = []
+
+
+def register_stage(stage: Stage, publish=None):
+    """
+    Adds a stage to every generation graph. It runs as soon as its inputs are
+    available; `publish(value)` optionally maps its output to task fields.
+    """
+    EXTRA_STAGES.append(stage)
+    if publish is not None:
+        for name in stage.outputs:
+            PUBLISHED[name] = publish
+
+
+def generation_stages(fused: bool = False, embedded: bool = False) -> list:
+    """
+    Words (+ venue description) -> prompt -> image -> variants, plus registered
+    stages. `fused` replaces the enrichment with the single clean + enrich call,
+    which consumes the raw terms instead. `embedded` puts the image itself in the
+    media output instead of writing variants to disk (stateless runs).
+    """
+    if fused:
+        enrich = Stage("clean_and_enrich", clean_and_enrich_words,
+                       inputs=("report", STAGE_RAW_WORDS, STAGE_VENUE_NAMES, "style", "theme", "prompt_fallback"),
+                       outputs=(STAGE_WORDS, STAGE_VENUE_DESCRIPTION, STAGE_ENRICHED_PROMPT, STAGE_PROMPT,
+                                STAGE_PIPELINE_MODE),
+                       status="enriching_prompt", progress=30, weight=2)
+    else:
+        enrich = Stage(STAGE_ENRICHED_PROMPT, enrich_words,
+                       inputs=("report", STAGE_WORDS, "style", "theme", STAGE_VENUE_DESCRIPTION, "prompt_fallback"),
+                       outputs=(STAGE_ENRICHED_PROMPT, STAGE_PROMPT),
+                       status="enriching_prompt", progress=40, weight=1.5)
+    return [
+        enrich,
+        # Not checkpointed: the image is a multi-megabyte data URI.
+        Stage(STAGE_IMAGE, make_image, inputs=("report", STAGE_PROMPT, "model_provider"),
+              checkpoint=False, status="generating_art", progress=70, weight=4),
+        Stage(STAGE_VARIANTS, embed_media, inputs=(STAGE_IMAGE, "accept"), outputs=(STAGE_MEDIA,),
+              checkpoint=False, status="optimizing_image", progress=90) if embedded else
+        # Manages its own manifest checkpoint: it is only reusable if the files are on this host.
+        Stage(STAGE_VARIANTS, make_media, inputs=("task_id", STAGE_IMAGE, "model_provider"),
+              outputs=(STAGE_MEDIA,), checkpoint=False),
+        *EXTRA_STAGES,
+    ]
+
+
+async def _spare_capacity(reserve: int = 0) -> bool:
+    """Nothing is waiting in the queue and a worker slot besides this job's (and `reserve` more) is idle."""
+    counts = await asyncio.to_thread(get_job_queue().counts)
+    return counts.get(QUEUED, 0) == 0 and counts.get(RUNNING, 0) < get_worker().concurrency - reserve
+
+
+def _without(stages: list, names: set) -> list:
+    """`stages` minus the named ones and everything that depends on their outputs."""
+    kept, gone = list(stages), set()
+    while True:
+        drop = [s for s in kept if s.name in names or gone.intersection(s.inputs)]
+        if not drop:
+            return kept
+        for stage in drop:
+            kept.remove(stage)
+            gone.update(stage.outputs)
+
+
+async def plan_draft(stages: list, ctx) -> tuple[list, str]:
+    """
+    Adds the draft render to a generation graph and decides when the final one
+    runs (FINAL_*). Speculatively, both start from the prompt at once and the
+    draft is optional. Otherwise the graph ends at the draft and the job waits
+    for the user to accept it. The accepted run leaves the draft out: it is
+    already on the task record, so it isn't checkpointed.
+    """
+    if ctx is not None and ctx.has_checkpoint(STAGE_DRAFT_ACCEPTED):
+        final_mode = FINAL_ACCEPTED
+    elif env_flag("DRAFT_SPECULATIVE", True) and await _spare_capacity():
+        final_mode = FINAL_SPECULATIVE
+    else:
+        final_mode = FINAL_ON_ACCEPT
+
+    if final_mode == FINAL_ACCEPTED:
+        return stages, final_mode
+    if final_mode == FINAL_ON_ACCEPT:
+        draft = Stage(STAGE_DRAFT, make_draft, inputs=(STAGE_PROMPT, "model_provider"),
+                      checkpoint=False, status="drafting", progress=55)
+        return _without(stages, {STAGE_IMAGE}) + [draft], final_mode
+    draft = Stage(STAGE_DRAFT, make_draft, inputs=(STAGE_PROMPT, "model_provider"), optional=True,
+                  checkpoint=False)
+    return stages + [draft], final_mode
+
+
+async def mark_stopped(task_id: str, e: TaskCancelled):
+    """Records why a job stopped early. After a lost lease, the task belongs to the new worker."""
+    if e.reason == LEASE_LOST:
+        return
+    log.info(f"Task {task_id} stopped: {e.reason}")
+    if e.reason == TIMEOUT:
+        await get_task_store().aupdate(task_id, status="failed", error=f"Timed out: {e}", progress=100)
+    else:
+        error = "Cancelled" if e.reason == CANCELLED else "Cancelled: nobody was watching this task"
+        await get_task_store().aupdate(task_id, status="cancelled", error=error, progress=100)
+
+
+async def run_generation(task_id: str, ctx: JobContext, initial: dict, source_stages: list = (), fused: bool = False,
+                         draft: bool = False, precomputed: dict = None):
+    """
+    Runs the source stages plus the generation stages and completes the task.
+    With `draft`, a low-res draft is rendered too (see `plan_draft()`), and the
+    task may stop at "draft_ready" until the user accepts it. Stages whose
+    outputs are all in `precomputed` (speculative results) are skipped and the
+    values used instead.
+    """
+    store = get_task_store()
+
+    async def on_start(stage):
+        if stage.status:
+            await store.aupdate(task_id, status=stage.status, progress=stage.progress)
+
+    async def on_output(name, value):
+        publish = PUBLISHED.get(name)
+        fields = publish(value) if publish is not None else None
+        if fields:
+            await store.aupdate(task_id, **fields)
+
+    # Partial results (the prompt as it streams, image previews) from inside stages.
+    async def report(kind, **fields):
+        await store.aupdate(task_id, **fields)
+
+    try:
+        stages = list(source_stages) + generation_stages(fused)
+        final_mode = None
+        if draft:
+            stages, final_mode = await plan_draft(stages, ctx)
+            await store.aupdate(task_id, draft=True, final_mode=final_mode)
+        if precomputed:
+            stages = [stage for stage in stages if not set(stage.outputs) <= set(precomputed)]
+            initial = {**initial, **precomputed}
+        initial = {"task_id": task_id, "report": report, **initial}
+        if not any(STAGE_VENUE_DESCRIPTION in stage.outputs for stage in stages):
+            initial[STAGE_VENUE_DESCRIPTION] = ""
+        for name, value in initial.items():
+            await on_output(name, value)
+        values = await run_graph(stages, initial, ctx, on_start=on_start, on_output=on_output)
+        if final_mode == FINAL_ON_ACCEPT:
+            # Parked: /accept_draft requeues the job for the final render.
+            await store.aupdate(task_id, status="draft_ready", progress=60)
+            return
+
+        media = values[STAGE_MEDIA]
+        words = as_json(values[STAGE_WORDS])
+        prompt = values[STAGE_PROMPT]
+        reasoning = _reasoning(values[STAGE_ENRICHED_PROMPT])
+        await store.aupdate(
+            task_id,
+            status="completed",
+            progress=100,
+            words=words,
+            generated_prompt=prompt,
+            reasoning=reasoning,
+            preview_url=None,
+            **media
+        )
+        await record_in_gallery(task_id, ctx, media, style=values["style"],
+                                provider=_provider(values["model_provider"]), theme=values["theme"],
+                                prompt=prompt, reasoning=reasoning, words=words,
+                                pipeline_mode=values.get(STAGE_PIPELINE_MODE))
+    except StageFailed as e:
+        await store.aupdate(task_id, status="failed", error=str(e), progress=100)
+    except TaskCancelled as e:
+        await mark_stopped(task_id, e)
+    except LeaseLost:
+        # Fenced out (the lease expired or the job was cancelled): the task belongs to someone else now.
+        raise
+    except Exception as e:
+        log.exception(f"Task {task_id} failed")
+        error_msg = f"{type(e).__name__}: {str(e)}"
+        await store.aupdate(task_id, status="failed", error=error_msg, progress=100)
+
+
+# --- Pipelines ------------------------------------------------------------------
+
+# Kept for backward compatibility if needed
+async def process_wordcloud(task_id: str, cookie: str, ctx: JobContext = None, pipeline_mode: str = "multi"):
+    fused = pipeline_mode == "fused"
+    initial = {
+        "cookie": cookie,
+        "style": "dali",
+        "theme": "Beer",
+        "model_provider": "google",
+        "prompt_fallback": ("A surrealist masterpiece with ", 10),
+    }
+    if fused:
+        # The scraper has no separate venue list; the fused call finds venues among the terms.
+        initial[STAGE_VENUE_NAMES] = []
+        source_stages = [Stage("scrape_words", scrape_raw_words, inputs=("cookie",), outputs=(STAGE_RAW_WORDS,),
+                               status="extracting_words", progress=10, weight=3)]
+    else:
+        initial[STAGE_PIPELINE_MODE] = "multi"
+        source_stages = [Stage("scrape_words", scrape_words, inputs=("cookie",), outputs=(STAGE_WORDS,),
+                               status="extracting_words", progress=10, weight=3)]
+    await run_generation(task_id, ctx, initial, source_stages, fused=fused)
+
+async def continue_generation_task(task_id: str, words: list[str], style: str, model_provider: str, theme: str = "Beer", ctx: JobContext = None,
+                                   draft: bool = False):
+    await run_generation(task_id, ctx, {
+        STAGE_WORDS: words,
+        "style": style,
+        "theme": theme,
+        "model_provider": model_provider,
+        "prompt_fallback": ("A list of items: ", 20),
+    }, draft=draft)
+
+async def process_ocr_task(task_id: str, images: list, style: str, model_provider: str, theme: str = "Beer", ctx: JobContext = None,
+                           draft: bool = False):
+    store = get_task_store()
+    await store.aupdate(task_id, status="analyzing_image", progress=10)
+
+    try:
+        # Step 1: OCR (GPT-4o Vision, one call per contact sheet of the photos)
+        words = await run_stage(ctx, STAGE_OCR_WORDS, get_menu_words, images)
+
+        if not WordBag.from_json(words):
+             # If no words found, wait for manual input
+             await store.aupdate(
+                 task_id,
+                 status="waiting_for_input",
+                 progress=20,
+                 style=style,
+                 model_provider=model_provider,
+                 theme=theme,
+                 error="No text detected. Please enter words manually."
+             )
+             return
+
+        # Proceed to generation if words found
+        await continue_generation_task(task_id, words, style, model_provider, theme, ctx=ctx, draft=draft)
+
+    except TaskCancelled as e:
+        await mark_stopped(task_id, e)
+    except LeaseLost:
+        # Fenced out (the lease expired or the job was cancelled): the task belongs to someone else now.
+        raise
+    except Exception as e:
+        log.exception(f"Task {task_id} failed")
+        error_msg = f"{type(e).__name__}: {str(e)}"
+        await store.aupdate(task_id, status="failed", error=error_msg, progress=100)
+
+
+async def process_untappd(task_id: str, token: str, style: str, model_provider: str, ctx: JobContext = None,
+                          pipeline_mode: str = "multi", draft: bool = False, speculated: dict = None):
+    fused = pipeline_mode == "fused"
+    initial = {
+        "token": token,
+        "style": style,
+        "theme": "Beer",
+        "model_provider": model_provider,
+        "prompt_fallback": ("A list of items: ", 20),
+    }
+    if speculated:
+        # Words and prompt were computed in the background (see SpeculationScheduler): straight to the image.
+        initial.update({STAGE_WORDS: speculated["words"], STAGE_VENUE_DESCRIPTION: speculated["venue_description"],
+                        STAGE_PIPELINE_MODE: "precomputed"})
+        precomputed = {STAGE_ENRICHED_PROMPT: speculated["enriched_prompt"], STAGE_PROMPT: speculated["prompt"]}
+        if draft and speculated.get("draft"):
+            precomputed[STAGE_DRAFT] = speculated["draft"]
+        await run_generation(task_id, ctx, initial, draft=draft, precomputed=precomputed)
+        return
+    if not fused:
+        initial[STAGE_PIPELINE_MODE] = "multi"
+    await run_generation(task_id, ctx, initial, untappd_stages(fused), fused=fused, draft=draft)
+
+
+def untappd_stages(fused: bool) -> list:
+    """Fetches the feed; without `fused`, also categorizes the terms and describes the top venue."""
+    stages = [
+        Stage("fetch_untappd", fetch_untappd, inputs=("token",),
+              outputs=(STAGE_RAW_WORDS, STAGE_VENUE_NAMES, STAGE_VENUES),
+              status="fetching_untappd", progress=10, weight=0.5),
+    ]
+    if not fused:
+        # The venue is described while the LLM is still categorizing the words.
+        stages += [
+            Stage("clean_words", clean_words_with_llm, inputs=(STAGE_RAW_WORDS,), outputs=(STAGE_WORDS,)),
+            Stage("describe_venue", describe_top_venues, inputs=(STAGE_VENUES,),
+                  outputs=(STAGE_VENUE_DESCRIPTION,), optional=True),
+        ]
+    return stages
+
+
+# --- Single-request streaming ----------------------------------------------------
+
+# Pipelines the streaming route can run
+STREAM_MANUAL = "manual"
+STREAM_OCR = "ocr"
+STREAM_UNTAPPD = "untappd"
+STREAM_SOURCES = (STREAM_MANUAL, STREAM_OCR, STREAM_UNTAPPD)
+
+
+class StreamContext:
+    """
+    Stands in for `JobContext` when a pipeline runs inside one request: a
+    deadline and stage timings, but no job, so nothing is checkpointed.
+    """
+
+    def __init__(self, run_id: str, deadline_seconds: float = None):
+        self.job_id = run_id
+        self.timings = {}
+        self.deadline = Deadline(deadline_seconds or None)
+
+    def has_checkpoint(self, stage: str) -> bool:
+        return False
+
+    def get_checkpoint(self, stage: str, default=None):
+        return default
+
+    def cancel(self, reason: str = CANCELLED):
+        self.deadline.cancel(reason)
+
+    async def checkpoint(self, stage: str, value):
+        pass
+
+
+async def stream_generation(stream: EventStream, source: str, style: str, model_provider: str, theme: str = "Beer",
+                            words: list = None, images: list = None, token: str = None,
+                            deadline_seconds: float = None, accept: str = ""):
+    """
+    Runs a whole pipeline within the current request and writes its progress to
+    `stream` (`app.core.event_stream`). Nothing is stored: no task record, job,
+    checkpoint or media file, so it works on hosts that freeze or recycle the
+    instance once the response is sent. Events, in order:
+
+        started                       run_id, deadline_seconds
+        stage                         stage, status, progress (per stage)
+        prompt, preview               partial results; newer ones replace older
+        data                          words, generated_prompt, reasoning, ...
+        result | error                the image (a data URI) and details | error, reason
+
+    The stream is always closed at the end. Cancelling this coroutine (the
+    client went away) cancels the run's deadline, which stops provider calls.
+    """
+    run_id = str(uuid.uuid4())
+    ctx = StreamContext(run_id, deadline_seconds)
+    fused = False
+    initial = {
+        "task_id": run_id,
+        "style": style,
+        "theme": theme,
+        "model_provider": model_provider,
+        "accept": accept,
+        "prompt_fallback": ("A list of items: ", 20),
+    }
+    if source == STREAM_MANUAL:
+        initial[STAGE_WORDS] = words
+        source_stages = []
+    elif source == STREAM_OCR:
+        initial["images"] = images
+        source_stages = [Stage("ocr", read_image_words, inputs=("images",), outputs=(STAGE_WORDS,),
+                               status="analyzing_image", progress=10, weight=1.5)]
+    elif source == STREAM_UNTAPPD:
+        fused = choose_pipeline_mode() == "fused"
+        initial["token"] = token
+        if not fused:
+            initial[STAGE_PIPELINE_MODE] = "multi"
+        source_stages = untappd_stages(fused)
+    else:
+        raise ValueError(f"Unknown stream source: {source}")
+
+    async def on_start(stage):
+        if stage.status:
+            await stream.send("stage", stage=stage.name, status=stage.status, progress=stage.progress)
+
+    async def on_output(name, value):
+        publish = PUBLISHED.get(name)
+        fields = publish(value) if publish is not None else None
+        if fields:
+            await stream.send("data", **fields)
+
+    async def report(kind, **fields):
+        stream.update(kind, **fields)
+
+    started = time.perf_counter()
+    with task_scope(run_id), log_context(task_id=run_id):
+        try:
+            await stream.send("started", run_id=run_id, source=source, deadline_seconds=deadline_seconds)
+            stages = source_stages + generation_stages(fused, embedded=True)
+            initial["report"] = report
+            if not any(STAGE_VENUE_DESCRIPTION in stage.outputs for stage in stages):
+                initial[STAGE_VENUE_DESCRIPTION] = ""
+            values = await run_graph(stages, initial, ctx, on_start=on_start, on_output=on_output)
+            ctx.timings["total"] = round(time.perf_counter() - started, 3)
+            await stream.send(
+                "result",
+                status="completed",
+                words=as_json(values[STAGE_WORDS]),
+                generated_prompt=values[STAGE_PROMPT],
+                reasoning=_reasoning(values[STAGE_ENRICHED_PROMPT]),
+                pipeline_mode=values.get(STAGE_PIPELINE_MODE),
+                timings=ctx.timings,
+                **values[STAGE_MEDIA],
+            )
+        except StageFailed as e:
+            await stream.send("error", status="failed", error=str(e))
+        except TaskCancelled as e:
+            status = "failed" if e.reason == TIMEOUT else "cancelled"
+            await stream.send("error", status=status, reason=e.reason, error=str(e))
+        except asyncio.CancelledError:
+            log.info(f"Stream {run_id} closed by the client, stopping")
+            ctx.cancel(CANCELLED)
+            raise
+        except Exception as e:
+            log.exception(f"Stream {run_id} failed")
+            await stream.send("error", status="failed", error=f"{type(e).__name__}: {str(e)}")
+        finally:
+            stream.close()
+
+
+# --- Durable job queue glue -------------------------------------------------
+
+# Job kinds submitted by the routes
+JOB_WORDCLOUD = "wordcloud"
+JOB_OCR = "ocr"
+JOB_MANUAL = "manual"
+JOB_UNTAPPD = "untappd"
+JOB_SPECULATE = "speculate"
+
+# Relative cost of each kind in the fair queue (roughly its share of provider time).
+JOB_COSTS = {
+    JOB_WORDCLOUD: 2.0,   # Playwright scrape + LLM cleaning
+    JOB_OCR: 1.5,         # Vision OCR before the generation
+    JOB_MANUAL: 1.0,
+    JOB_UNTAPPD: 1.2,
+    JOB_SPECULATE: 1.0,
+}
+
+
+async def run_job(job, ctx: JobContext) -> str:
+    """Worker handler: dispatches a claimed job to its pipeline and reports the outcome."""
+    # Tags the job's log records and lets an admin profile it by task id (see app.core.profiling).
+    with task_scope(job.job_id), log_context(task_id=job.job_id):
+        return await _dispatch_job(job, ctx)
+
+
+async def _dispatch_job(job, ctx: JobContext) -> str:
+    p = job.params
+    task_id = job.job_id
+    if job.kind == JOB_SPECULATE:
+        # Background work with no task record for anyone to poll.
+        await speculate_feed(p["owner"], ctx)
+        return "done"
+    draft = bool(p.get("draft"))
+    store = get_task_store()
+    if await store.aget(task_id) is None:
+        # The task record expired or lived in a per-process store that was lost; recreate it.
+        await store.aput(task_id, {"status": "queued", "progress": 0})
+
+    if job.kind == JOB_WORDCLOUD:
+        await process_wordcloud(task_id, p.get("cookie"), ctx=ctx, pipeline_mode=p.get("pipeline_mode", "multi"))
+    elif job.kind == JOB_OCR:
+        if ctx.has_checkpoint(STAGE_OCR_WORDS):
+            # Resumed with manual words (or recovered after OCR finished).
+            await continue_generation_task(task_id, ctx.get_checkpoint(STAGE_OCR_WORDS), p["style"],
+                                           p["model_provider"], p.get("theme", "Beer"), ctx=ctx, draft=draft)
+        else:
+            await process_ocr_task(task_id, unpack_images(job.payload, p.get("image_sizes")), p["style"], p["model_provider"], p.get("theme", "Beer"), ctx=ctx,
+                                   draft=draft)
+    elif job.kind == JOB_MANUAL:
+        await continue_generation_task(task_id, p["words"], p["style"], p["model_provider"], p.get("theme", "Beer"), ctx=ctx,
+                                       draft=draft)
+    elif job.kind == JOB_UNTAPPD:
+        await process_untappd(task_id, p["token"], p["style"], p["model_provider"], ctx=ctx,
+                              pipeline_mode=p.get("pipeline_mode", "multi"), draft=draft, speculated=p.get("speculated"))
+    else:
+        await store.aupdate(task_id, status="failed", error=f"Unknown job kind: {job.kind}", progress=100)
+
+    final = await store.aget(task_id) or {}
+    if final.get("status") in WAITING_STATUSES:
+        # Keep the flight open: followers wait on the same resume.
+        return "waiting"
+    await _land_flight(task_id)
+    if final.get("status") in ("failed", "cancelled"):
+        return final["status"]
+    return "done"
+
+
+async def _land_flight(task_id: str):
+    followers = await asyncio.to_thread(get_flight_registry().land, task_id)
+    if followers:
+        log.info(f"Task {task_id} served {followers} coalesced follower(s)")
+
+
+async def _mark_abandoned(job):
+    await get_task_store().aput(job.job_id, {
+        "status": "failed",
+        "progress": 100,
+        "error": "Generation was interrupted too many times. Please try again.",
+    })
+    await _land_flight(job.job_id)
+
+
+async def _housekeeping():
+    """
+    Worker timer: deletes finished jobs older than JOB_RETENTION_SECONDS and
+    cancels parked jobs (drafts, manual words) nobody resumed within
+    JOB_WAITING_TTL_SECONDS.
+    """
+    queue = get_job_queue()
+    now = time.time()
+    pruned = await asyncio.to_thread(queue.prune, now - env_float("JOB_RETENTION_SECONDS", 24 * 3600))
+    expired = await asyncio.to_thread(queue.expire_waiting, now - env_float("JOB_WAITING_TTL_SECONDS", 24 * 3600))
+    for task_id in expired:
+        try:
+            await get_task_store().atransition(task_id, WAITING_STATUSES, "cancelled", progress=100,
+                                               error="Expired while waiting for input")
+        except TaskNotFound:
+            pass
+        await _land_flight(task_id)
+    if pruned or expired:
+        log.info(f"Job housekeeping: pruned {pruned} finished job(s), expired {len(expired)} waiting job(s)",
+                 extra={"event": "jobs.housekeeping", "pruned": pruned, "expired": len(expired)})
+
+
+_worker = None
+
+
+def get_worker() -> JobWorker:
+    global _worker
+    if _worker is None:
+        _worker = JobWorker(
+            get_job_queue(),
+            run_job,
+            concurrency=env_int("JOB_WORKER_CONCURRENCY", 4),
+            poll_interval=env_float("JOB_POLL_INTERVAL", 2.0),
+            on_abandoned=_mark_abandoned,
+            deadline_seconds=env_float("JOB_DEADLINE_SECONDS", 300),
+            watchdog=_watch_job,
+            housekeeping=_housekeeping,
+            housekeeping_interval=env_float("JOB_HOUSEKEEPING_INTERVAL", 300),
+        )
+    return _worker
+
+
+# Polls refresh `last_polled` at most this often, to keep /status cheap.
+POLL_TOUCH_SECONDS = 5
+
+
+async def note_poll(task_id: str, record: dict):
+    """Called by /status: marks the task as still watched (see `_watch_job`)."""
+    if record.get("status") in FINAL_STATUSES:
+        return
+    now = time.time()
+    if now - (record.get("last_polled") or 0) >= POLL_TOUCH_SECONDS:
+        await get_task_store().aupdate(task_id, last_polled=now)
+
+
+async def _watch_job(ctx: JobContext):
+    """Worker watchdog: stops a job whose task nobody has polled for TASK_ABANDON_SECONDS (tab closed)."""
+    limit = ctx.job.params.get("abandon_seconds", env_float("TASK_ABANDON_SECONDS", 90))
+    if not limit:
+        return None
+    record = await get_task_store().aget(ctx.job_id) or {}
+    last_seen = max(record.get("last_polled") or 0, ctx.job.created_at or 0)
+    if time.time() - last_seen > limit:
+        return ABANDONED
+    return None
+
+
+async def cancel_task(task_id: str):
+    """
+    Cancels a task (for /cancel). A coalesced follower only detaches from its
+    leader; a leader whose job is shared with followers keeps running for them.
+    Returns the task's record afterwards, or None if there is no such task.
+    """
+    store = get_task_store()
+    record = await store.aget(task_id)
+    if record is None or record.get("status") in FINAL_STATUSES:
+        return record
+    leader_id = record.get("coalesced_with")
+    if leader_id:
+        await asyncio.to_thread(get_flight_registry().leave, leader_id)
+        return await store.aupdate(task_id, coalesced_with=None, status="cancelled", error="Cancelled", progress=100)
+    if await asyncio.to_thread(get_flight_registry().followers, task_id):
+        log.info(f"Task {task_id} is shared with followers, not cancelling its job")
+        return record
+
+    previous = await asyncio.to_thread(get_job_queue().cancel, task_id)
+    if previous is None:
+        return await store.aget(task_id)
+    record = await store.aupdate(task_id, status="cancelled", error="Cancelled", progress=100)
+    if previous == RUNNING:
+        # Running here: stopped right away. Elsewhere: at that worker's next heartbeat.
+        get_worker().cancel(task_id, CANCELLED)
+    else:
+        await _land_flight(task_id)
+    return record
+
+
+def pack_images(images: list) -> tuple:
+    """
+    Photos of one upload as a single job payload: `(payload, sizes)`. The sizes
+    go in the job params so the worker can split the payload again.
+    """
+    return b"".join(images), [len(image) for image in images]
+
+
+def unpack_images(payload: bytes, sizes: list = None) -> list:
+    """The photos of a job payload (jobs queued before multi-photo uploads carry one, without sizes)."""
+    if not sizes:
+        return [payload]
+    images, offset = [], 0
+    for size in sizes:
+        images.append(payload[offset:offset + size])
+        offset += size
+    return images
+
+
+async def submit_job(task_id: str, kind: str, params: dict, payload: bytes = None, flight_key: str = None,
+                     owner: str = None, weight: float = 1.0, reservation: str = None):
+    """
+    Persists a job and wakes this process's worker (starting it if the lifespan
+    hook didn't run). With a `flight_key`, an identical in-flight job absorbs the
+    submission instead: the task is marked `coalesced_with` that job's id, which
+    is returned. Returns None when a new job was queued.
+    `owner` (the session) and `weight` place the job in the fair queue. The
+    admission `reservation` is consumed by the new job, or released if the
+    submission was absorbed.
+    """
+    if flight_key and env_flag("SINGLEFLIGHT_ENABLED", True):
+        leader_id = await asyncio.to_thread(get_flight_registry().join_or_lead, flight_key, task_id)
+        if leader_id:
+            if reservation:
+                await asyncio.to_thread(get_job_queue().release_reservation, reservation)
+            await get_task_store().aupdate(task_id, coalesced_with=leader_id)
+            log.info(f"Task {task_id} coalesced with in-flight task {leader_id}")
+            return leader_id
+    if kind in (JOB_WORDCLOUD, JOB_UNTAPPD):
+        # Chosen once at submit, so a recovered job keeps its mode (and its checkpoints stay valid).
+        params = {**params, "pipeline_mode": choose_pipeline_mode()}
+    await asyncio.to_thread(get_job_queue().submit, task_id, kind, params, payload,
+                            owner=owner, cost=JOB_COSTS.get(kind, 1.0), weight=weight, reservation=reservation)
+    worker = get_worker()
+    worker.start()
+    worker.notify()
+    return None
+
+
+async def resume_job(task_id: str, words) -> bool:
+    """Requeues a job parked in waiting_for_input with the user's words as its OCR result."""
+    return await _requeue(task_id, STAGE_OCR_WORDS, words)
+
+
+async def accept_draft(task_id: str) -> bool:
+    """Requeues a job parked at draft_ready to render the final image."""
+    return await _requeue(task_id, STAGE_DRAFT_ACCEPTED, True)
+
+
+async def _requeue(task_id: str, stage: str, value) -> bool:
+    resumed = await asyncio.to_thread(get_job_queue().resume, task_id, stage, value)
+    if resumed:
+        worker = get_worker()
+        worker.start()
+        worker.notify()
+    return resumed
+
+
+# --- Speculative pre-generation ---------------------------------------------------
+
+# Fair-queue owner of every speculative job, so together they get a single lane.
+SPECULATION_OWNER = "speculation"
+SPECULATION_PROMPT_FALLBACK = ("A list of items: ", 20)
+
+
+def feed_hash(raw_words: list) -> str:
+    return hashlib.sha256(json.dumps(raw_words, ensure_ascii=False).encode()).hexdigest()
+
+
+def speculation_budget() -> int:
+    """Speculative LLM and image calls allowed per UTC day, across all processes."""
+    return env_int("SPECULATION_DAILY_BUDGET", 200)
+
+
+async def _ignore_report(kind, **fields):
+    pass
+
+
+def _ignore_emit(name, value):
+    pass
+
+
+async def speculate_feed(owner: str, ctx: JobContext = None):
+    """
+    Refreshes one subscriber (see app.core.speculation). Fetches the feed and, for
+    the favourite styles whose result wasn't computed from this exact feed,
+    categorizes the words, describes the venues and writes a prompt (plus a
+    draft, if enabled). The calls are reserved from the daily budget up
+    front. Without room, or on any error, the refresh waits for the next
+    interval.
+    """
+    store = get_speculation_store()
+    sub = await asyncio.to_thread(store.subscriber, owner)
+    if sub is None:
+        return
+    deadline = ctx.deadline if ctx is not None else None
+    try:
+        with use_deadline(deadline):
+            await guard(_speculate(store, sub), deadline, "Speculation")
+    except (TaskCancelled, LeaseLost):
+        raise
+    except Exception as e:
+        log.warning(f"Speculation for session {owner[:8]} failed: {e}", extra={"event": "speculation.failed"})
+
+
+async def _speculate(store, sub: dict):
+    owner = sub["owner"]
+    feed = await asyncio.to_thread(fetch_untappd_feed, sub["token"])
+    if not feed["raw_words"]:
+        return
+    digest = feed_hash(feed["raw_words"])
+    # Recorded first: results from an older feed are stale from now on, even if this refresh stops early.
+    await asyncio.to_thread(store.mark_checked, owner, digest)
+    current = await asyncio.to_thread(store.current_styles, owner, digest)
+    styles = [style for style in sub["styles"] if style not in current]
+    if not styles:
+        log.debug(f"Speculation: feed unchanged for session {owner[:8]}")
+        return
+
+    drafts = sub["drafts"] and env_flag("SPECULATION_DRAFTS", False)
+    calls = 2 + len(styles) * (2 if drafts else 1)  # clean + venues, then a prompt (and draft) per style
+    if not await asyncio.to_thread(store.try_spend, calls, speculation_budget()):
+        log.info(f"Speculation budget exhausted; skipping session {owner[:8]}", extra={"event": "speculation.budget"})
+        return
+
+    words, venue_description = await asyncio.gather(
+        asyncio.to_thread(clean_words_with_llm, feed["raw_words"]),
+        asyncio.to_thread(describe_top_venues, feed["venues"]),
+    )
+    if not WordBag.from_json(words):
+        return
+    for style in styles:
+        enriched = await enrich_words(_ignore_report, words, style, "Beer", venue_description,
+                                      SPECULATION_PROMPT_FALLBACK, _ignore_emit)
+        result = {
+            "words": as_json(words),
+            "venue_description": venue_description,
+            "enriched_prompt": enriched[STAGE_ENRICHED_PROMPT],
+            "prompt": enriched[STAGE_PROMPT],
+        }
+        if drafts:
+            try:
+                result["draft"] = await asyncio.to_thread(make_draft, result["prompt"], sub["model_provider"])
+            except StageFailed:
+                pass
+        await asyncio.to_thread(store.put_result, owner, style, digest, sub["model_provider"], result)
+    log.info(f"Precomputed {len(styles)} style(s) for session {owner[:8]}", extra={"event": "speculation.done"})
+
+
+class SpeculationScheduler:
+    """
+    Opt-in background refresh of the subscribers' Untappd feeds. Every `tick`
+    seconds, if nothing is queued, at least `reserve` + 1 worker slots are
+    idle and today's budget isn't spent, up to `per_tick` subscribers are queued as
+    speculative jobs. Each subscriber is refreshed at most every `interval`
+    seconds. The jobs have a low fair-queue weight and a short deadline. Nobody
+    polls them, so they are exempt from the abandon watchdog. Subscribers not
+    seen for `idle_ttl` seconds are skipped and then deleted.
+    """
+
+    def __init__(self, tick: float = 60.0, interval: float = 900.0, per_tick: int = 2, reserve: int = 1,
+                 idle_ttl: float = 14 * 24 * 3600):
+        self.tick = tick
+        self.interval = interval
+        self.per_tick = per_tick
+        self.reserve = reserve
+        self.idle_ttl = idle_ttl
+        self._task = None
+        self.queued = 0
+        self.skipped_busy = 0
+        self.skipped_budget = 0
+        self.pruned = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="speculation-scheduler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.run_once()
+            except Exception:
+                log.exception("Speculation scheduler tick failed")
+
+    async def run_once(self) -> int:
+        """Queues the subscribers that are due, capacity and budget permitting. Returns how many."""
+        store = get_speculation_store()
+        if self.idle_ttl:
+            pruned = await asyncio.to_thread(store.prune_idle, self.idle_ttl)
+            if pruned:
+                log.info(f"Dropped {pruned} idle speculation subscriber(s)")
+                self.pruned += pruned
+        if not await _spare_capacity(self.reserve):
+            self.skipped_busy += 1
+            return 0
+        if await asyncio.to_thread(store.spent_today) >= speculation_budget():
+            self.skipped_budget += 1
+            return 0
+        owners = await asyncio.to_thread(store.claim_due, self.per_tick, self.interval, self.idle_ttl)
+        for owner in owners:
+            await submit_job(str(uuid.uuid4()), JOB_SPECULATE, {
+                "owner": owner,
+                "deadline_seconds": env_float("SPECULATION_DEADLINE_SECONDS", 120),
+                "abandon_seconds": 0,
+            }, owner=SPECULATION_OWNER, weight=env_float("SPECULATION_WEIGHT", 0.25))
+        self.queued += len(owners)
+        return len(owners)
+
+    async def stats(self) -> dict:
+        stats = await asyncio.to_thread(get_speculation_store().stats)
+        stats.update({
+            "enabled": self._task is not None and not self._task.done(),
+            "daily_budget": speculation_budget(),
+            "queued": self.queued,
+            "skipped_busy": self.skipped_busy,
+            "skipped_budget": self.skipped_budget,
+            "pruned_idle": self.pruned,
+        })
+        return stats
+
+
+_speculation_scheduler = None
+
+
+def get_speculation_scheduler() -> SpeculationScheduler:
+    global _speculation_scheduler
+    if _speculation_scheduler is None:
+        _speculation_scheduler = SpeculationScheduler(
+            tick=env_float("SPECULATION_TICK_SECONDS", 60),
+            interval=env_float("SPECULATION_INTERVAL_SECONDS", 900),
+            per_tick=env_int("SPECULATION_PER_TICK", 2),
+            reserve=env_int("SPECULATION_RESERVED_SLOTS", 1),
+            idle_ttl=env_float("SPECULATION_IDLE_TTL_SECONDS", 14 * 24 * 3600),
+        )
+    return _speculation_scheduler
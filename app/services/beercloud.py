@@ -1,23 +1,45 @@
-try:
-    from playwright.sync_api import sync_playwright
-except ImportError:
-    sync_playwright = None
-
+import json
 import time
 import re
-import os
-import requests
-from openai import OpenAI
-from dotenv import load_dotenv
+from app.config import env_int
+from app.services.registry import get_openai_client, get_requests, get_sync_playwright
+from app.core.deadline import call_timeout, deadline_reached
+from app.core.words import WordBag, CATEGORIES
+from app.core.fuzzy import compact_terms
+from app.core.logs import get_logger
+from app.core.venue_cache import get_venue_cache, venue_key
+
+log = get_logger(__name__)
 
-load_dotenv()
+# Categories produced by clean_words_with_llm (and the fused clean + enrich call)
+WORD_CATEGORIES = list(CATEGORIES)
 
 def get_untappd_friends_words(access_token: str) -> dict:
     """
     Fetches recent check-ins from the user's friends feed via Untappd API 
     and extracts relevant words, categorized.
     """
-    print("DEBUG: Fetching Untappd friends feed...")
+    words = fetch_untappd_terms(access_token)
+    if not words:
+        return []
+    return clean_words_with_llm(words)
+
+def fetch_untappd_terms(access_token: str) -> list[str]:
+    """
+    Fetches recent check-ins from the user's friends feed and returns the raw
+    terms (beer, style, brewery, venue, city) without LLM cleaning.
+    """
+    return fetch_untappd_feed(access_token)["raw_words"]
+
+
+def fetch_untappd_feed(access_token: str) -> dict:
+    """
+    Like `fetch_untappd_terms`, but also returns the venue names on their own
+    (most frequent first), so the venue can be described without waiting for
+    the LLM to categorize the terms. `venues` pairs each name with its city.
+    Returns `{"raw_words": [...], "venue_names": [...], "venues": [{"name", "city"}, ...]}`.
+    """
+    log.info("Fetching Untappd friends feed...")
     try:
         # Endpoint for User's Friend Activity Feed: /v4/checkin/recent
         # Note: This endpoint might return global or friends depending on params, 
@@ -26,15 +48,17 @@ def get_untappd_friends_words(access_token: str) -> dict:
         url = "https://api.untappd.com/v4/checkin/recent" 
         params = {"access_token": access_token, "limit": 50}
         
-        response = requests.get(url, params=params)
+        response = get_requests().get(url, params=params, timeout=call_timeout(20))
         if response.status_code != 200:
-            print(f"Error fetching Untappd data: {response.text}")
-            return []
+            log.error(f"Error fetching Untappd data: HTTP {response.status_code}", extra={"body": response.text})
+            return {"raw_words": [], "venue_names": [], "venues": []}
             
         data = response.json()
         items = data.get("response", {}).get("checkins", {}).get("items", [])
         
         words = []
+        venues = WordBag()
+        cities = {}
         for item in items:
             beer = item.get("beer", {})
             brewery = item.get("brewery", {})
@@ -54,46 +78,42 @@ def get_untappd_friends_words(access_token: str) -> dict:
                 
             # Extract Location (City/Venue)
             if venue:
+                 city = venue.get("location", {}).get("venue_city")
                  if venue.get("venue_name"):
                      words.append(venue["venue_name"])
-                 if venue.get("location", {}).get("venue_city"):
-                     words.append(venue["location"]["venue_city"])
+                     venues.add(venue["venue_name"])
+                     cities.setdefault(venue["venue_name"].strip(), city)
+                 if city:
+                     words.append(city)
 
-        # Shuffle and Clean
-        print(f"DEBUG: Found {len(words)} raw terms from Untappd.")
-        return clean_words_with_llm(words)
+        log.info(f"Found {len(words)} raw terms from Untappd.")
+        venue_names = venues.top_k()
+        return {
+            "raw_words": words,
+            "venue_names": venue_names,
+            "venues": [{"name": name, "city": cities.get(name)} for name in venue_names],
+        }
 
     except Exception as e:
-        print(f"Error in get_untappd_friends_words: {e}")
-        return []
+        log.error(f"Error in fetch_untappd_feed: {e}")
+        return {"raw_words": [], "venue_names": [], "venues": []}
 
-def clean_words_with_llm(raw_words: list[str]) -> dict:
+def clean_words_with_llm(raw_words: list[str]) -> WordBag:
     """
     Uses OpenAI to clean the scraped word list and categorize it.
-    Returns a dict with keys: 'beer_styles', 'breweries', 'venues', 'friends', 'flavors', 'miscellaneous'.
+    Returns a categorized WordBag ('beer_styles', 'breweries', 'venues', 'friends', 'flavors', 'miscellaneous').
     """
-    openai_key = os.getenv("OPENAI_API_KEY")
+    client = get_openai_client()
     # If no key or no words, return basic structure with raw words in 'miscellaneous'
-    if not openai_key or not raw_words:
-        return {
-            "beer_styles": [],
-            "breweries": [],
-            "venues": [],
-            "friends": [],
-            "flavors": [],
-            "miscellaneous": raw_words
-        }
+    if client is None or not raw_words:
+        return WordBag.from_json({"miscellaneous": raw_words})
 
     try:
-        client = OpenAI(api_key=openai_key)
-        
-        # Deduplicate and limit to save tokens
-        unique_words = list(set(raw_words))
-        if len(unique_words) > 200:
-            unique_words = unique_words[:200]
-            
+        # Collapse near-duplicates and limit to save tokens (the most frequent terms are kept)
+        unique_words = compact_terms(raw_words, 200)
+
         joined_words = ", ".join(unique_words)
-        print(f"DEBUG: Asking LLM to clean and categorize {len(unique_words)} words...")
+        log.info(f"Asking LLM to clean and categorize {len(unique_words)} words...")
 
         response = client.chat.completions.create(
             model="gpt-4o",
@@ -126,64 +146,128 @@ def clean_words_with_llm(raw_words: list[str]) -> dict:
             ],
             response_format={"type": "json_object"},
             temperature=0.1,
-            max_tokens=800
+            max_tokens=800,
+            timeout=call_timeout(60),
         )
         
         cleaned_text = response.choices[0].message.content
         import json
         data = json.loads(cleaned_text)
         
-        # Ensure all keys exist
-        keys = ["beer_styles", "breweries", "venues", "friends", "flavors", "miscellaneous"]
-        for k in keys:
-            if k not in data:
-                data[k] = []
-                
-        print(f"DEBUG: LLM categorization complete.")
-        return data
+        # Only the six categories are kept
+        bag = WordBag.from_json(data)
+
+        log.info("LLM categorization complete.")
+        return bag
 
     except Exception as e:
-        print(f"Warning: LLM cleaning failed ({type(e).__name__}: {e}). Returning raw list in 'miscellaneous'.")
+        log.warning(f"LLM cleaning failed ({type(e).__name__}: {e}). Returning raw list in 'miscellaneous'.")
         # Check for rate limit and warn explicitly
         if "429" in str(e) or "quota" in str(e).lower():
-            print("ALERT: OpenAI Rate Limit/Quota exceeded in cleaning step.")
+            log.warning("OpenAI Rate Limit/Quota exceeded in cleaning step.")
             
-        return {
-            "beer_styles": [],
-            "breweries": [],
-            "venues": [],
-            "friends": [],
-            "flavors": [],
-            "miscellaneous": raw_words
-        }
+        return WordBag.from_json({"miscellaneous": raw_words})
+
+VENUE_SYSTEM_PROMPT = (
+    "You are a creative writer. Given a venue name, imagine its atmosphere, decor, and vibe. "
+    "Describe it in 2-3 evocative sentences suitable for an art prompt (e.g. lighting, materials, crowd, mood)."
+)
+
+
+def _venue(venue) -> tuple:
+    """(name, city) from a name, a (name, city) pair or a {"name", "city"} dict."""
+    if isinstance(venue, dict):
+        return (venue.get("name") or "").strip(), venue.get("city") or None
+    if isinstance(venue, (list, tuple)):
+        name, city = (list(venue) + [None])[:2]
+        return (name or "").strip(), city or None
+    return (venue or "").strip(), None
 
-def describe_venue(venue_name: str) -> str:
+
+def describe_venues(venues: list) -> list[str]:
     """
-    Asks LLM to describe the vibe/theme of a venue based on its name.
+    The vibe of each venue (a name, a (name, city) pair or a {"name", "city"}
+    dict), in the order given; "" where none is available. Cached vibes come
+    from the venue cache; all the others are described in one structured LLM
+    call per VENUE_BATCH_SIZE venues and then cached.
     """
-    openai_key = os.getenv("OPENAI_API_KEY")
-    if not openai_key or not venue_name:
-        return ""
-        
+    pairs = [_venue(v) for v in venues]
+    keys = [venue_key(name, city) if name else None for name, city in pairs]
+    try:
+        known = get_venue_cache().get_many(k for k in keys if k)
+    except Exception as e:
+        log.warning(f"Venue cache unavailable: {type(e).__name__}: {e}")
+        known = {}
+
+    missing = {}
+    for key, pair in zip(keys, pairs):
+        if key and key not in known and key not in missing:
+            missing[key] = pair
+    if missing:
+        batch_size = max(1, env_int("VENUE_BATCH_SIZE", 20))
+        todo = list(missing.items())
+        for i in range(0, len(todo), batch_size):
+            batch = todo[i:i + batch_size]
+            descriptions = _describe_batch([pair for _, pair in batch])
+            known.update((key, d) for (key, _), d in zip(batch, descriptions) if d)
+            try:
+                get_venue_cache().put_many((name, city, d) for (_, (name, city)), d in zip(batch, descriptions))
+            except Exception as e:
+                log.warning(f"Could not cache venue vibes: {type(e).__name__}: {e}")
+    return [known.get(key, "") if key else "" for key in keys]
+
+
+def _describe_batch(pairs: list) -> list[str]:
+    """One structured-output call describing every (name, city) in `pairs`."""
+    client = get_openai_client()
+    if client is None or not pairs:
+        return [""] * len(pairs)
+
+    ids = [f"v{i}" for i in range(len(pairs))]
+    listing = "\n".join(f"{vid}: {name}" + (f" ({city})" if city else "") for vid, (name, city) in zip(ids, pairs))
+    schema = {
+        "type": "object",
+        "properties": {vid: {"type": "string"} for vid in ids},
+        "required": ids,
+        "additionalProperties": False,
+    }
+    log.info(f"Describing {len(pairs)} venue(s) in one call...")
     try:
-        client = OpenAI(api_key=openai_key)
         response = client.chat.completions.create(
             model="gpt-4o",
             messages=[
-                {"role": "system", "content": "You are a creative writer. Given a venue name, imagine its atmosphere, decor, and vibe. Describe it in 2-3 evocative sentences suitable for an art prompt (e.g. lighting, materials, crowd, mood)."},
-                {"role": "user", "content": f"Describe the venue: {venue_name}"}
+                {"role": "system", "content": VENUE_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Describe each venue, answering with its id as the key:\n{listing}"}
             ],
-            max_tokens=150
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "venue_vibes", "strict": True, "schema": schema},
+            },
+            max_tokens=min(4000, 150 * len(pairs) + 50),
+            timeout=call_timeout(30 + 5 * len(pairs)),
         )
-        return response.choices[0].message.content
-    except Exception:
+        data = json.loads(response.choices[0].message.content)
+    except Exception as e:
+        log.warning(f"Venue description failed: {type(e).__name__}: {e}")
+        return [""] * len(pairs)
+    return [str(data.get(vid) or "").strip() for vid in ids]
+
+
+def describe_venue(venue_name: str, city: str = None) -> str:
+    """
+    Asks LLM to describe the vibe/theme of a venue based on its name (cached, see describe_venues).
+    """
+    if not venue_name:
         return ""
+    return describe_venues([(venue_name, city)])[0]
 
 
-def get_wordcloud_data(cookie_string: str = None):
+def get_wordcloud_data(cookie_string: str = None, clean: bool = True):
     """
     Launches a browser to fetch word cloud data.
     If the user is not logged in, the browser window remains open for them to log in.
+    With `clean=False` the raw scraped terms are returned (for the fused
+    clean + enrich call) instead of the LLM-categorized WordBag.
     """
     # Simulation hook for testing without opening a browser
     if cookie_string and "simulated_success" in cookie_string:
@@ -191,8 +275,9 @@ def get_wordcloud_data(cookie_string: str = None):
 
     data = []
     
+    sync_playwright = get_sync_playwright()
     if sync_playwright is None:
-        print("WARNING: Playwright not installed. Scraping disabled.")
+        log.warning("Playwright not installed. Scraping disabled.")
         return []
 
     with sync_playwright() as p:
@@ -207,46 +292,46 @@ def get_wordcloud_data(cookie_string: str = None):
 
         page = context.new_page()
         
-        print("Navigating to BeerCloud...")
+        log.info("Navigating to BeerCloud...")
         try:
             page.goto("https://beercloud.wardy.au/")
             
             # Check if we need to login. 
-            print("Checking login status...")
+            log.info("Checking login status...")
             
             # Wait loop: Wait for "Login with Untappd" to disappear
             start_time = time.time()
             logged_in = False
             
-            while time.time() - start_time < 120:
+            # The login wait never outlasts the job's deadline (or a cancel).
+            while time.time() - start_time < 120 and not deadline_reached():
                 # Check for common login indicator
                 try:
                     # Using a broad selector for the login button/link we saw earlier
                     if page.get_by_text("Login with Untappd").count() > 0 and page.get_by_text("Login with Untappd").is_visible():
-                         # print("Waiting for login...", end='\r') # Avoid spamming stdout in this environment
                          page.wait_for_timeout(3000)
                     else:
-                        print("Login button not visible. Assuming logged in!")
+                        log.info("Login button not visible. Assuming logged in!")
                         logged_in = True
                         break
                 except Exception as e:
-                    print(f"Error checking login state: {e}")
+                    log.warning(f"Error checking login state: {e}")
                     page.wait_for_timeout(3000)
 
-            if logged_in:
+            if logged_in and not deadline_reached():
                 # Wait for the word cloud to render
-                print("Waiting for word cloud to render...")
+                log.info("Waiting for word cloud to render...")
                 page.wait_for_timeout(8000)  # Give it a good 8 seconds
                 
-                print("Extracting words...")
+                log.info("Extracting words...")
                 try:
                     # Strategy 1: SVG text elements (common for D3/word clouds)
                     svg_texts = page.locator("svg text").all_inner_texts()
                     if len(svg_texts) > 5:
                         data = svg_texts
-                        print(f"Found {len(data)} words in SVG.")
+                        log.info(f"Found {len(data)} words in SVG.")
                     else:
-                        print("SVG strategy insufficient.")
+                        log.info("SVG strategy insufficient.")
 
                     # Strategy 1.5: Spans/Divs commonly used for word clouds
                     # If SVG didn't work, try capturing spans (often used for HTML clouds)
@@ -254,45 +339,45 @@ def get_wordcloud_data(cookie_string: str = None):
                          span_texts = page.locator("span").all_inner_texts()
                          candidates = [s for s in span_texts if len(s) > 3]
                          if len(candidates) > 5:
-                             data = list(set(candidates))
-                             print(f"Found {len(data)} words in spans.")
+                             data = WordBag.from_json(candidates).top_k()
+                             log.info(f"Found {len(data)} words in spans.")
 
                     # Strategy 2: just body text fallback
                     if not data:
                         body_text = page.evaluate("document.body.innerText")
                         # Simple cleanup: words > 3 chars
                         words = [w.strip() for w in body_text.split() if len(w.strip()) > 3]
-                        data = list(set(words))
-                        print(f"Found {len(data)} words in body.")
+                        data = WordBag.from_json(words).top_k()
+                        log.info(f"Found {len(data)} words in body.")
                         
                 except Exception as ex:
-                    print(f"Extraction error: {ex}")
+                    log.warning(f"Extraction error: {ex}")
             else:
-                print("Timed out waiting for login.")
+                log.warning("Timed out waiting for login.")
             # FILTERING & CLEANUP
             # Use LLM to clean up the scraped data (Fixes corrupted words and removes UI junk)
-            if data:
-                print("Refining extracted words with LLM...")
+            if data and clean:
+                log.info("Refining extracted words with LLM...")
                 data = clean_words_with_llm(data)
             
             # Debug: Take a screenshot to see what the bot sees
             try:
                 page.screenshot(path="static/debug_page.png")
-                print("Saved debug screenshot to static/debug_page.png")
+                log.debug("Saved debug screenshot to static/debug_page.png")
             except Exception:
                 pass
 
             # FINAL SAFETY FALLBACK
             # If we still have no data (or very little), use a fallback list so the AI has something to draw.
             if len(data) < 5:
-                print("Extraction failed to find sufficient quality text. Using fallback beer words.")
+                log.warning("Extraction failed to find sufficient quality text. Using fallback beer words.")
                 data = ["IPA", "Stout", "Hazy", "Lager", "Ale", "Hops", "Malt", "Brewery", "Craft", "Pilsner", "Saison", "Lambic"]
             
         except Exception as e:
-            print(f"Error during browser interaction: {e}")
+            log.error(f"Error during browser interaction: {e}")
             
         except Exception as e:
-            print(f"Error during browser interaction: {e}")
+            log.error(f"Error during browser interaction: {e}")
         finally:
             browser.close()
 
@@ -0,0 +1,132 @@
+"""
+Contact sheets for multi-photo OCR.
+
+People photograph a long menu as 3-6 pictures. Sending each one to GPT-4o Vision
+as its own job costs a call (and an artwork) per photo. `/upload` now takes all
+of them for one job. Before the Vision calls, `contact_sheets` does this:
+
+- Prepares each photo: applies the EXIF rotation, converts to RGB, lightly
+  stretches the contrast, and shrinks to OCR_MAX_EDGE. Anything larger is
+  thrown away by the model's own resize, so it only costs upload time.
+- Drops near-duplicates (the same board shot twice) by comparing a difference
+  hash. OCR_DEDUPE_DISTANCE is the number of differing bits, out of 256, that
+  still counts as the same photo.
+- Packs the rest side by side into rows. With "high" detail the model fits an
+  image into 2048x2048 and then shrinks its short side to 768, so a strip of
+  two or three portrait menus is read at nearly the resolution of a single
+  one. `_vision_scale` models that resize. A photo joins the current sheet
+  only if it, and every photo already there, keeps at least
+  OCR_TILE_MIN_SCALE of the resolution it would get alone. Otherwise a new
+  sheet is started, and sheets are read by parallel calls.
+
+Photos Pillow can't decode are passed through untouched as sheets of their
+own, as before. Vision may still read them.
+"""
+import io
+
+from app.config import env_int, env_float
+from app.core.logs import get_logger
+
+log = get_logger(__name__)
+
+# GPT-4o "high" detail: fit within 2048x2048, then scale the short side down to 768.
+VISION_MAX_EDGE = 2048
+VISION_SHORT_EDGE = 768
+HASH_SIZE = 16
+GUTTER = 16
+
+
+def _vision_scale(width: int, height: int) -> float:
+    """How much the Vision model shrinks a width x height image before reading it."""
+    scale = min(1.0, VISION_MAX_EDGE / max(width, height))
+    return scale * min(1.0, VISION_SHORT_EDGE / (min(width, height) * scale))
+
+
+def _prepare(image_bytes: bytes, max_edge: int):
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(image_bytes))
+    # JPEGs can be decoded at a fraction of their size, much faster than decoding and shrinking.
+    img.draft("RGB", (max_edge, max_edge))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return ImageOps.autocontrast(img, cutoff=1)
+
+
+def _dhash(img) -> int:
+    from PIL import Image
+
+    small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (HASH_SIZE + 1) + col + 1])
+    return bits
+
+
+def _fits(tiles: list, min_scale: float) -> bool:
+    """Whether every tile in a row keeps `min_scale` of its solo resolution."""
+    height = min(img.height for img in tiles)
+    widths = [round(img.width * height / img.height) for img in tiles]
+    sheet_scale = _vision_scale(sum(widths) + GUTTER * (len(tiles) - 1), height)
+    return all(height / img.height * sheet_scale >= min_scale * _vision_scale(*img.size) for img in tiles)
+
+
+def _render(tiles: list) -> bytes:
+    from PIL import Image
+
+    height = min(img.height for img in tiles)
+    resized = [img if img.height == height else img.resize((round(img.width * height / img.height), height), Image.LANCZOS)
+               for img in tiles]
+    sheet = Image.new("RGB", (sum(img.width for img in resized) + GUTTER * (len(resized) - 1), height), "white")
+    x = 0
+    for img in resized:
+        sheet.paste(img, (x, 0))
+        x += img.width + GUTTER
+    buf = io.BytesIO()
+    sheet.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def contact_sheets(images: list) -> tuple:
+    """
+    Packs photos into as few legible sheets as possible.
+    Returns `([(sheet_bytes, photo_count), ...], stats)`.
+    """
+    max_edge = env_int("OCR_MAX_EDGE", VISION_MAX_EDGE)
+    max_distance = env_int("OCR_DEDUPE_DISTANCE", 20)
+    min_scale = env_float("OCR_TILE_MIN_SCALE", 0.7)
+    per_sheet = max(1, env_int("OCR_TILES_PER_SHEET", 4))
+
+    stats = {"images": len(images), "duplicates": 0, "unreadable": 0, "sheets": 0}
+    prepared, hashes, passthrough = [], [], []
+    for index, image_bytes in enumerate(images):
+        try:
+            img = _prepare(image_bytes, max_edge)
+        except Exception as e:
+            log.warning(f"Could not decode photo {index + 1} ({e}); sending it as is")
+            stats["unreadable"] += 1
+            passthrough.append((image_bytes, 1))
+            continue
+        digest = _dhash(img)
+        if any(bin(digest ^ seen).count("1") <= max_distance for seen in hashes):
+            log.info(f"Photo {index + 1} is a near-duplicate; skipping it")
+            stats["duplicates"] += 1
+            continue
+        hashes.append(digest)
+        prepared.append(img)
+
+    rows = []
+    for img in prepared:
+        if rows and len(rows[-1]) < per_sheet and _fits(rows[-1] + [img], min_scale):
+            rows[-1].append(img)
+        else:
+            rows.append([img])
+    sheets = [(_render(row), len(row)) for row in rows] + passthrough
+    stats["sheets"] = len(sheets)
+    return sheets, stats
@@ -1,118 +1,142 @@
-from openai import OpenAI
-import os
-import requests
 import urllib.parse
 
-from dotenv import load_dotenv
+from app.config import get_env
+from app.core.json_stream import PartialJSONObject
+from app.core.deadline import call_timeout, deadline_reached, abort_on_cancel
+from app.core.words import WordBag
+from app.core.fuzzy import compact_terms
+from app.core.logs import get_logger
+from app.services.beercloud import WORD_CATEGORIES
+from app.services.registry import get_openai_client, get_genai, get_genai_client, get_requests
+
+log = get_logger(__name__)
+
+STYLE_INSTRUCTIONS = {
+    "scarry": (
+        "Style: Richard Scarry 'Busytown' Illustration (1970s Children's Book).\n"
+        "Details: A chaotic, happy scene. "
+        "Every beer style and brewery must be a physical shop, character, or vehicle. "
+        "Draw a 'Where's Waldo' density. Flat colors, detailed ink lines."
+    ),
+    "dali": (
+        "Style: Salvador Dali Surrealist Oil Painting.\n"
+        "Details: A dreamscape. Venue descriptions become the warped landscape. "
+        "Beer objects melt or float. High symbolism. "
+        "Captures the subconscious feeling of the drinking session."
+    ),
+    "picasso": (
+        "Style: Pablo Picasso Synthetic Cubism (1912).\n"
+        "Details: Fragment and reassemble the venue and bottles. "
+        "Use the venue vibe to dictate the color palette."
+    ),
+    "cyberpunk": (
+        "Style: High-Fidelity Cyberpunk / Blade Runner Aesthetic.\n"
+        "Details: A futuristic night market. The venue is a high-tech lounge. "
+        "Breweries are neon corporate logos. "
+        "High contrast, rain, steam, neon."
+    ),
+    "technology": (
+        "Style: Abstract Future Technology / Data Visualization.\n"
+        "Details: A visual representation of the data as a complex network. "
+        "The venue is the server. Beers are data packets."
+    )
+}
+
+
+GEMINI_IMAGE_MODEL = "gemini-3-pro-image-preview"
+DALLE_IMAGE_MODEL = "dall-e-3"
+
+# Draft tier: a fraction of the cost and time of the models above.
+DRAFT_GEMINI_MODEL = "gemini-2.5-flash-image"
+DRAFT_DALLE_MODEL = "dall-e-2"
+DRAFT_DALLE_SIZE = "512x512"
+
+# Prompt length limits of the DALL-E models.
+DALLE_PROMPT_LIMITS = {"dall-e-3": 3900, "dall-e-2": 1000}
+
+JSON_INSTRUCTION = (
+    "\n\nCRITICAL: Output your response as valid JSON with two fields: 'visual_prompt' (the final image prompt) "
+    "and 'reasoning' (a summary of your analysis, the categories found, and the story you created)."
+)
+
+
+def _enrichment_messages(data: any, style: str, venue_description: str = "") -> list:
+    """Chat messages asking for the JSON art direction (shared by the blocking and streaming calls)."""
+    # Prepare content based on input type
+    bag = WordBag.from_json(data)
+    if bag.categorized:
+        # Formatted string for the LLM
+        input_text = "Categorized Keywords:\n"
+        for category, items in bag.groups().items():
+            input_text += f"- {category.upper()}: {', '.join(items)}\n"
+        if venue_description:
+            input_text += f"\nVENUE VIBE/THEME: {venue_description}\n"
+    else:
+        # Fallback for list
+        input_text = f"Keywords: {', '.join(bag)}"
+
+    context_desc = "categorized beer and venue data" if bag.categorized else "list of words"
+
+    system_content = (
+        f"You are an expert AI Art Director and Data Storyteller. Your goal is to transform {context_desc} "
+        "into a rich, cohesive visual narrative prompt for an image generator.\n\n"
+        "PROCESS:\n"
+        "1. ANALYZE: Review the keywords. Pay special attention to 'BEER_STYLES', 'BREWERIES', and 'VENUES'.\n"
+        "2. THEME: If a VENUE VIBE is provided, use it as the core atmosphere (lighting, mood, setting).\n"
+        "3. METAPHOR: Do NOT just list the words. Transform specific items into visual metaphors.\n"
+        "   - A 'Stout' might become a river of dark velvet or an obsidian monolith.\n"
+        "   - 'Stone Brewery' might appear as literal gargoyles or stone architecture.\n"
+        "   - Friends' names can be subtle details (e.g., 'Chris' engraved on a mug, or a character named Chris).\n"
+        "4. STORY: Develop a short visual scene where these elements coexist.\n"
+        "5. PROMPT: Write a highly detailed image generation prompt based on this narrative in the requested style."
+    )
+    
+    # Default to Dali if style unknown
+    specific_instruction = STYLE_INSTRUCTIONS.get(style, STYLE_INSTRUCTIONS["dali"])
+    
+    user_content = (
+        f"INPUT DATA:\n{input_text}\n\n"
+        f"Create the prompt applying this specific style guidance:\n{specific_instruction}"
+    )
+    return [
+        {"role": "system", "content": system_content},
+        {"role": "user", "content": user_content + JSON_INSTRUCTION},
+    ]
 
-# Ensure env is loaded
-load_dotenv()
 
 def enrich_prompt(data: any, style: str, theme: str = "Beer", venue_description: str = "") -> dict:
     """Uses OpenAI to create a detailed visual description from the word list/dict. Returns dict with 'visual_prompt' and 'reasoning'."""
-    openai_key = os.getenv("OPENAI_API_KEY")
-    if not openai_key:
-        print("DEBUG: No OpenAI Key found, skipping enrichment.")
+    client = get_openai_client()
+    if client is None:
+        log.info("No OpenAI Key found, skipping enrichment.")
         return None
 
     try:
-        client = OpenAI(api_key=openai_key)
-        
-        # Prepare content based on input type
-        if isinstance(data, dict):
-            # Formatted string for the LLM
-            input_text = "Categorized Keywords:\n"
-            for category, items in data.items():
-                if items:
-                    input_text += f"- {category.upper()}: {', '.join(items)}\n"
-            if venue_description:
-                input_text += f"\nVENUE VIBE/THEME: {venue_description}\n"
-        else:
-            # Fallback for list
-            input_text = f"Keywords: {', '.join(data)}"
-
-        context_desc = "categorized beer and venue data" if isinstance(data, dict) else "list of words"
-
-        system_content = (
-            f"You are an expert AI Art Director and Data Storyteller. Your goal is to transform {context_desc} "
-            "into a rich, cohesive visual narrative prompt for an image generator.\n\n"
-            "PROCESS:\n"
-            "1. ANALYZE: Review the keywords. Pay special attention to 'BEER_STYLES', 'BREWERIES', and 'VENUES'.\n"
-            "2. THEME: If a VENUE VIBE is provided, use it as the core atmosphere (lighting, mood, setting).\n"
-            "3. METAPHOR: Do NOT just list the words. Transform specific items into visual metaphors.\n"
-            "   - A 'Stout' might become a river of dark velvet or an obsidian monolith.\n"
-            "   - 'Stone Brewery' might appear as literal gargoyles or stone architecture.\n"
-            "   - Friends' names can be subtle details (e.g., 'Chris' engraved on a mug, or a character named Chris).\n"
-            "4. STORY: Develop a short visual scene where these elements coexist.\n"
-            "5. PROMPT: Write a highly detailed image generation prompt based on this narrative in the requested style."
-        )
-        
-        style_instructions = {
-            "scarry": (
-                "Style: Richard Scarry 'Busytown' Illustration (1970s Children's Book).\n"
-                "Details: A chaotic, happy scene. "
-                "Every beer style and brewery must be a physical shop, character, or vehicle. "
-                "Draw a 'Where's Waldo' density. Flat colors, detailed ink lines."
-            ),
-            "dali": (
-                "Style: Salvador Dali Surrealist Oil Painting.\n"
-                "Details: A dreamscape. Venue descriptions become the warped landscape. "
-                "Beer objects melt or float. High symbolism. "
-                "Captures the subconscious feeling of the drinking session."
-            ),
-            "picasso": (
-                "Style: Pablo Picasso Synthetic Cubism (1912).\n"
-                "Details: Fragment and reassemble the venue and bottles. "
-                "Use the venue vibe to dictate the color palette."
-            ),
-            "cyberpunk": (
-                "Style: High-Fidelity Cyberpunk / Blade Runner Aesthetic.\n"
-                "Details: A futuristic night market. The venue is a high-tech lounge. "
-                "Breweries are neon corporate logos. "
-                "High contrast, rain, steam, neon."
-            ),
-            "technology": (
-                "Style: Abstract Future Technology / Data Visualization.\n"
-                "Details: A visual representation of the data as a complex network. "
-                "The venue is the server. Beers are data packets."
-            )
-        }
-        
-        # Default to Dali if style unknown
-        specific_instruction = style_instructions.get(style, style_instructions["dali"])
-        
-        user_content = (
-            f"INPUT DATA:\n{input_text}\n\n"
-            f"Create the prompt applying this specific style guidance:\n{specific_instruction}"
-        )
+        messages = _enrichment_messages(data, style, venue_description)
 
-        print(f"DEBUG: Calling OpenAI for prompt enrichment (Style: {style})...")
+        log.info(f"Calling OpenAI for prompt enrichment (Style: {style})...")
 
         # Use gpt-4o for better detail text generation
         model = "gpt-4o"
         try:
              response = client.chat.completions.create(
                 model=model,
-                messages=[
-                    {"role": "system", "content": system_content},
-                    {"role": "user", "content": user_content + "\n\nCRITICAL: Output your response as valid JSON with two fields: 'visual_prompt' (the final image prompt) and 'reasoning' (a summary of your analysis, the categories found, and the story you created)."}
-                ],
+                messages=messages,
                 max_tokens=800,
-                response_format={"type": "json_object"}
+                response_format={"type": "json_object"},
+                timeout=call_timeout(60),
             )
         except Exception as e:
-            print(f"DEBUG: {model} failed ({e}), falling back to gpt-3.5-turbo")
+            log.info(f"{model} failed ({e}), falling back to gpt-3.5-turbo")
             response = client.chat.completions.create(
                 model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_content},
-                    {"role": "user", "content": user_content + "\n\nCRITICAL: Output your response as valid JSON with two fields: 'visual_prompt' (the final image prompt) and 'reasoning' (a summary of your analysis, the categories found, and the story you created)."}
-                ],
+                messages=messages,
                 max_tokens=800,
+                timeout=call_timeout(60),
             )
 
         content = response.choices[0].message.content
-        print(f"DEBUG: Enriched prompt raw: {content}")
+        log.debug("Enriched prompt raw", extra={"event": "llm.raw", "content": content})
         
         # Parse JSON
         import json
@@ -120,93 +144,283 @@ def enrich_prompt(data: any, style: str, theme: str = "Beer", venue_description:
             data = json.loads(content)
             return data
         except json.JSONDecodeError:
-            print("ERROR: Could not parse JSON from LLM, returning raw text as prompt.")
+            log.error("Could not parse JSON from LLM, returning raw text as prompt.")
             return {"visual_prompt": content, "reasoning": "Could not extract reasoning."}
         
     except Exception as e:
-        print(f"DEBUG: OpenAI Enrichment failed: {e}")
+        log.info(f"OpenAI Enrichment failed: {e}")
         return None
 
-def generate_image_google(prompt: str) -> str:
+
+def enrich_prompt_stream(data: any, style: str, theme: str = "Beer", venue_description: str = "",
+                         on_update=None) -> dict:
     """
-    Generates an image using Google's Gemini 3 Pro (Nano Banana Pro) model.
+    Streaming version of `enrich_prompt`. The JSON is parsed as tokens arrive and
+    `on_update(fields, closed)` is called with the partial `visual_prompt` /
+    `reasoning` text and the set of fields that are already complete, so the
+    caller can start generating the image as soon as `visual_prompt` closes.
+    Falls back to the blocking call if the stream can't be opened.
+    """
+    client = get_openai_client()
+    if client is None:
+        log.info("No OpenAI Key found, skipping enrichment.")
+        return None
+
+    messages = _enrichment_messages(data, style, venue_description)
+    # The image can only start early if the prompt comes before the reasoning.
+    messages[-1]["content"] += " Write the 'visual_prompt' field first."
+
+    log.info(f"Streaming OpenAI prompt enrichment (Style: {style})...")
+    try:
+        stream = client.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            max_tokens=800,
+            response_format={"type": "json_object"},
+            stream=True,
+            timeout=call_timeout(60),
+        )
+    except Exception as e:
+        log.info(f"Streaming enrichment unavailable ({e}), using the blocking call")
+        return enrich_prompt(data, style, theme, venue_description)
+
+    parser = PartialJSONObject()
+    raw = []
+    try:
+        # Cancelling the job closes the connection, which ends the loop below.
+        with abort_on_cancel(stream.close):
+            for chunk in stream:
+                if deadline_reached():
+                    break
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                raw.append(delta)
+                changed = parser.feed(delta) & {"visual_prompt", "reasoning"}
+                if changed and on_update is not None:
+                    on_update(dict(parser.fields), set(parser.closed))
+    except Exception as e:
+        # Keep whatever arrived: a closed visual_prompt is already usable.
+        log.info(f"Enrichment stream broke off: {type(e).__name__}: {e}")
+
+    content = "".join(raw)
+    log.debug("Enriched prompt raw", extra={"event": "llm.raw", "content": content})
+    if "visual_prompt" in parser.closed:
+        return {"visual_prompt": parser.fields["visual_prompt"], "reasoning": parser.fields.get("reasoning", "")}
+    if content.strip():
+        log.error("Could not parse JSON from LLM stream, returning raw text as prompt.")
+        return {"visual_prompt": content, "reasoning": "Could not extract reasoning."}
+    return None
+
+ART_DIRECTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "categories": {
+            "type": "object",
+            "properties": {k: {"type": "array", "items": {"type": "string"}} for k in WORD_CATEGORIES},
+            "required": WORD_CATEGORIES,
+            "additionalProperties": False,
+        },
+        "venue_vibe": {"type": "string"},
+        "visual_prompt": {"type": "string"},
+        "reasoning": {"type": "string"},
+    },
+    "required": ["categories", "venue_vibe", "visual_prompt", "reasoning"],
+    "additionalProperties": False,
+}
+
+
+def validate_art_direction(data) -> list[str]:
+    """Checks a fused clean + enrich response against ART_DIRECTION_SCHEMA. Returns the problems found."""
+    if not isinstance(data, dict):
+        return ["response is not an object"]
+    problems = []
+    categories = data.get("categories")
+    if not isinstance(categories, dict):
+        problems.append("categories is not an object")
+    else:
+        for k in WORD_CATEGORIES:
+            items = categories.get(k)
+            if not isinstance(items, list) or not all(isinstance(i, str) for i in items):
+                problems.append(f"categories.{k} is not a list of strings")
+        if not any(categories.get(k) for k in WORD_CATEGORIES):
+            problems.append("categories are all empty")
+    for k in ("venue_vibe", "visual_prompt", "reasoning"):
+        if not isinstance(data.get(k), str):
+            problems.append(f"{k} is not a string")
+    if isinstance(data.get("visual_prompt"), str) and len(data["visual_prompt"].strip()) < 20:
+        problems.append("visual_prompt is too short")
+    return problems
+
+
+def clean_and_enrich(raw_words: list[str], style: str, theme: str = "Beer", venue_names: list[str] = None):
+    """
+    Fused mode: cleans and categorizes the raw terms, imagines the venue's vibe
+    and writes the visual prompt in a single structured-output call, instead of
+    clean_words_with_llm + describe_venue + enrich_prompt.
+    Returns the validated response, or None so the caller can fall back to the
+    multi-call path.
+    """
+    client = get_openai_client()
+    if client is None or not raw_words:
+        return None
+
+    unique_words = compact_terms(raw_words, 200)
+    specific_instruction = STYLE_INSTRUCTIONS.get(style, STYLE_INSTRUCTIONS["dali"])
+    system_content = (
+        "You are a data cleaner and an expert AI Art Director. You get a raw list of terms from a beer app "
+        "and turn it into an image generation prompt, in one pass:\n"
+        "1. CLEAN: fix partial/corrupted words; remove UI elements (Settings, Login, Cookies, Menu) and generic "
+        "words (Beer, Drink, Pour, View) unless they are specific flavors.\n"
+        "2. CATEGORIZE the cleaned terms into 'beer_styles', 'breweries', 'venues', 'friends' (names of people), "
+        "'flavors' and 'miscellaneous'.\n"
+        "3. VENUE VIBE: imagine the atmosphere of the main venue (lighting, materials, crowd, mood) in 2-3 "
+        "evocative sentences. Empty string if there is no venue.\n"
+        "4. PROMPT: transform the items into visual metaphors (a 'Stout' might become a river of dark velvet), "
+        "set the scene in the venue vibe, and write a highly detailed image prompt in the requested style.\n"
+        "5. REASONING: summarize the categories found and the story you created."
+    )
+    user_content = f"RAW TERMS: {', '.join(unique_words)}\n"
+    if venue_names:
+        user_content += f"MAIN VENUE: {venue_names[0]}\n"
+    user_content += f"\nCreate the prompt applying this specific style guidance:\n{specific_instruction}"
+
+    log.info(f"Fused clean + enrich call for {len(unique_words)} terms (Style: {style})...")
+    try:
+        response = client.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": system_content},
+                {"role": "user", "content": user_content},
+            ],
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "art_direction", "strict": True, "schema": ART_DIRECTION_SCHEMA},
+            },
+            max_tokens=1400,
+            timeout=call_timeout(90),
+        )
+        import json
+        data = json.loads(response.choices[0].message.content)
+    except Exception as e:
+        log.warning(f"Fused clean + enrich call failed: {type(e).__name__}: {e}")
+        return None
+
+    problems = validate_art_direction(data)
+    if problems:
+        log.warning(f"Fused response failed validation ({'; '.join(problems)}), falling back to multi-call.")
+        return None
+    return data
+
+def _image_parts(parts):
+    """The inline image payloads among response parts, in order."""
+    for part in parts or ():
+        if part.inline_data and part.inline_data.mime_type.startswith("image"):
+            yield part.inline_data.data
+
+
+def _image_bytes(data) -> bytes:
+    """Inline image data as bytes (some SDK versions hand back base64 text)."""
+    import base64
+
+    if isinstance(data, str):
+        try:
+            return base64.b64decode(data)
+        except Exception:
+            return data.encode()
+    return data
+
+
+def _stream_google(client, config, prompt: str, on_image, model: str = GEMINI_IMAGE_MODEL) -> tuple[list, list]:
+    """
+    Consumes the Gemini response as it streams. The "Thinking" model renders
+    intermediate images before the final one; each is handed to `on_image(bytes)`
+    as soon as its chunk arrives. Returns (images, texts) like the blocking call.
+    """
+    images, texts = [], []
+    for chunk in client.models.generate_content_stream(model=model, contents=[prompt], config=config):
+        for part in chunk.parts or ():
+            if part.text:
+                texts.append(part.text)
+        for data in _image_parts(chunk.parts):
+            image_bytes = _image_bytes(data)
+            images.append(image_bytes)
+            try:
+                on_image(image_bytes)
+            except Exception as e:
+                # A broken preview must never cost the real image.
+                log.warning(f"Image preview callback failed: {type(e).__name__}: {e}")
+    return images, texts
+
+
+def generate_image_google(prompt: str, on_image=None, model: str = GEMINI_IMAGE_MODEL) -> str:
+    """
+    Generates an image using Google's Gemini 3 Pro (Nano Banana Pro) model, or
+    another Gemini image `model`.
+
+    With `on_image`, the response is streamed and every image the model renders
+    (intermediate "thinking" images, then the final one) is passed to
+    `on_image(bytes)` as it arrives. The return value is always the final image.
     """
     try:
-        from google import genai
-        from google.genai import types
-        import uuid
-        import io
         import base64
-        
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY missing in environment")
 
-        # Configure Client
-        client = genai.Client(api_key=api_key)
+        _, types = get_genai()
+        client = get_genai_client()
+        if client is None:
+            raise ValueError("GOOGLE_API_KEY missing in environment")
         
-        print(f"DEBUG: Calling Google Gemini 3 Pro (Nano Banana Pro)...")
-        # print(f"DEBUG: Prompt: {prompt[:50]}...")
+        log.info(f"Calling Google Gemini ({model})...")
         
         # Use generate_content for Gemini 3 image generation
         # Allowing TEXT modality too because it's a "Thinking" model
-        response = client.models.generate_content(
-            model='gemini-3-pro-image-preview',
-            contents=[prompt],
-            config=types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE'], 
-                image_config=types.ImageConfig(
-                    aspect_ratio="1:1"
-                )
-            )
+        config = types.GenerateContentConfig(
+            response_modalities=['TEXT', 'IMAGE'], 
+            image_config=types.ImageConfig(
+                aspect_ratio="1:1"
+            ),
+            # Milliseconds; capped by the job's deadline.
+            http_options=types.HttpOptions(timeout=int(call_timeout(180) * 1000)),
         )
-        
-        # Collect all images from the response
-        found_images = []
-        
-        if response.parts:
-            for part in response.parts:
-                 if part.inline_data and part.inline_data.mime_type.startswith("image"):
-                     found_images.append(part.inline_data.data)
+
+        if on_image is not None and hasattr(client.models, "generate_content_stream"):
+            found_images, texts = _stream_google(client, config, prompt, on_image, model)
+        else:
+            response = client.models.generate_content(
+                model=model,
+                contents=[prompt],
+                config=config,
+            )
+            # Collect all images from the response
+            found_images = [_image_bytes(data) for data in _image_parts(response.parts)]
+            texts = [p.text for p in response.parts or () if p.text]
 
         if found_images:
             # The docs say: "The last image within Thinking is also the final rendered image."
             # So we take the last one.
-            final_image_data = found_images[-1]
-            
-            # Handle bytes vs base64 string
-            if isinstance(final_image_data, str):
-                try:
-                    # Check if it's already a base64 string we can just use
-                    # Logic: if it decodes successfully, it's b64.
-                    image_bytes = base64.b64decode(final_image_data)
-                    b64_string = final_image_data
-                except Exception:
-                    # It was a raw string? Convert to bytes then b64
-                    image_bytes = final_image_data.encode() if hasattr(final_image_data, 'encode') else final_image_data
-                    b64_string = base64.b64encode(image_bytes).decode('utf-8')
-            else:
-                # It is bytes
-                b64_string = base64.b64encode(final_image_data).decode('utf-8')
+            b64_string = base64.b64encode(found_images[-1]).decode('utf-8')
 
             # Vercel Read-Only Fix: Return Data URI instead of saving to file
-            print(f"DEBUG: Returning Google Image as Data URI (Length: {len(b64_string)})")
+            log.debug(f"Returning Google Image as Data URI (Length: {len(b64_string)}, "
+                      f"{len(found_images) - 1} intermediate images)")
             return f"data:image/png;base64,{b64_string}"
         
         # If we got here, we had no images. Let's see if there was text output (error or refusal).
-        text_content = " ".join([p.text for p in response.parts if p.text])
+        text_content = " ".join(texts)
         if text_content:
-             print(f"DEBUG: No images, but text received: {text_content[:200]}...")
+             log.warning("No images, but text received", extra={"event": "llm.raw", "content": text_content})
              raise ValueError(f"Model returned text but no image: {text_content[:100]}...")
         
         raise ValueError("No content returned from Google API")
 
     except ImportError:
         error_msg = "'google-genai' package not installed."
-        print(f"ERROR: {error_msg}")
+        log.error(f"{error_msg}")
         raise ImportError(error_msg)
     except Exception as e:
-        print(f"ERROR: Google Generation failed: {e}")
+        log.error(f"Google Generation failed: {e}")
         # Check for specific known errors to give better feedback
         err_str = str(e)
         if "429" in err_str or "quota" in err_str.lower() or "resource exhausted" in err_str.lower():
@@ -214,87 +428,90 @@ def generate_image_google(prompt: str) -> str:
         # Raise exception so it appears in the UI instead of generic 'failed'
         raise e
 
-def generate_image_dalle(prompt: str) -> str:
+def generate_image_dalle(prompt: str, model: str = DALLE_IMAGE_MODEL, size: str = "1024x1024") -> str:
     """
-    Generates an image using OpenAI DALL-E 3.
-    Saves it locally to static/generated/ and returns a local relative URL.
+    Generates an image using OpenAI DALL-E 3 (or DALL-E 2 for drafts).
+    Returns it as a data URI.
     """
-    import uuid
     import base64
     
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        print("ERROR: OpenAI Key missing for DALL-E generation")
+    client = get_openai_client()
+    if client is None:
+        log.error("OpenAI Key missing for DALL-E generation")
         return None
 
     try:
-        client = OpenAI(api_key=api_key)
-        
-        print(f"DEBUG: Calling DALL-E 3 generation...")
+        log.info(f"Calling DALL-E generation ({model}, {size})...")
         
         response = client.images.generate(
-            model="dall-e-3",
-            prompt=prompt[:3900], # DALL-E 3 char limit is 4000
-            size="1024x1024",
+            model=model,
+            prompt=prompt[:DALLE_PROMPT_LIMITS.get(model, 1000)],
+            size=size,
             quality="standard",
             n=1,
+            timeout=call_timeout(120),
         )
 
         image_url_temp = response.data[0].url
         
         # Download the image bytes
-        img_data = requests.get(image_url_temp).content
+        img_data = get_requests().get(image_url_temp, timeout=call_timeout(60)).content
         
         # Vercel Read-Only Fix: Return Data URI
         b64_string = base64.b64encode(img_data).decode('utf-8')
         
-        print(f"DEBUG: Returning DALL-E Image as Data URI (Length: {len(b64_string)})")
+        log.debug(f"Returning DALL-E Image as Data URI (Length: {len(b64_string)})")
         return f"data:image/png;base64,{b64_string}"
 
     except Exception as e:
-        print(f"ERROR: DALL-E Generation failed: {e}")
+        log.error(f"DALL-E Generation failed: {e}")
         err_str = str(e)
         if "429" in err_str or "billing" in err_str.lower() or "insufficient_quota" in err_str.lower():
              raise ValueError("OpenAI API Quota Exceeded (429). Please check your billing.")
         raise e
 
 
+def generate_draft_image(prompt: str, provider: str = "google") -> str:
+    """
+    A fast, cheap render of the prompt so the user can judge the concept before
+    paying for the full one: Gemini 2.5 Flash Image, or DALL-E 2 at 512px.
+    """
+    if provider == "dalle":
+        return generate_image_dalle(prompt, model=get_env("DRAFT_DALLE_MODEL", DRAFT_DALLE_MODEL),
+                                    size=DRAFT_DALLE_SIZE)
+    return generate_image_google(prompt, model=get_env("DRAFT_GEMINI_MODEL", DRAFT_GEMINI_MODEL))
+
+
 def generate_image(data: any, style: str = 'dali') -> str:
     from app.services.beercloud import describe_venue
     
     venue_desc = ''
-    if isinstance(data, dict):
+    bag = WordBag.from_json(data)
+    if bag.categorized:
         # Implement Logic to pick a venue and get description
-        venues = data.get('venues', [])
+        venues = bag.category('venues')
         if venues:
             # Pick the first one or random? First is fine.
             venue_name = venues[0]
-            print(f'DEBUG: Found venue: {venue_name}. Asking for description...')
+            log.info(f'Found venue: {venue_name}. Asking for description...')
             venue_desc = describe_venue(venue_name)
     
     # Step 1: Enrich Prompt
-    enriched = enrich_prompt(data, style, venue_description=venue_desc)
+    enriched = enrich_prompt(bag, style, venue_description=venue_desc)
     
     visual_prompt = ''
     if enriched and 'visual_prompt' in enriched:
         visual_prompt = enriched['visual_prompt']
     else:
         # Fallback if enrichment fails
-        if isinstance(data, dict):
-            # flatten
-            flat = []
-            for k,v in data.items():
-                if isinstance(v, list): flat.extend(v)
-            visual_prompt = f'A surreal artistic beer cloud featuring: {', '.join(flat[:20])}'
-        else:
-             visual_prompt = f'A surreal artistic beer cloud featuring: {', '.join(data[:20])}'
+        visual_prompt = 'A surreal artistic beer cloud featuring: ' + ', '.join(bag.top_k(20))
 
     # Step 2: Generate Image
     # Try Google First, then DALL-E
     try:
         return generate_image_google(visual_prompt)
     except Exception as e:
-        print(f"DEBUG: Google Gen failed ({e}), trying DALL-E...")
+        log.info(f"Google Gen failed ({e}), trying DALL-E...")
         # If it was a quota error, user might want to know, but we have a fallback. 
         # But if specifically requested Google, maybe we should stop? 
         # The 'generate_image' function is the generic one. It falls back.
@@ -302,7 +519,7 @@ def generate_image(data: any, style: str = 'dali') -> str:
         try:
              return generate_image_dalle(visual_prompt)
         except Exception as e2:
-             print(f"ERROR: All image generation failed: {e2}")
+             log.error(f"All image generation failed: {e2}")
              # If both failed, raise the last error (likely quota) or a combined message
              raise ValueError(f"Image Generation Failed. Google: {e}. DALL-E: {e2}")
 
@@ -1,31 +1,57 @@
 import re
 import base64
-import os
-from openai import OpenAI
-from dotenv import load_dotenv
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from app.config import env_int
+from app.services.registry import get_openai_client
+from app.services.contact_sheet import contact_sheets
+from app.core.deadline import call_timeout
+from app.core.words import WordBag
+from app.core.logs import get_logger
 
-load_dotenv()
+log = get_logger(__name__)
 
 # No longer initializing EasyOCR to save memory/startup time
 # reader = easyocr.Reader(['en']) 
 
-def get_ocr_words(image_bytes: bytes) -> dict:
+def get_menu_words(images: list) -> WordBag:
+    """
+    Reads several photos of one menu (see app.services.contact_sheet) and
+    merges what each sheet yields into one categorized word set.
+    """
+    sheets, stats = contact_sheets(images)
+    log.info(f"OCR: {stats['images']} photo(s) -> {stats['sheets']} sheet(s), "
+             f"{stats['duplicates']} duplicate(s) skipped", extra={"event": "ocr.sheets", **stats})
+    if len(sheets) == 1:
+        return get_ocr_words(*sheets[0])
+    with ThreadPoolExecutor(max_workers=max(1, min(len(sheets), env_int("OCR_MAX_PARALLEL", 4)))) as pool:
+        # Each call carries the caller's context (deadline, log tags) into its thread.
+        futures = [pool.submit(contextvars.copy_context().run, get_ocr_words, sheet, photos)
+                   for sheet, photos in sheets]
+        results = [future.result() for future in futures]
+    bag = WordBag(categorized=True)
+    for words in results:
+        for term, category, count in words.items():
+            bag.add(term, category, count)
+    return bag.dedupe()
+
+
+def get_ocr_words(image_bytes: bytes, photos: int = 1) -> WordBag:
     """
     Extracts words from image bytes using GPT-4o Vision and categorizes them.
-    Returns structured dict.
+    `photos` > 1 tells the model the image is a contact sheet of that many photos.
+    Returns a categorized WordBag (empty if nothing could be read).
     """
     try:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            print("ERROR: No OpenAI Key found for Vision OCR.")
-            return {}
-
-        client = OpenAI(api_key=api_key)
+        client = get_openai_client()
+        if client is None:
+            log.error("No OpenAI Key found for Vision OCR.")
+            return WordBag(categorized=True)
         
         # Encode bytes to base64
         base64_image = base64.b64encode(image_bytes).decode('utf-8')
 
-        print("Calling GPT-4o Vision for text extraction and categorization...")
+        log.info("Calling GPT-4o Vision for text extraction and categorization...")
         
         response = client.chat.completions.create(
             model="gpt-4o",
@@ -48,7 +74,9 @@ def get_ocr_words(image_bytes: bytes) -> dict:
                 {
                     "role": "user",
                     "content": [
-                        {"type": "text", "text": "Extract and categorize the data from this image."},
+                        {"type": "text", "text": "Extract and categorize the data from this image." if photos == 1 else
+                                 f"This image is {photos} photos of the same menu placed side by side. "
+                                 "Extract and categorize the data from every photo."},
                         {
                             "type": "image_url",
                             "image_url": {
@@ -60,25 +88,21 @@ def get_ocr_words(image_bytes: bytes) -> dict:
                 }
             ],
             response_format={"type": "json_object"},
-            max_tokens=600
+            max_tokens=600 + 400 * (photos - 1),  # room for the extra text of a sheet
+            timeout=call_timeout(90),
         )
 
         content = response.choices[0].message.content
-        print(f"GPT Vision Raw Output: {content}")
+        log.debug("GPT Vision raw output", extra={"event": "llm.raw", "content": content})
         
         import json
         try:
             data = json.loads(content)
-            # Normalize keys
-            expected_keys = ["beer_styles", "breweries", "venues", "friends", "flavors", "miscellaneous"]
-            for k in expected_keys:
-                if k not in data:
-                    data[k] = []
-            return data
+            return WordBag.from_json(data)
         except json.JSONDecodeError:
-            print("GPT returned invalid JSON. Falling back to simple list in miscellaneous.")
-            return {"miscellaneous": [content], "beer_styles": [], "breweries": [], "venues": [], "friends": [], "flavors": []}
+            log.warning("GPT returned invalid JSON. Falling back to simple list in miscellaneous.")
+            return WordBag.from_json({"miscellaneous": [content]})
 
     except Exception as e:
-        print(f"GPT Vision OCR Failed: {e}")
-        return {}
+        log.error(f"GPT Vision OCR Failed: {e}")
+        return WordBag(categorized=True)
@@ -0,0 +1,257 @@
+"""
+Post-processing for generated images.
+
+Gemini and DALL-E return 1-3 MB PNGs, which we used to ship as-is (as data URIs)
+to phones on bar Wi-Fi. After generation, each image is now transcoded into
+WebP and AVIF at a few responsive sizes, and the original PNG is kept for
+download. The variants and a `manifest.json` are written to MEDIA_DIR/<image_id>/.
+
+The CPU-heavy encoding runs in a process pool, off the event loop and outside the
+GIL. `choose_variant()` picks the smallest file the client can use, based on its
+`Accept` header and the width it asked for.
+"""
+import asyncio
+import base64
+import io
+import json
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.config import get_env, env_int
+from app.core.logs import get_logger
+
+log = get_logger(__name__)
+
+# name -> max edge in pixels (None = keep the original size)
+SIZES = {
+    "thumb": 256,
+    "mobile": 768,
+    "full": None,
+}
+
+# Quality tuned for illustrations: WebP 80 / AVIF 50 are visually lossless at
+# these sizes while cutting the PNG by roughly 10x / 15x.
+FORMATS = {
+    "webp": {"mime": "image/webp", "save": {"format": "WEBP", "quality": 80, "method": 4}},
+    "avif": {"mime": "image/avif", "save": {"format": "AVIF", "quality": 50, "speed": 6}},
+}
+
+ORIGINAL_MIMES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+IMAGE_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,80}$")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def media_dir() -> str:
+    return get_env("MEDIA_DIR", os.path.join("static", "generated"))
+
+
+def decode_image_url(image_url: str) -> bytes:
+    """Returns the raw bytes of a `data:` URI as produced by the generators."""
+    if not image_url.startswith("data:"):
+        raise ValueError("Only data URIs can be post-processed")
+    _, b64 = image_url.split(",", 1)
+    return base64.b64decode(b64)
+
+
+def _supported_formats() -> list[str]:
+    from PIL import features
+    return [name for name in FORMATS if features.check(name)]
+
+
+def build_variants(image_bytes: bytes, image_id: str, out_dir: str) -> dict:
+    """
+    Writes the original plus every size/format variant to `out_dir/image_id/`
+    and returns the manifest. Runs inside a worker process.
+    """
+    from PIL import Image
+
+    target = os.path.join(out_dir, image_id)
+    os.makedirs(target, exist_ok=True)
+
+    img = Image.open(io.BytesIO(image_bytes))
+    original_format = img.format or "PNG"
+    ext = original_format.lower().replace("jpeg", "jpg")
+    original_name = f"original.{ext}"
+    with open(os.path.join(target, original_name), "wb") as f:
+        f.write(image_bytes)
+
+    manifest = {
+        "image_id": image_id,
+        "original": {
+            "file": original_name,
+            "mime": ORIGINAL_MIMES.get(original_format, "image/png"),
+            "width": img.width,
+            "height": img.height,
+            "bytes": len(image_bytes),
+        },
+        "variants": [],
+    }
+
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+
+    for size_name, max_edge in SIZES.items():
+        if max_edge and max(img.width, img.height) > max_edge:
+            resized = img.copy()
+            resized.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        else:
+            resized = img
+        for fmt in _supported_formats():
+            spec = FORMATS[fmt]
+            filename = f"{size_name}.{fmt}"
+            path = os.path.join(target, filename)
+            resized.save(path, **spec["save"])
+            manifest["variants"].append({
+                "size": size_name,
+                "format": fmt,
+                "mime": spec["mime"],
+                "file": filename,
+                "width": resized.width,
+                "height": resized.height,
+                "bytes": os.path.getsize(path),
+            })
+
+    with open(os.path.join(target, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=env_int("IMAGE_POSTPROCESS_WORKERS", 2))
+    return _pool
+
+
+def _discard_pool(pool):
+    """Drops a broken pool so the next `_get_pool()` starts fresh worker processes."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+async def postprocess_image(image_url: str, image_id: str) -> dict:
+    """Transcodes a generated data-URI image in the process pool and returns its manifest."""
+    image_bytes = decode_image_url(image_url)
+    loop = asyncio.get_running_loop()
+    try:
+        pool = _get_pool()
+        try:
+            return await loop.run_in_executor(pool, build_variants, image_bytes, image_id, media_dir())
+        except BrokenProcessPool as e:
+            # A worker process died (OOM killer, encoder crash) and took the whole pool with it.
+            log.warning(f"Post-processing pool broke ({e}), retrying in a new pool.")
+            _discard_pool(pool)
+            return await loop.run_in_executor(_get_pool(), build_variants, image_bytes, image_id, media_dir())
+    except (OSError, NotImplementedError) as e:
+        # Some sandboxes (serverless) can't fork worker processes; encode in a thread instead.
+        log.warning(f"Process pool unavailable ({e}), post-processing in a thread.")
+        return await asyncio.to_thread(build_variants, image_bytes, image_id, media_dir())
+
+
+def transcode_data_uri(image_url: str, accept: str = "") -> str:
+    """
+    The image re-encoded in the first of FORMATS the client accepts, as a data
+    URI, for responses that carry the image itself. Unchanged if none is accepted.
+    """
+    accepted = _accepted_mimes(accept)
+    formats = [name for name in _supported_formats() if FORMATS[name]["mime"] in accepted]
+    if not formats:
+        return image_url
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(decode_image_url(image_url)))
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    spec = FORMATS[formats[0]]
+    out = io.BytesIO()
+    img.save(out, **spec["save"])
+    return f"data:{spec['mime']};base64," + base64.b64encode(out.getvalue()).decode("ascii")
+
+
+def make_preview(image_bytes: bytes, edge: int = None) -> str:
+    """A small JPEG data URI of an in-progress image, for the progress screen (`IMAGE_PREVIEW_EDGE`)."""
+    from PIL import Image
+
+    edge = edge or env_int("IMAGE_PREVIEW_EDGE", 256)
+    img = Image.open(io.BytesIO(image_bytes))
+    img.draft("RGB", (edge, edge))
+    img = img.convert("RGB")
+    img.thumbnail((edge, edge))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=60)
+    return "data:image/jpeg;base64," + base64.b64encode(out.getvalue()).decode("ascii")
+
+
+def load_manifest(image_id: str):
+    if not IMAGE_ID_RE.match(image_id):
+        return None
+    path = os.path.join(media_dir(), image_id, "manifest.json")
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def file_path(image_id: str, filename: str) -> str:
+    return os.path.join(media_dir(), image_id, filename)
+
+
+def _accepted_mimes(accept: str) -> set:
+    # Media ranges with q > 0. Wildcards (`image/*`, `*/*`) don't opt into WebP/AVIF:
+    # browsers that decode them list them explicitly, older ones send wildcards too.
+    accepted = set()
+    for part in (accept or "").split(","):
+        mime, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    pass
+        if q > 0:
+            accepted.add(mime.lower())
+    return accepted
+
+
+def choose_variant(manifest: dict, accept: str = "", width: int = None) -> dict:
+    """
+    Picks the smallest file the client accepts that is at least `width` pixels
+    wide (or the widest one if none is). Falls back to the original.
+    """
+    accepted = _accepted_mimes(accept)
+    candidates = [v for v in manifest["variants"] if v["mime"] in accepted]
+    if not candidates:
+        return dict(manifest["original"])
+    if width:
+        wide_enough = [v for v in candidates if v["width"] >= width]
+        if wide_enough:
+            candidates = wide_enough
+        else:
+            widest = max(v["width"] for v in candidates)
+            candidates = [v for v in candidates if v["width"] == widest]
+    return min(candidates, key=lambda v: v["bytes"])
+
+
+def variant_urls(manifest: dict) -> dict:
+    """URLs the frontend uses: negotiated display image, srcset entries, thumbnail and download."""
+    image_id = manifest["image_id"]
+    widths = sorted({v["width"] for v in manifest["variants"]})
+    return {
+        "image_url": f"/media/{image_id}",
+        "download_url": f"/media/{image_id}/original",
+        "thumbnail_url": f"/media/{image_id}?w={SIZES['thumb']}",
+        "srcset": ", ".join(f"/media/{image_id}?w={w} {w}w" for w in widths),
+    }
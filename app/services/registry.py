@@ -0,0 +1,149 @@
+"""
+Lazy registry for the heavy third-party SDKs used by the services.
+
+Importing `openai`, `google.genai` or Playwright costs hundreds of milliseconds,
+which used to be paid on every serverless cold start even for requests that
+never touch them (login page, status polls, static files). The services now ask
+this registry for a module or client on first use instead.
+
+`prewarm()` can be run in a background thread after startup so the first real
+generation does not pay the import cost either.
+"""
+import threading
+import time
+
+from app.config import get_env
+from app.core.logs import get_logger
+
+log = get_logger(__name__)
+
+_lock = threading.RLock()
+_modules = {}
+_clients = {}
+
+# Names accepted by prewarm(); each maps to the loader that imports it.
+PREWARM_TARGETS = ("openai", "genai", "requests")
+
+
+def _load(name: str, loader):
+    module = _modules.get(name)
+    if module is None:
+        with _lock:
+            module = _modules.get(name)
+            if module is None:
+                module = loader()
+                _modules[name] = module
+    return module
+
+
+def _import_openai():
+    import openai
+    return openai
+
+
+def _import_genai():
+    from google import genai
+    from google.genai import types
+    return genai, types
+
+
+def _import_requests():
+    import requests
+    return requests
+
+
+def _import_playwright():
+    try:
+        from playwright.sync_api import sync_playwright
+    except ImportError:
+        return False  # cached "not installed" marker
+    return sync_playwright
+
+
+def get_openai_client(api_key: str = None):
+    """Returns a shared OpenAI client for `api_key` (defaults to OPENAI_API_KEY), or None without a key."""
+    api_key = api_key or get_env("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    key = ("openai", api_key)
+    client = _clients.get(key)
+    if client is None:
+        openai = _load("openai", _import_openai)
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = openai.OpenAI(api_key=api_key)
+                _clients[key] = client
+    return client
+
+
+def get_genai():
+    """Returns the `(genai, types)` modules of the google-genai SDK. Raises ImportError if missing."""
+    return _load("genai", _import_genai)
+
+
+def get_genai_client(api_key: str = None):
+    """Returns a shared Gemini client for `api_key` (defaults to GOOGLE_API_KEY), or None without a key."""
+    api_key = api_key or get_env("GOOGLE_API_KEY")
+    if not api_key:
+        return None
+    key = ("genai", api_key)
+    client = _clients.get(key)
+    if client is None:
+        genai, _ = get_genai()
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = genai.Client(api_key=api_key)
+                _clients[key] = client
+    return client
+
+
+def get_requests():
+    return _load("requests", _import_requests)
+
+
+def get_sync_playwright():
+    """Returns Playwright's `sync_playwright`, or None when Playwright is not installed."""
+    return _load("playwright", _import_playwright) or None
+
+
+def prewarm(targets=PREWARM_TARGETS) -> dict:
+    """
+    Imports the given SDKs so later requests find them loaded.
+    Returns a mapping of target -> seconds taken (or the error message).
+    """
+    loaders = {
+        "openai": lambda: _load("openai", _import_openai),
+        "genai": get_genai,
+        "requests": get_requests,
+        "playwright": get_sync_playwright,
+    }
+    timings = {}
+    for target in targets:
+        loader = loaders.get(target)
+        if loader is None:
+            continue
+        start = time.perf_counter()
+        try:
+            loader()
+            timings[target] = round(time.perf_counter() - start, 4)
+        except Exception as e:
+            timings[target] = f"{type(e).__name__}: {e}"
+    return timings
+
+
+def start_prewarm_thread(targets=PREWARM_TARGETS) -> threading.Thread:
+    """Runs prewarm() in a daemon thread so it never delays serving the first request."""
+    def _run():
+        timings = prewarm(targets)
+        log.info(f"Service prewarm finished: {timings}", extra={"timings": timings})
+
+    thread = threading.Thread(target=_run, name="service-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+def loaded() -> list[str]:
+    """Names of the SDKs imported so far (handy for the import-time report and debugging)."""
+    return sorted(name for name, module in _modules.items() if module)
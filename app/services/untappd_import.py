@@ -0,0 +1,163 @@
+"""
+Importer for Untappd data exports.
+
+Untappd supporters can download their whole history as CSV or JSON, with one
+row or object per check-in. That can be tens of thousands of check-ins, far
+more than the 50 recent ones the API feed gives us, and far too much to paste
+into `/generate_manual`. `import_export` reads such a file chunk by chunk and
+never holds more than one check-in. It counts terms as it goes:
+
+- beers (`beer_name`), styles (`beer_type`), breweries (`brewery_name`),
+  venues (`venue_name`) and cities (`venue_city`)
+- flavors, taken from the comma-separated `flavor_profiles`
+
+A power user can have thousands of distinct beers, so the counters are bounded
+as well. Each keeps at most twice IMPORT_TERMS_PER_FIELD terms. When it fills
+up, it drops the least frequent half. A term dropped early and seen again
+starts from zero, which only affects the long tail we discard anyway.
+
+The format is sniffed from the first character: `[` means JSON, anything else
+is read as CSV. `profile_words` turns the stored counts into a categorized word
+set for the generation pipeline.
+"""
+import codecs
+import csv
+
+from app.config import env_int
+from app.core.json_stream import JSONArrayItems
+from app.core.logs import get_logger
+
+log = get_logger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Profile field -> export column.
+FIELDS = {
+    "beers": "beer_name",
+    "styles": "beer_type",
+    "breweries": "brewery_name",
+    "venues": "venue_name",
+    "cities": "venue_city",
+    "flavors": "flavor_profiles",
+}
+LIST_FIELDS = {"flavors"}
+
+# Profile field -> WordBag category for the generation pipeline.
+CATEGORY_OF = {
+    "styles": "beer_styles",
+    "breweries": "breweries",
+    "venues": "venues",
+    "flavors": "flavors",
+    "beers": "miscellaneous",
+    "cities": "miscellaneous",
+}
+
+
+class ExportProfile:
+    """Incremental, bounded term counts over a stream of check-ins."""
+
+    def __init__(self, keep: int = 500):
+        self.keep = max(1, keep)
+        self.checkins = 0
+        self.counts = {field: {} for field in FIELDS}
+
+    def add(self, checkin: dict):
+        if not isinstance(checkin, dict):
+            return
+        self.checkins += 1
+        for field, column in FIELDS.items():
+            value = checkin.get(column)
+            if not value:
+                continue
+            terms = str(value).split(",") if field in LIST_FIELDS else (value,)
+            counts = self.counts[field]
+            for term in terms:
+                term = " ".join(str(term).split())
+                if term:
+                    counts[term] = counts.get(term, 0) + 1
+            if len(counts) > 2 * self.keep:
+                self.counts[field] = dict(self._top(counts, self.keep))
+
+    @staticmethod
+    def _top(counts: dict, k: int) -> list:
+        return sorted(counts.items(), key=lambda item: -item[1])[:k]
+
+    def result(self) -> dict:
+        """field -> [[term, count], ...], most frequent first."""
+        return {field: [list(item) for item in self._top(counts, self.keep)] for field, counts in self.counts.items()}
+
+
+def _chunks(fileobj):
+    """The upload decoded to text, one chunk at a time (a UTF-8 BOM is dropped)."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    while True:
+        data = fileobj.read(CHUNK_SIZE)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _lines(chunks):
+    """Lines for the csv module. Only "\n" ends a line; comments may contain other line breaks."""
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + chunk).split("\n")
+        # The last piece may continue in the next chunk.
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if pending:
+        yield pending
+
+
+def import_export(fileobj) -> tuple:
+    """
+    Reads an Untappd export from a binary file object.
+    Returns `(format, checkins, counts)`; raises ValueError if it can't be read.
+    """
+    profile = ExportProfile(keep=env_int("IMPORT_TERMS_PER_FIELD", 500))
+    chunks = _chunks(fileobj)
+    first = next(chunks, "")
+    stripped = first.lstrip()
+    while first and not stripped:
+        first = next(chunks, "")
+        stripped = first.lstrip()
+
+    def rest():
+        yield first
+        yield from chunks
+
+    if stripped.startswith("["):
+        source = "json"
+        items = JSONArrayItems()
+        for chunk in rest():
+            for checkin in items.feed(chunk):
+                profile.add(checkin)
+        items.close()
+    else:
+        source = "csv"
+        reader = csv.DictReader(_lines(rest()))
+        if not reader.fieldnames or not set(FIELDS.values()) & {name.strip() for name in reader.fieldnames}:
+            raise ValueError("This doesn't look like an Untappd export (no beer, brewery or venue columns)")
+        try:
+            for row in reader:
+                profile.add({key.strip(): value for key, value in row.items() if key})
+        except csv.Error as e:
+            raise ValueError(f"Malformed CSV at line {reader.line_num}: {e}")
+    log.info(f"Imported {profile.checkins} check-ins from a {source} export",
+             extra={"event": "import.untappd", "checkins": profile.checkins})
+    return source, profile.checkins, profile.result()
+
+
+def profile_words(counts: dict, per_field: int = None) -> dict:
+    """The most frequent terms of a stored profile as a categorized word set (see app.core.words)."""
+    per_field = per_field or env_int("PROFILE_WORDS_PER_FIELD", 12)
+    words = {}
+    for field, category in CATEGORY_OF.items():
+        words.setdefault(category, []).extend(term for term, _ in counts.get(field, [])[:per_field])
+    return words
@@ -0,0 +1,44 @@
+"""
+Builds the fingerprinted, precompressed static assets ahead of deploy.
+
+Run this in the deploy's build step and ship ASSET_DIR with the app (vercel.json
+does this with its buildCommand). Serverless deploys have a read-only
+filesystem, so the app can't build them itself there; elsewhere it can also
+build on startup with ASSET_BUILD_ON_STARTUP=true.
+
+    python -m app.tools.build_assets
+    python -m app.tools.build_assets --clean --json
+"""
+import argparse
+import json
+import sys
+
+from app.core import assets
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--out", default=None, help="Output directory (default: ASSET_DIR)")
+    parser.add_argument("--clean", action="store_true", help="Remove previous build output first")
+    parser.add_argument("--json", action="store_true", help="Print the manifest as JSON")
+    args = parser.parse_args(argv)
+
+    if args.clean:
+        assets.clean(args.out)
+    manifest = assets.build_assets(args.out)
+
+    if args.json:
+        print(json.dumps(manifest, indent=2, sort_keys=True))
+        return 0
+    source_total = sum(e["source_bytes"] for e in manifest.values())
+    built_total = sum(e["bytes"] for e in manifest.values())
+    for path, entry in sorted(manifest.items()):
+        encodings = ", ".join(entry["encodings"]) or "-"
+        print(f"{path:<32} {entry['source_bytes'] / 1024:>9.1f} KB -> {entry['url']:<44} "
+              f"{entry['bytes'] / 1024:>9.1f} KB  [{encodings}]")
+    print(f"Total: {source_total / 1024:.1f} KB -> {built_total / 1024:.1f} KB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,29 @@
+"""
+Adds images generated before the gallery index existed to it.
+
+Scans MEDIA_DIR for the legacy `gen_*`, `dalle_*` and `google_nano_*` files,
+builds their WebP/AVIF variants and records them (with the file's mtime as the
+creation time). Safe to re-run: already-indexed files are skipped.
+
+    python -m app.tools.gallery_backfill
+    python -m app.tools.gallery_backfill --dir static/generated
+"""
+import argparse
+import sys
+
+from app.core.gallery import get_gallery
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dir", default=None, help="Directory with legacy images (default: MEDIA_DIR)")
+    args = parser.parse_args(argv)
+
+    gallery = get_gallery()
+    added = gallery.backfill_legacy(args.dir)
+    print(f"Indexed {added} legacy image(s); gallery now holds {gallery.count()}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Cold-start import-time report.
+
+Imports the app in a fresh interpreter with `python -X importtime`, prints the
+slowest modules and fails (exit code 1) when the total exceeds a budget or
+when one of the heavy SDKs gets imported at startup again.
+
+    python -m app.tools.import_report
+    python -m app.tools.import_report --budget-ms 800 --top 20 --json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# SDKs that must only be imported lazily through app.services.registry.
+HEAVY_MODULES = ("openai", "google.genai", "playwright", "PIL", "redis")
+
+DEFAULT_BUDGET_MS = 1500
+
+
+def measure(module: str = "app.main", python: str = sys.executable) -> list[dict]:
+    """Runs `import <module>` with -X importtime and returns one entry per imported module."""
+    env = dict(os.environ)
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+        cwd=os.getcwd(),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+
+    entries = []
+    for line in proc.stderr.splitlines():
+        # Format: "import time:      self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        try:
+            _, rest = line.split(":", 1)
+            self_us, cumulative_us, name = rest.split("|", 2)
+            entries.append({
+                "module": name.strip(),
+                "depth": (len(name) - len(name.lstrip())) // 2,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            })
+        except ValueError:
+            continue
+    return entries
+
+
+def build_report(entries: list[dict], top: int = 15) -> dict:
+    # Top-level entries (depth 0) partition the whole import, so they sum to the total.
+    total_ms = sum(e["cumulative_ms"] for e in entries if e["depth"] == 0)
+    imported = {e["module"] for e in entries}
+    heavy = sorted(
+        name for name in imported
+        if any(name == h or name.startswith(h + ".") for h in HEAVY_MODULES)
+    )
+    slowest = sorted(entries, key=lambda e: e["cumulative_ms"], reverse=True)[:top]
+    return {
+        "total_ms": round(total_ms, 1),
+        "module_count": len(entries),
+        "heavy_modules": heavy,
+        "slowest": slowest,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", DEFAULT_BUDGET_MS)))
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = build_report(measure(args.module), top=args.top)
+    report["budget_ms"] = args.budget_ms
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Import of {args.module}: {report['total_ms']} ms across {report['module_count']} modules (budget {args.budget_ms} ms)")
+        print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for e in report["slowest"]:
+            print(f"{e['cumulative_ms']:>14.1f} {e['self_ms']:>9.1f}  {e['module']}")
+        if report["heavy_modules"]:
+            print(f"Heavy SDKs imported at startup: {', '.join(report['heavy_modules'])}")
+
+    failed = False
+    if report["total_ms"] > args.budget_ms:
+        print(f"FAIL: import time {report['total_ms']} ms exceeds budget {args.budget_ms} ms", file=sys.stderr)
+        failed = True
+    if report["heavy_modules"]:
+        print("FAIL: heavy SDKs must be loaded through app.services.registry", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
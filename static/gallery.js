@@ -0,0 +1,131 @@
+/* --- Gallery: cursor-paginated grid of past generations --- */
+const PAGE_SIZE = 24;
+
+let nextCursor = null;
+let currentStyle = '';
+let loading = false;
+let exhausted = false;
+
+document.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('#gallery-filter .xor-btn').forEach(btn => {
+        btn.addEventListener('click', () => {
+            document.querySelectorAll('#gallery-filter .xor-btn').forEach(b => b.classList.remove('selected'));
+            btn.classList.add('selected');
+            currentStyle = btn.dataset.style;
+            resetGallery();
+        });
+    });
+
+    document.getElementById('gallery-more').addEventListener('click', loadPage);
+    document.getElementById('gallery-close').addEventListener('click', closeDetail);
+    document.getElementById('gallery-modal').addEventListener('click', (e) => {
+        if (e.target.id === 'gallery-modal') closeDetail();
+    });
+
+    // Infinite scroll; the Load More button is the fallback for old browsers.
+    if ('IntersectionObserver' in window) {
+        const observer = new IntersectionObserver((entries) => {
+            if (entries.some(e => e.isIntersecting)) loadPage();
+        }, { rootMargin: '400px' });
+        observer.observe(document.getElementById('gallery-sentinel'));
+    } else {
+        document.getElementById('gallery-more').classList.remove('hidden');
+    }
+
+    loadPage();
+});
+
+function resetGallery() {
+    nextCursor = null;
+    exhausted = false;
+    document.getElementById('gallery-grid').innerHTML = '';
+    document.getElementById('gallery-empty').classList.add('hidden');
+    loadPage();
+}
+
+async function loadPage() {
+    if (loading || exhausted) return;
+    loading = true;
+
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    if (nextCursor) params.set('cursor', nextCursor);
+    if (currentStyle) params.set('style', currentStyle);
+    const requestedStyle = currentStyle;
+
+    try {
+        const res = await fetch(`/api/gallery?${params}`);
+        if (res.status === 401) {
+            window.location.href = '/login';
+            return;
+        }
+        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+        const page = await res.json();
+        if (requestedStyle !== currentStyle) return; // Filter changed mid-request
+
+        const grid = document.getElementById('gallery-grid');
+        page.items.forEach(item => grid.appendChild(renderTile(item)));
+
+        nextCursor = page.next_cursor;
+        exhausted = !nextCursor;
+        if (exhausted && grid.children.length === 0) {
+            document.getElementById('gallery-empty').classList.remove('hidden');
+        }
+        document.getElementById('gallery-more').classList.toggle('hidden', exhausted || 'IntersectionObserver' in window);
+    } catch (err) {
+        console.error('Gallery load failed:', err);
+    } finally {
+        loading = false;
+    }
+}
+
+function renderTile(item) {
+    const tile = document.createElement('button');
+    tile.type = 'button';
+    tile.className = 'gallery-tile';
+
+    const img = document.createElement('img');
+    img.src = item.thumbnail_url || item.image_url;
+    img.loading = 'lazy';
+    img.decoding = 'async';
+    img.width = 256;
+    img.height = 256;
+    img.alt = item.prompt ? item.prompt.slice(0, 120) : 'Generated artwork';
+    tile.appendChild(img);
+
+    const caption = document.createElement('span');
+    caption.className = 'gallery-caption';
+    caption.textContent = [item.style, new Date(item.created_at * 1000).toLocaleDateString()]
+        .filter(Boolean).join(' · ');
+    tile.appendChild(caption);
+
+    tile.addEventListener('click', () => openDetail(item.task_id));
+    return tile;
+}
+
+async function openDetail(taskId) {
+    const res = await fetch(`/api/gallery/${encodeURIComponent(taskId)}`);
+    if (!res.ok) return;
+    const item = await res.json();
+
+    const img = document.getElementById('gallery-detail-image');
+    if (item.srcset) {
+        img.srcset = item.srcset;
+        img.sizes = '(max-width: 800px) 90vw, 800px';
+    } else {
+        img.removeAttribute('srcset');
+    }
+    img.src = item.image_url;
+
+    const meta = [item.style, item.provider, item.theme].filter(Boolean);
+    if (item.timings && item.timings.total) meta.push(`${item.timings.total.toFixed(1)}s`);
+    document.getElementById('gallery-detail-meta').textContent = meta.join(' · ');
+    document.getElementById('gallery-detail-prompt').textContent = item.prompt || '';
+    document.getElementById('gallery-detail-reasoning').textContent = item.reasoning || '';
+    document.getElementById('gallery-detail-download').href = item.download_url || item.image_url;
+
+    document.getElementById('gallery-modal').classList.add('visible');
+}
+
+function closeDetail() {
+    document.getElementById('gallery-modal').classList.remove('visible');
+}
@@ -109,26 +109,32 @@ function setupModal() {
     }
 }
 
+// Fingerprinted asset URLs are injected by the page (window.ASSET_URLS);
+// fall back to the original path when the asset build hasn't run.
+function assetUrl(path) {
+    return (window.ASSET_URLS && window.ASSET_URLS[path]) || path;
+}
+
 // Style Preview Data
 const styleDetails = {
     'dali': {
-        img: '/images/dali.png',
+        img: assetUrl('/images/dali.png'),
         desc: '"Dreamlike visuals with melting forms and bizarre landscapes."'
     },
     'scarry': {
-        img: '/images/richard_scarry.png',
+        img: assetUrl('/images/richard_scarry.png'),
         desc: '"Busy, colorful, detailed 1970s illustration style."'
     },
     'picasso': {
-        img: '/images/picasso.png',
+        img: assetUrl('/images/picasso.png'),
         desc: '"Geometric shapes, fragmented perspectives, and abstract forms."'
     },
     'cyberpunk': {
-        img: '/images/steampunk.png',
+        img: assetUrl('/images/steampunk.png'),
         desc: '"Neon lights, high-tech low-life, futuristic cityscapes."'
     },
     'technology': {
-        img: '/images/abstracttech.png',
+        img: assetUrl('/images/abstracttech.png'),
         desc: '"Clean lines, circuit board patterns, and modern digital aesthetics."'
     }
 };
@@ -218,17 +224,19 @@ document.getElementById('generate-btn').addEventListener('click', async () => {
     formData.append('style', style);
     formData.append('model_provider', modelProvider);
     formData.append('theme', theme);
+    formData.append('draft', document.getElementById('draft-first').checked ? 'true' : 'false');
 
     if (inputMode === 'upload') {
         endpoint = '/upload';
         const fileInput = document.getElementById('image-upload');
-        const file = fileInput.files[0];
-        if (!file) {
+        if (fileInput.files.length === 0) {
             alert("No file found. Please go back to Step 1.");
             goToStep(1);
             return;
         }
-        formData.append('file', file);
+        for (const file of fileInput.files) {
+            formData.append('file', file);
+        }
     } else if (inputMode === 'manual') {
         endpoint = '/generate_manual';
         const manualText = document.getElementById('manual-text-input').value.trim();
@@ -264,6 +272,13 @@ document.getElementById('generate-btn').addEventListener('click', async () => {
             body: formData
         });
 
+        if (response.status === 429) {
+            // Admission control: too many creations in flight, come back later.
+            const retryAfter = response.headers.get('Retry-After');
+            let detail = "The easel is busy.";
+            try { detail = (await response.json()).detail || detail; } catch (e) {}
+            throw new Error(retryAfter ? `${detail} (try again in ${retryAfter}s)` : detail);
+        }
         if (!response.ok) {
             const errText = await response.text();
             throw new Error(`Request Failed: ${response.statusText} \n ${errText}`);
@@ -280,9 +295,50 @@ document.getElementById('generate-btn').addEventListener('click', async () => {
     }
 });
 
+// The task being generated; cancelled if the page is closed before it finishes.
+let activeTaskId = null;
+
+window.addEventListener('pagehide', () => {
+    if (activeTaskId) navigator.sendBeacon(`/cancel/${activeTaskId}`);
+});
+
 function pollTask(taskId) {
     const statusText = document.getElementById('status-text');
     const progressBar = document.getElementById('progress-bar');
+    activeTaskId = taskId;
+    const livePreview = document.getElementById('live-preview');
+    livePreview.classList.add('hidden');
+    delete livePreview.dataset.count;
+
+    // Draft mode: the full-quality render waits for this button.
+    const acceptBtn = document.getElementById('accept-draft-btn');
+    const newAcceptBtn = acceptBtn.cloneNode(true);
+    acceptBtn.parentNode.replaceChild(newAcceptBtn, acceptBtn);
+    newAcceptBtn.classList.add('hidden');
+    newAcceptBtn.addEventListener('click', async () => {
+        newAcceptBtn.classList.add('hidden');
+        statusText.innerText = "Rendering full quality...";
+        try {
+            await fetch(`/accept_draft/${taskId}`, { method: 'POST' });
+        } catch (e) {
+            console.error(e);
+        }
+    });
+
+    // One-time listener for the cancel button
+    const cancelBtn = document.getElementById('cancel-btn');
+    const newCancelBtn = cancelBtn.cloneNode(true);
+    cancelBtn.parentNode.replaceChild(newCancelBtn, cancelBtn);
+    newCancelBtn.classList.remove('hidden');
+    newCancelBtn.addEventListener('click', async () => {
+        newCancelBtn.disabled = true;
+        statusText.innerText = "Cancelling...";
+        try {
+            await fetch(`/cancel/${taskId}`, { method: 'POST' });
+        } catch (e) {
+            console.error(e);
+        }
+    });
 
     const pollInterval = setInterval(async () => {
         try {
@@ -292,8 +348,34 @@ function pollTask(taskId) {
             const statusData = await statusRes.json();
             progressBar.style.width = statusData.progress + "%";
             
+            // The art direction streams in while the prompt is being written.
+            const livePrompt = document.getElementById('live-prompt');
+            if (statusData.generated_prompt && statusData.status !== 'completed') {
+                livePrompt.innerText = statusData.generated_prompt;
+                livePrompt.classList.remove('hidden');
+            }
+
+            // Low-res previews of the image while the model is still rendering it,
+            // or the draft until the final render has something to show.
+            const previewKey = statusData.preview_url ? String(statusData.preview_count) : 'draft';
+            const previewUrl = statusData.preview_url || statusData.draft_url;
+            if (previewUrl && statusData.status !== 'completed' && livePreview.dataset.count !== previewKey) {
+                livePreview.src = previewUrl;
+                livePreview.dataset.count = previewKey;
+                livePreview.classList.remove('hidden');
+            }
+
             if (statusData.status === 'analyzing_image') {
                 statusText.innerText = "Reading text from image...";
+            } else if (statusData.status === 'enriching_prompt') {
+                statusText.innerText = "Composing the scene...";
+            } else if (statusData.status === 'drafting') {
+                statusText.innerText = "Sketching a quick draft...";
+            } else if (statusData.status === 'draft_ready') {
+                statusText.innerText = "Here's the draft. Like it?";
+                newAcceptBtn.classList.remove('hidden');
+            } else if (statusData.status === 'optimizing_image') {
+                statusText.innerText = "Framing your masterpiece...";
             } else if (statusData.status === 'waiting_for_input') {
                 // Manual Disambiguation Needed
                 document.getElementById('progress-section').classList.add('hidden');
@@ -342,9 +424,23 @@ function pollTask(taskId) {
                 statusText.innerText = `Dreaming of ${wordExample}...`;
             } else if (statusData.status === 'completed') {
                 clearInterval(pollInterval);
+                activeTaskId = null;
+                livePrompt.classList.add('hidden');
+                livePreview.classList.add('hidden');
+                delete livePreview.dataset.count;
+                newAcceptBtn.classList.add('hidden');
+                newCancelBtn.classList.add('hidden');
                 showResult(statusData);
+            } else if (statusData.status === 'cancelled') {
+                clearInterval(pollInterval);
+                activeTaskId = null;
+                newCancelBtn.classList.add('hidden');
+                statusText.innerText = statusData.error || "Cancelled";
+                statusText.style.color = "#ccc";
             } else if (statusData.status === 'failed') {
                 clearInterval(pollInterval);
+                activeTaskId = null;
+                newCancelBtn.classList.add('hidden');
                 statusText.innerText = "Error: " + statusData.error;
                 statusText.style.color = "red";
                 progressBar.style.backgroundColor = "red";
@@ -360,10 +456,17 @@ function showResult(data) {
     document.getElementById('result-section').classList.remove('hidden');
     
     const img = document.getElementById('generated-image');
+    if (data.srcset) {
+        // Server-side variants: let the browser pick a width, the server picks WebP/AVIF.
+        img.srcset = data.srcset;
+        img.sizes = "(max-width: 800px) 100vw, 800px";
+    } else {
+        img.removeAttribute('srcset');
+    }
     img.src = data.image_url;
     
     const downloadBtn = document.getElementById('download-btn');
-    downloadBtn.href = data.image_url;
+    downloadBtn.href = data.download_url || data.image_url;
 
     // Populate details
     document.getElementById('art-reasoning').innerText = data.reasoning || "Reasoning unavailable.";
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.core import admission
+from app.core.admission import AdmissionController, Rejected
+from app.core.job_queue import JobQueue
+
+
+@pytest.fixture
+def controller(tmp_path, monkeypatch):
+    controller = AdmissionController(JobQueue(str(tmp_path / "jobs.db")), max_active=1, rate_per_minute=0)
+    monkeypatch.setattr(admission, "_controller", controller)
+    return controller
+
+
+def test_open_stream_counts_as_an_active_job(controller):
+    stream = controller.admit_stream("alice", 60)
+    with pytest.raises(Rejected) as rejected:
+        controller.admit_stream("alice", 60)
+    assert rejected.value.reason == "concurrency"
+    with pytest.raises(Rejected):
+        controller.admit("alice")
+    controller.admit("bob")
+
+    controller.release(stream)
+    controller.admit("alice")
+
+
+def test_stream_left_open_by_a_dead_process_lapses(controller):
+    controller.admit_stream("alice", 60)
+    controller.queue._conn().execute("UPDATE reservations SET expires_at = ?", (time.time() - 1,))
+    controller.admit_stream("alice", 60)
+    assert controller.stats()["streams"] == 1
+
+
+def test_submit_consumes_the_reservation(controller):
+    reservation = controller.admit("alice")
+    controller.queue.submit("job-1", "manual", {}, owner="alice", reservation=reservation)
+    assert controller.queue.load("alice")["owner_active"] == 1
+    with pytest.raises(Rejected):
+        controller.admit("alice")
+
+
+def test_concurrent_admits_respect_the_limit(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    controller = AdmissionController(queue, max_active=3, rate_per_minute=0, max_backlog=0)
+    start = threading.Barrier(12)
+    outcomes = []
+
+    def attempt():
+        start.wait()
+        try:
+            outcomes.append(controller.admit("alice"))
+        except Rejected as e:
+            outcomes.append(e.reason)
+
+    threads = [threading.Thread(target=attempt) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    admitted = [o for o in outcomes if o != "concurrency"]
+    assert len(outcomes) == 12
+    assert len(admitted) == 3
+    assert queue.load("alice")["owner_active"] == 3
+
+
+def test_second_concurrent_stream_gets_429(controller, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app import main
+
+    release = threading.Event()
+
+    async def fake_generation(stream, *args, **kwargs):
+        try:
+            await stream.send("started")
+            while not release.is_set():
+                await asyncio.sleep(0.01)
+        finally:
+            stream.close()
+
+    monkeypatch.setattr(main, "stream_generation", fake_generation)
+    client = TestClient(main.app)
+    client.post("/login", data={"password": "Wardy123"}, follow_redirects=False)
+    form = {"source": "manual", "words": "Stout, Porter"}
+
+    # Establishes the session id cookie, and checks a finished stream stops counting.
+    release.set()
+    assert client.post("/generate/stream", data=form).status_code == 200
+    assert controller.stats()["streams"] == 0
+
+    release.clear()
+    first = {}
+    thread = threading.Thread(target=lambda: first.update(response=client.post("/generate/stream", data=form)))
+    thread.start()
+    try:
+        for _ in range(500):
+            if controller.stats()["streams"]:
+                break
+            time.sleep(0.01)
+        assert controller.stats()["streams"] == 1
+
+        second = client.post("/generate/stream", data=form)
+        assert second.status_code == 429
+        assert "Retry-After" in second.headers
+    finally:
+        release.set()
+        thread.join(10)
+    assert first["response"].status_code == 200
+    assert controller.stats()["streams"] == 0
@@ -0,0 +1,38 @@
+import json
+import os
+
+import pytest
+
+from app.core import assets
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("ASSET_DIR", str(tmp_path / "dist"))
+    (tmp_path / "static").mkdir()
+    (tmp_path / "static" / "script.js").write_text("console.log('hi');")
+    yield tmp_path
+    assets.set_manifest({})
+
+
+def test_missing_manifest_serves_original_urls(site):
+    assert assets.load_manifest() == {}
+    assert assets.asset_url("/static/script.js") == "/static/script.js"
+
+
+def test_built_manifest_serves_hashed_urls(site):
+    assets.build_assets()
+    assets.set_manifest({})
+    assets.load_manifest()
+    url = assets.asset_url("/static/script.js")
+    assert url.startswith("/assets/script.") and url.endswith(".js")
+
+
+def test_manifest_entries_without_files_fall_back(site):
+    manifest = assets.build_assets()
+    os.remove(site / "dist" / manifest["/static/script.js"]["file"])
+    assert "/static/script.js" in json.loads((site / "dist" / assets.MANIFEST_NAME).read_text())
+
+    assert assets.load_manifest() == {}
+    assert assets.asset_url("/static/script.js") == "/static/script.js"
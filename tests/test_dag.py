@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.core.dag import GraphError, Stage, StageFailed, run_graph
+from app.core.deadline import TIMEOUT, Deadline, DeadlineExceeded, current_deadline
+
+
+class Context:
+    """The parts of a JobContext the graph uses."""
+
+    def __init__(self, seconds=None):
+        self.job_id = "job"
+        self.deadline = Deadline(seconds)
+        self.timings = {}
+        self.checkpoints = {}
+
+    def has_checkpoint(self, name):
+        return name in self.checkpoints
+
+    def get_checkpoint(self, name, default=None):
+        return self.checkpoints.get(name, default)
+
+    async def checkpoint(self, name, value):
+        self.checkpoints[name] = value
+
+
+def run(stages, initial=None, ctx=None):
+    return asyncio.run(run_graph(stages, initial or {}, ctx))
+
+
+def test_runs_stages_in_dependency_order():
+    order = []
+
+    def stage(name, result):
+        def fn(**kwargs):
+            order.append(name)
+            return result(**kwargs)
+        return fn
+
+    values = run([
+        Stage("prompt", stage("prompt", lambda words: f"A cloud of {', '.join(words)}"), inputs=("words",)),
+        Stage("image", stage("image", lambda prompt: f"<{prompt}>"), inputs=("prompt",)),
+        Stage("words", stage("words", lambda seed: [seed, "Stout"]), inputs=("seed",)),
+    ], {"seed": "IPA"})
+    assert order == ["words", "prompt", "image"]
+    assert values["image"] == "<A cloud of IPA, Stout>"
+
+
+def test_independent_stages_run_concurrently():
+    both_started = threading.Barrier(2, timeout=2)
+
+    def branch(words):
+        both_started.wait()  # deadlocks (and times out) unless the two branches overlap
+        return len(words)
+
+    async def join(left, right):
+        return left + right
+
+    values = run([
+        Stage("left", branch, inputs=("words",)),
+        Stage("right", branch, inputs=("words",)),
+        Stage("total", join, inputs=("left", "right")),
+    ], {"words": ["IPA", "Stout"]})
+    assert values["total"] == 4
+
+
+def test_failing_stage_cancels_its_dependents_and_siblings():
+    ran, sibling_cancelled = [], []
+
+    def fail(words):
+        raise StageFailed("No words")
+
+    async def slow_sibling(words):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            sibling_cancelled.append(True)
+            raise
+
+    def dependent(cleaned):
+        ran.append("dependent")
+
+    started = time.monotonic()
+    with pytest.raises(StageFailed, match="No words"):
+        run([
+            Stage("cleaned", fail, inputs=("words",)),
+            Stage("sibling", slow_sibling, inputs=("words",)),
+            Stage("dependent", dependent, inputs=("cleaned",)),
+        ], {"words": []})
+    assert ran == []
+    assert sibling_cancelled == [True]
+    assert time.monotonic() - started < 2
+
+
+def test_failing_optional_stage_yields_none():
+    def fail(words):
+        raise RuntimeError("venue lookup failed")
+
+    values = run([
+        Stage("venue", fail, inputs=("words",), optional=True),
+        Stage("prompt", lambda words, venue: f"{words[0]} at {venue}", inputs=("words", "venue")),
+    ], {"words": ["IPA"]})
+    assert values["venue"] is None
+    assert values["prompt"] == "IPA at None"
+
+
+def test_exhausted_budget_raises_timeout():
+    ctx = Context(seconds=0.2)
+
+    async def hang(words):
+        await asyncio.sleep(5)
+
+    with pytest.raises(DeadlineExceeded) as excinfo:
+        run([Stage("image", hang, inputs=("words",))], {"words": ["IPA"]}, ctx)
+    assert excinfo.value.reason == TIMEOUT
+    assert "Stage 'image'" in str(excinfo.value)
+
+
+def test_stage_budget_is_its_share_of_the_remaining_time():
+    ctx = Context(seconds=10)
+    budgets = {}
+
+    def measure(name):
+        def fn(**kwargs):
+            budgets[name] = current_deadline().remaining()
+            return name
+        return fn
+
+    run([
+        Stage("words", measure("words"), inputs=("seed",), weight=1),
+        Stage("image", measure("image"), inputs=("words",), weight=3),
+    ], {"seed": "IPA"}, ctx)
+    assert 2 < budgets["words"] <= 2.5
+    assert 9 < budgets["image"] <= 10
+
+
+def test_checkpointed_stage_is_not_run_again():
+    ctx = Context()
+    ctx.checkpoints["words"] = ["IPA"]
+
+    def never(seed):
+        raise AssertionError("the checkpoint should have been used")
+
+    assert run([Stage("words", never, inputs=("seed",))], {"seed": "x"}, ctx)["words"] == ["IPA"]
+
+
+@pytest.mark.parametrize("stages", [
+    [Stage("a", lambda b: b, inputs=("b",)), Stage("b", lambda a: a, inputs=("a",))],
+    [Stage("a", lambda missing: missing, inputs=("missing",))],
+    [Stage("a", lambda: 1), Stage("b", lambda: 2, outputs=("a",))],
+])
+def test_invalid_graphs(stages):
+    with pytest.raises(GraphError):
+        run(stages)
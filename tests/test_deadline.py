@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import pytest
+
+from app.core.deadline import (
+    CANCELLED, MIN_CALL_TIMEOUT, TIMEOUT, Deadline, DeadlineExceeded, TaskCancelled,
+    call_timeout, current_deadline, deadline_reached, guard, use_deadline,
+)
+
+
+def test_call_timeout_without_deadline_is_the_default():
+    assert current_deadline() is None
+    assert call_timeout(20) == 20
+    assert not deadline_reached()
+
+
+def test_deadline_follows_nested_calls_into_threads():
+    def provider_call():
+        return call_timeout(60)
+
+    def stage():
+        # A helper two levels down, in an executor thread, sees the stage's deadline.
+        return provider_call()
+
+    async def main():
+        with use_deadline(Deadline(5)):
+            return await asyncio.to_thread(stage)
+
+    assert 4 < asyncio.run(main()) <= 5
+    assert current_deadline() is None
+
+
+def test_nested_use_deadline_restores_the_outer_one():
+    outer = Deadline(30)
+    with use_deadline(outer):
+        with use_deadline(Deadline(2, parent=outer)):
+            assert call_timeout(60) <= 2
+        assert current_deadline() is outer
+        assert 29 < call_timeout(60) <= 30
+
+
+def test_child_never_outlives_its_parent():
+    parent = Deadline(1)
+    assert Deadline(60, parent=parent).remaining() <= 1
+
+
+def test_cancelling_the_parent_cancels_the_child():
+    parent = Deadline()
+    child = Deadline(parent=parent)
+    parent.cancel(CANCELLED)
+    assert child.reason == CANCELLED
+    with pytest.raises(TaskCancelled) as excinfo:
+        child.check()
+    assert excinfo.value.reason == CANCELLED
+
+
+def test_closed_child_is_detached():
+    parent = Deadline()
+    child = Deadline(parent=parent)
+    child.close()
+    parent.cancel()
+    assert not child.cancelled
+
+
+def test_spent_budget_raises_timeout():
+    deadline = Deadline(0)
+    assert deadline.reached()
+    with pytest.raises(DeadlineExceeded) as excinfo:
+        deadline.check()
+    assert excinfo.value.reason == TIMEOUT
+
+
+def test_call_timeout_has_a_floor():
+    with use_deadline(Deadline(0.01)):
+        assert call_timeout(60) == MIN_CALL_TIMEOUT
+
+
+def test_guard_times_out_and_runs_the_abort_callbacks():
+    aborted = []
+
+    async def main():
+        deadline = Deadline(0.1)
+        deadline.on_cancel(lambda: aborted.append(True))
+        await guard(asyncio.sleep(5), deadline, "Image")
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded, match="Image ran out of time") as excinfo:
+        asyncio.run(main())
+    assert excinfo.value.reason == TIMEOUT
+    assert aborted == [True]
+    assert time.monotonic() - started < 2
+
+
+def test_guard_raises_the_cancel_reason():
+    async def main():
+        deadline = Deadline(30)
+        asyncio.get_running_loop().call_later(0.05, deadline.cancel, "abandoned")
+        await guard(asyncio.sleep(5), deadline)
+
+    with pytest.raises(TaskCancelled) as excinfo:
+        asyncio.run(main())
+    assert excinfo.value.reason == "abandoned"
+    assert not isinstance(excinfo.value, DeadlineExceeded)
@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+from app.core.event_stream import HEARTBEAT, EventStream
+
+
+def decode(line: bytes) -> dict:
+    return json.loads(line)
+
+
+def test_slow_consumer_bounds_the_queue():
+    async def main():
+        stream = EventStream(max_pending=4, heartbeat=5)
+        sent, received, high_water = [], [], []
+
+        async def produce():
+            for i in range(30):
+                await stream.send("stage", i=i)
+                sent.append(i)
+                high_water.append(stream._required)
+            stream.close()
+
+        producer = asyncio.ensure_future(produce())
+        async for line in stream:
+            received.append(decode(line)["i"])
+            # The producer is held back by the unread events, not buffered ahead.
+            assert len(sent) <= len(received) + stream.max_pending
+            await asyncio.sleep(0.001)
+        await producer
+        return received, max(high_water)
+
+    received, high_water = asyncio.run(main())
+    assert received == list(range(30))
+    assert high_water <= 4
+
+
+def test_updates_replace_undelivered_ones_and_never_wait():
+    async def main():
+        stream = EventStream(max_pending=1, heartbeat=5)
+        await stream.send("started")
+        for i in range(100):
+            stream.update("prompt", text="x" * i)
+        stream.close()
+        return stream, [decode(line) async for line in stream]
+
+    stream, events = asyncio.run(main())
+    assert [e["event"] for e in events] == ["started", "prompt"]
+    assert events[1]["text"] == "x" * 99
+    assert stream.superseded == 99
+
+
+def test_close_releases_a_waiting_sender():
+    async def main():
+        stream = EventStream(max_pending=1, heartbeat=5)
+        await stream.send("started")
+        blocked = asyncio.ensure_future(stream.send("words"))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        stream.close()
+        await asyncio.wait_for(blocked, 1)
+        await stream.send("ignored")
+        return [decode(line)["event"] async for line in stream]
+
+    assert asyncio.run(main()) == ["started"]
+
+
+def test_idle_stream_sends_heartbeats():
+    async def main():
+        stream = EventStream(heartbeat=0.01)
+        lines = stream.__aiter__()
+        first = decode(await lines.__anext__())
+        stream.close()
+        return first
+
+    assert asyncio.run(main())["event"] == HEARTBEAT
@@ -0,0 +1,39 @@
+import pytest
+
+from app.core.fuzzy import cluster, fold
+
+
+def canonicals(terms):
+    return sorted(canonical for canonical, _, _ in cluster(terms))
+
+
+def test_fold():
+    assert fold("Hazy I.P.A ") == fold("hazy ipa") == "hazy ipa"
+
+
+def test_merges_spelling_variants():
+    result = cluster(["Hazy IPA", "hazy ipa ", "Hazy I.P.A", "Other Half", "Other Half", "Other Hal"])
+    assert [(c, n) for c, n, _ in result] == [("Hazy IPA", 3), ("Other Half", 3)]
+
+
+def test_truncated_term_joins_its_cluster():
+    assert canonicals(["Stone Brewing Co", "Stone Brewing Co", "Stone Brew…"]) == ["Stone Brewing Co"]
+
+
+def test_truncated_term_joins_the_most_frequent_match():
+    terms = ["Stone Brewing Co"] * 3 + ["Stone Brewing Berlin"] * 2 + ["Other Half"] + ["Stone Brew…", "Zymurg…"]
+    result = {canonical: (count, spellings) for canonical, count, spellings in cluster(terms)}
+    assert result["Stone Brewing Co"] == (4, ["Stone Brewing Co", "Stone Brew…"])
+    assert result["Stone Brewing Berlin"][0] == 2
+    assert result["Zymurg…"][0] == 1
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Stout", "Scout"),
+    ("Lager", "Later"),
+    ("Brewery 1", "Brewery 2"),
+    ("Batch 12 Stout", "Batch 13 Stout"),
+    ("Cantillon", "Kantillon"),
+])
+def test_keeps_distinct_terms_apart(a, b):
+    assert canonicals([a, a, b]) == sorted([a, b])
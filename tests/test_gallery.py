@@ -0,0 +1,73 @@
+import pytest
+
+from app.core import gallery
+from app.core.gallery import GalleryIndex, InvalidCursor, decode_cursor, encode_cursor
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = GalleryIndex(str(tmp_path / "gallery.db"))
+    monkeypatch.setattr(gallery, "_index", index)
+    return index
+
+
+def pages(index, limit, **filters):
+    cursor, seen = None, []
+    while True:
+        page = index.list(cursor, limit, **filters)
+        seen.append([item["task_id"] for item in page["items"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return seen
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(1700000000.123456, "task-1")) == (1700000000.123456, "task-1")
+
+
+def test_pages_do_not_overlap_when_created_at_ties(index):
+    # Eleven generations in the same second, plus a few before and after it.
+    for i in range(11):
+        index.record(f"tied-{i:02d}", created_at=1000.0, style="dali")
+    for i in range(3):
+        index.record(f"early-{i}", created_at=900.0 + i, style="monet")
+    index.record("late", created_at=2000.0, style="dali")
+
+    seen = pages(index, 4)
+    flat = [task_id for page in seen for task_id in page]
+    assert [len(page) for page in seen] == [4, 4, 4, 3]
+    assert len(flat) == len(set(flat)) == index.count()
+    assert flat[0] == "late"
+    assert flat[1:12] == [f"tied-{i:02d}" for i in reversed(range(11))]
+    assert flat[12:] == ["early-2", "early-1", "early-0"]
+
+
+def test_filtered_pages(index):
+    for i in range(5):
+        index.record(f"t{i}", created_at=1000.0, style="dali" if i % 2 else "monet")
+    assert pages(index, 1, style="dali") == [["t3"], ["t1"]]
+
+
+def test_last_full_page_has_no_cursor(index):
+    for i in range(4):
+        index.record(f"t{i}", created_at=1000.0 + i)
+    assert index.list(limit=4)["next_cursor"] is None
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", encode_cursor(1.0, "x")[:-3], "WyJhIl0"])
+def test_malformed_cursor(index, cursor):
+    with pytest.raises(InvalidCursor):
+        index.list(cursor)
+
+
+def test_malformed_cursor_is_a_400(index):
+    from fastapi.testclient import TestClient
+    from app import main
+
+    client = TestClient(main.app)
+    client.post("/login", data={"password": "Wardy123"}, follow_redirects=False)
+    index.record("t1", created_at=1000.0)
+    assert client.get("/api/gallery").json()["items"][0]["task_id"] == "t1"
+    response = client.get("/api/gallery", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
@@ -0,0 +1,59 @@
+import time
+
+from app.core.job_queue import JobQueue, CANCELLED, DONE, FAILED, WAITING
+
+
+def make_queue(tmp_path) -> JobQueue:
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+def run_to_checkpoint(queue: JobQueue, job_id: str) -> str:
+    queue.submit(job_id, "manual", {"words": ["Stout"]}, payload=b"image")
+    job = queue.claim("w1")
+    queue.checkpoint(job.job_id, "w1", "prompt", "a stout on a bar")
+    assert queue.get(job_id).checkpoints == {"prompt": "a stout on a bar"}
+    return "w1"
+
+
+def test_complete_drops_checkpoints_and_payload(tmp_path):
+    queue = make_queue(tmp_path)
+    worker_id = run_to_checkpoint(queue, "job-1")
+    queue.complete("job-1", worker_id)
+    job = queue.get("job-1")
+    assert job.status == DONE
+    assert job.checkpoints == {}
+    assert job.payload is None
+
+
+def test_fail_drops_checkpoints(tmp_path):
+    queue = make_queue(tmp_path)
+    worker_id = run_to_checkpoint(queue, "job-1")
+    queue.fail("job-1", worker_id, "boom")
+    job = queue.get("job-1")
+    assert job.status == FAILED
+    assert job.checkpoints == {}
+
+
+def test_expire_waiting_cancels_only_stale_parked_jobs(tmp_path):
+    queue = make_queue(tmp_path)
+    for job_id in ("old", "new"):
+        queue.submit(job_id, "manual", {})
+        queue.claim("w1")
+        queue.park(job_id, "w1")
+    queue._conn().execute("UPDATE jobs SET updated_at = ? WHERE job_id = 'old'", (time.time() - 3600,))
+
+    assert queue.expire_waiting(time.time() - 60) == ["old"]
+    assert queue.get("old").status == CANCELLED
+    assert queue.get("new").status == WAITING
+    assert not queue.resume("old", "draft_accepted", True)
+
+
+def test_prune_deletes_old_finished_jobs(tmp_path):
+    queue = make_queue(tmp_path)
+    worker_id = run_to_checkpoint(queue, "job-1")
+    queue.complete("job-1", worker_id)
+    queue.submit("job-2", "manual", {})
+
+    assert queue.prune(time.time() + 1) == 1
+    assert queue.get("job-1") is None
+    assert queue.get("job-2") is not None
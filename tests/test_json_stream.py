@@ -0,0 +1,35 @@
+import pytest
+
+from app.core.json_stream import JSONArrayItems
+
+
+def feed_all(chunks) -> list:
+    items = JSONArrayItems()
+    out = []
+    for chunk in chunks:
+        out.extend(items.feed(chunk))
+    items.close()
+    return out
+
+
+def test_scalar_split_across_chunks():
+    assert feed_all(["[12", "34, tr", "ue, 1.", "5e", "2]"]) == [1234, True, 150.0]
+
+
+def test_every_split_point_gives_the_same_items():
+    text = '[{"beer_name": "Stout", "rating": 4.25}, 1234, "Lager", null, [1, 2], -0.5e3]'
+    expected = feed_all([text])
+    for i in range(len(text) + 1):
+        assert feed_all([text[:i], text[i:]]) == expected
+
+
+def test_truncated_array_raises_on_close():
+    items = JSONArrayItems()
+    assert items.feed('[{"a": 1}, 12') == [{"a": 1}]
+    with pytest.raises(ValueError):
+        items.close()
+
+
+def test_not_an_array():
+    with pytest.raises(ValueError):
+        JSONArrayItems().feed('{"a": 1}')
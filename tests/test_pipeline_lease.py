@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+import pytest
+
+from app import pipeline
+from app.core import task_store
+from app.core.job_queue import JobQueue, LeaseLost
+from app.core.task_store import MemoryTaskStore
+from app.core.worker import JobContext
+
+
+def cancel_elsewhere(queue, store, task_id):
+    """What /cancel does from another process."""
+    queue.cancel(task_id)
+    store.update(task_id, status="cancelled", error="Cancelled")
+    return "cancelled"
+
+
+def steal_lease(queue, store, task_id):
+    """The lease expired and another worker recovered the job."""
+    queue._conn().execute("UPDATE jobs SET lease_expires = ? WHERE job_id = ?", (time.time() - 1, task_id))
+    assert queue.claim("w2").job_id == task_id
+    store.update(task_id, status="enriching_prompt", progress=41)
+    return "enriching_prompt"
+
+
+@pytest.mark.parametrize("fence", [cancel_elsewhere, steal_lease])
+def test_fenced_out_worker_leaves_the_task_record_alone(tmp_path, monkeypatch, fence):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    store = MemoryTaskStore()
+    monkeypatch.setattr(task_store, "_store", store)
+    queue.submit("t1", "manual", {})
+    ctx = JobContext(queue, queue.claim("w1"), "w1")
+    store.create("t1", {"status": "queued", "progress": 0})
+    expected = {}
+
+    async def fake_enrich(**kwargs):
+        expected["status"] = fence(queue, store, "t1")
+        return {pipeline.STAGE_ENRICHED_PROMPT: {"prompt": "a pub"}, pipeline.STAGE_PROMPT: "a pub"}
+
+    monkeypatch.setattr(pipeline, "enrich_words", fake_enrich)
+
+    with pytest.raises(LeaseLost):
+        asyncio.run(pipeline.continue_generation_task("t1", ["Stout"], "dali", "google", ctx=ctx))
+
+    assert ctx.lease_lost
+    assert store.get("t1")["status"] == expected["status"]
+    assert store.get("t1").get("error") != "LeaseLost"
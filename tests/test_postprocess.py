@@ -0,0 +1,90 @@
+import asyncio
+import base64
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.services import postprocess
+from app.services.postprocess import build_variants, choose_variant
+
+PIL = pytest.importorskip("PIL")
+
+
+def png(width=1024, height=768) -> bytes:
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 120, 40)).save(out, format="PNG")
+    return out.getvalue()
+
+
+def variant(size, fmt, width, size_bytes):
+    return {"size": size, "format": fmt, "mime": f"image/{fmt}", "file": f"{size}.{fmt}",
+            "width": width, "height": width, "bytes": size_bytes}
+
+
+MANIFEST = {
+    "image_id": "img",
+    "original": {"file": "original.png", "mime": "image/png", "width": 1024, "height": 1024, "bytes": 900_000},
+    "variants": [
+        variant("thumb", "webp", 256, 9_000), variant("thumb", "avif", 256, 6_000),
+        variant("mobile", "webp", 768, 60_000), variant("mobile", "avif", 768, 40_000),
+        variant("full", "webp", 1024, 90_000), variant("full", "avif", 1024, 70_000),
+    ],
+}
+
+
+def test_build_variants(tmp_path):
+    manifest = build_variants(png(), "img", str(tmp_path))
+    assert manifest["original"]["mime"] == "image/png"
+    assert {v["size"] for v in manifest["variants"]} == set(postprocess.SIZES)
+    thumbs = [v for v in manifest["variants"] if v["size"] == "thumb"]
+    assert thumbs and all(v["width"] == 256 for v in thumbs)
+    for v in manifest["variants"]:
+        assert os.path.getsize(tmp_path / "img" / v["file"]) == v["bytes"]
+    assert (tmp_path / "img" / "manifest.json").exists()
+
+
+@pytest.mark.parametrize("accept, expected", [
+    ("image/avif,image/webp,*/*", "image/avif"),
+    ("image/webp,*/*;q=0.8", "image/webp"),
+    ("image/avif;q=0, image/webp", "image/webp"),
+    ("IMAGE/WEBP ; q=0.5", "image/webp"),
+    # Wildcards alone don't opt into the modern formats.
+    ("*/*", "image/png"),
+    ("image/*", "image/png"),
+    ("image/avif;q=0,image/webp;q=0.0,image/*", "image/png"),
+    ("", "image/png"),
+])
+def test_choose_variant_negotiates_the_format(accept, expected):
+    assert choose_variant(MANIFEST, accept, 1024)["mime"] == expected
+
+
+@pytest.mark.parametrize("width, expected", [
+    (200, "thumb.avif"),
+    (500, "mobile.avif"),
+    (768, "mobile.avif"),
+    (4000, "full.avif"),
+])
+def test_choose_variant_picks_the_smallest_wide_enough(width, expected):
+    assert choose_variant(MANIFEST, "image/avif,image/webp", width)["file"] == expected
+
+
+def test_broken_pool_is_replaced_and_the_job_retried(tmp_path, monkeypatch):
+    class BrokenPool(ThreadPoolExecutor):
+        def submit(self, *args, **kwargs):
+            raise BrokenProcessPool("A child process terminated abruptly")
+
+    broken = BrokenPool()
+    monkeypatch.setattr(postprocess, "_pool", broken)
+    monkeypatch.setattr(postprocess, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setenv("MEDIA_DIR", str(tmp_path))
+    image_url = "data:image/png;base64," + base64.b64encode(png(64, 64)).decode()
+
+    manifest = asyncio.run(postprocess.postprocess_image(image_url, "img"))
+    assert manifest["image_id"] == "img"
+    assert postprocess._pool is not broken
+    postprocess._pool.shutdown()
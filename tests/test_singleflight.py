@@ -0,0 +1,104 @@
+import asyncio
+import threading
+
+import pytest
+
+from app import pipeline
+from app.core import job_queue, singleflight, task_store
+from app.core.job_queue import JobQueue
+from app.core.singleflight import FlightRegistry, canonical_key
+from app.core.task_store import MemoryTaskStore
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    registry = FlightRegistry(str(tmp_path / "singleflight.db"))
+    monkeypatch.setattr(singleflight, "_registry", registry)
+    return registry
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = MemoryTaskStore()
+    monkeypatch.setattr(task_store, "_store", store)
+    return store
+
+
+def test_canonical_key_ignores_case_spacing_and_order():
+    assert canonical_key("manual", "dali", "Beer", "google", words=["Hazy I.P.A", "Stout"]) == \
+        canonical_key("manual", "dali", " beer", "google", words=["stout", "hazy ipa "])
+    assert canonical_key("manual", "dali", "Beer", "google", words=["Stout"]) != \
+        canonical_key("manual", "monet", "Beer", "google", words=["Stout"])
+
+
+def test_concurrent_identical_keys_have_one_leader(registry):
+    start = threading.Barrier(10)
+    leaders = {}
+
+    def submit(task_id):
+        start.wait()
+        leaders[task_id] = registry.join_or_lead("key", task_id)
+
+    threads = [threading.Thread(target=submit, args=(f"task-{i}",)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    led = [task_id for task_id, leader in leaders.items() if leader is None]
+    assert len(led) == 1
+    assert {leader for leader in leaders.values() if leader is not None} == set(led)
+    assert registry.land(led[0]) == 9
+    # The flight is over: the next identical submission runs again.
+    assert registry.join_or_lead("key", "task-10") is None
+
+
+def test_concurrent_submissions_queue_one_job(tmp_path, monkeypatch, registry, store):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(job_queue, "_queue", queue)
+
+    class Worker:
+        def start(self):
+            pass
+
+        def notify(self):
+            pass
+
+    monkeypatch.setattr(pipeline, "get_worker", Worker)
+    key = canonical_key("manual", "dali", "Beer", "google", words=["Stout"])
+
+    async def main():
+        for i in range(8):
+            await store.aput(f"task-{i}", {"status": "queued"})
+        return await asyncio.gather(*(
+            pipeline.submit_job(f"task-{i}", pipeline.JOB_MANUAL, {"words": ["Stout"]}, flight_key=key)
+            for i in range(8)
+        ))
+
+    results = asyncio.run(main())
+    leader = next(f"task-{i}" for i, result in enumerate(results) if result is None)
+    assert results.count(None) == 1
+    assert queue.claim("w1").job_id == leader
+    assert queue.claim("w1") is None
+    for i in range(8):
+        if f"task-{i}" != leader:
+            assert store.get(f"task-{i}")["coalesced_with"] == leader
+
+
+def test_leader_failure_reaches_every_follower(registry, store):
+    from fastapi.testclient import TestClient
+    from app import main
+
+    registry.join_or_lead("key", "leader")
+    store.put("leader", {"status": "running"})
+    for follower in ("f1", "f2", "f3"):
+        assert registry.join_or_lead("key", follower) == "leader"
+        store.put(follower, {"status": "queued", "coalesced_with": "leader"})
+    store.update("leader", status="failed", error="No text detected.", progress=100)
+
+    client = TestClient(main.app)
+    for follower in ("f1", "f2", "f3"):
+        status = client.get(f"/status/{follower}").json()
+        assert status["task_id"] == follower
+        assert status["coalesced_with"] == "leader"
+        assert (status["status"], status["error"]) == ("failed", "No text detected.")
@@ -0,0 +1,50 @@
+import sqlite3
+import time
+
+from app.core.speculation import SpeculationStore
+
+DAY = 24 * 3600
+
+
+def make_store(tmp_path) -> SpeculationStore:
+    store = SpeculationStore(str(tmp_path / "speculation.db"))
+    for owner in ("active", "idle"):
+        store.subscribe(owner, f"token-{owner}", ["dali"], "google")
+        store.put_result(owner, "dali", "hash", "google", {"prompt": "a pub"})
+    store._conn().execute("UPDATE subscribers SET last_seen = ? WHERE owner = 'idle'", (time.time() - 30 * DAY,))
+    return store
+
+
+def test_claim_due_skips_idle_subscribers(tmp_path):
+    store = make_store(tmp_path)
+    assert store.claim_due(10, 900, idle_ttl=14 * DAY) == ["active"]
+
+
+def test_touch_keeps_a_subscriber_active(tmp_path):
+    store = make_store(tmp_path)
+    store.touch("idle")
+    assert sorted(store.claim_due(10, 900, idle_ttl=14 * DAY)) == ["active", "idle"]
+
+
+def test_prune_idle_deletes_subscriber_and_results(tmp_path):
+    store = make_store(tmp_path)
+    assert store.prune_idle(14 * DAY) == 1
+    assert store.subscriber("idle") is None
+    assert store.current_styles("idle", "hash") == set()
+    assert store.current_styles("active", "hash") == {"dali"}
+
+
+def test_store_from_before_last_seen_is_migrated(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE subscribers (owner TEXT PRIMARY KEY, token TEXT NOT NULL, styles TEXT NOT NULL, "
+                 "model_provider TEXT NOT NULL, drafts INTEGER NOT NULL DEFAULT 0, feed_hash TEXT, checked_at REAL, "
+                 "next_check REAL NOT NULL, created_at REAL NOT NULL)")
+    conn.execute("INSERT INTO subscribers VALUES ('old', 't', '[\"dali\"]', 'google', 0, NULL, NULL, 0, ?)",
+                 (time.time() - 30 * DAY,))
+    conn.commit()
+    conn.close()
+
+    store = SpeculationStore(path)
+    assert store.subscriber("old")["last_seen"] is not None
+    assert store.prune_idle(14 * DAY) == 1
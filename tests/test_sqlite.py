@@ -0,0 +1,31 @@
+import os
+import tempfile
+
+import pytest
+
+from app.core import sqlite
+
+
+@pytest.fixture(autouse=True)
+def fresh_data_dir(monkeypatch):
+    monkeypatch.setattr(sqlite, "_data_dir", None)
+    monkeypatch.delenv("DATA_DIR", raising=False)
+
+
+def test_data_dir_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATA_DIR", str(tmp_path / "db"))
+    assert sqlite.data_path("jobs.db") == os.path.join(str(tmp_path / "db"), "jobs.db")
+    assert (tmp_path / "db").is_dir()
+
+
+def test_data_dir_defaults_to_cwd(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert sqlite.data_path("jobs.db") == os.path.join("data", "jobs.db")
+    assert (tmp_path / "data").is_dir()
+
+
+def test_read_only_cwd_falls_back_to_tmp(tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlite, "_writable", lambda directory: False)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    assert sqlite.data_path("jobs.db") == os.path.join(str(tmp_path), "wordcloud", "jobs.db")
+    assert (tmp_path / "wordcloud").is_dir()
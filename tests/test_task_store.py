@@ -0,0 +1,107 @@
+import time
+
+from app.core.task_store import MemoryTaskStore, RedisTaskStore, SqliteTaskStore
+
+
+class WatchError(Exception):
+    """Named like redis.WatchError, which is all RedisTaskStore checks."""
+
+
+class FakeRedis:
+    """The slice of redis-py's API RedisTaskStore uses, with WATCH/MULTI semantics."""
+
+    def __init__(self):
+        self.data = {}
+        self.writes = {}         # key -> number of writes, to detect changes under WATCH
+        self.before_execute = None
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        self.writes[key] = self.writes.get(key, 0) + 1
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.watched = {}
+        self.queued = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def watch(self, key):
+        self.watched[key] = self.client.writes.get(key, 0)
+
+    def unwatch(self):
+        self.watched = {}
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def multi(self):
+        pass
+
+    def set(self, key, value, ex=None):
+        self.queued.append((key, value))
+
+    def execute(self):
+        if self.client.before_execute is not None:
+            hook, self.client.before_execute = self.client.before_execute, None
+            hook()
+        if any(self.client.writes.get(key, 0) != n for key, n in self.watched.items()):
+            raise WatchError("watched key changed")
+        for key, value in self.queued:
+            self.client.set(key, value)
+
+
+def test_redis_update_retries_after_a_concurrent_write():
+    client = FakeRedis()
+    store = RedisTaskStore(client=client)
+    store.create("t1", {"status": "queued", "progress": 0})
+    other = RedisTaskStore(client=client)
+    # Another worker writes between our WATCH and EXEC: the first attempt must not land.
+    client.before_execute = lambda: other.update("t1", progress=50)
+
+    record = store.update("t1", status="running")
+
+    assert record["status"] == "running"
+    assert record["progress"] == 50
+    assert record["version"] == 3
+    assert store.get("t1") == record
+
+
+def test_redis_transition_loses_to_a_concurrent_transition():
+    client = FakeRedis()
+    store = RedisTaskStore(client=client)
+    store.create("t1", {"status": "waiting_for_input"})
+    client.before_execute = lambda: RedisTaskStore(client=client).transition("t1", "waiting_for_input", "resuming")
+
+    assert store.transition("t1", "waiting_for_input", "resuming") is None
+    assert store.get("t1")["version"] == 2
+
+
+def test_create_prunes_expired_records(tmp_path):
+    for store in (MemoryTaskStore(ttl_seconds=60), SqliteTaskStore(str(tmp_path / "tasks.db"), ttl_seconds=60)):
+        store.create("old", {"status": "completed"})
+        store._cas("old", 1, {**store.get("old"), "version": 2, "updated_at": time.time() - 3600})
+        store._next_prune = 0.0
+
+        store.create("new", {"status": "queued"})
+
+        assert store.get("old") is None
+        assert store.get("new") is not None
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from app.core import word_profiles
+from app.core.word_profiles import WordProfileStore
+
+COUNTS = {"styles": [["IPA", 3], ["Stout", 1]]}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = WordProfileStore(str(tmp_path / "profiles.db"), ttl_seconds=3600)
+    monkeypatch.setattr(word_profiles, "_store", store)
+    return store
+
+
+def owners(store):
+    return sorted(row["owner"] for row in store._conn().execute("SELECT owner FROM profiles"))
+
+
+def test_profiles_belong_to_their_session(store):
+    profile_id = store.put("alice", "export.csv", "csv", 4, COUNTS)
+    assert store.get(profile_id, "alice")["counts"] == COUNTS
+    assert store.get(profile_id, "bob") is None
+    assert not store.delete(profile_id, "bob")
+    assert store.delete(profile_id, "alice")
+    assert store.list("alice") == []
+
+
+def test_put_prunes_expired_profiles(store):
+    old = store.put("alice", "old", "csv", 1, COUNTS)
+    store._conn().execute("UPDATE profiles SET created_at = ? WHERE profile_id = ?", (time.time() - 7200, old))
+    store._next_prune = 0.0
+    new = store.put("alice", "new", "csv", 1, COUNTS)
+    assert [p["profile_id"] for p in store.list("alice")] == [new]
+
+
+def test_pruning_is_rate_limited(store):
+    store.put("alice", "first", "csv", 1, COUNTS)
+    store._conn().execute("UPDATE profiles SET created_at = ?", (time.time() - 7200,))
+    store.put("alice", "second", "csv", 1, COUNTS)
+    assert len(store.list("alice")) == 2
+    assert store.prune() == 1
+
+
+def test_zero_ttl_keeps_profiles(tmp_path):
+    store = WordProfileStore(str(tmp_path / "profiles.db"), ttl_seconds=0)
+    store.put("alice", "old", "csv", 1, COUNTS)
+    store._conn().execute("UPDATE profiles SET created_at = 0")
+    assert store.prune() == 0
+    assert len(store.list("alice")) == 1
+
+
+def test_logout_deletes_the_session_profiles(store, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app import main
+
+    monkeypatch.setattr(main, "import_export", lambda file: ("csv", 4, COUNTS))
+    alice, bob = TestClient(main.app), TestClient(main.app)
+    for client in (alice, bob):
+        client.post("/login", data={"password": "Wardy123"}, follow_redirects=False)
+        response = client.post("/import/untappd", files={"file": ("export.csv", b"beer_name\nIPA\n")})
+        assert response.status_code == 200
+    assert len(owners(store)) == 2
+
+    alice.get("/logout", follow_redirects=False)
+    assert len(owners(store)) == 1
+    assert len(bob.get("/word_profiles").json()["profiles"]) == 1
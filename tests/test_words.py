@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from app.core.job_queue import JobQueue
+from app.core.words import CATEGORIES, WordBag, as_json
+
+
+@pytest.mark.parametrize("data", [
+    ["IPA", "Stout", "Other Half"],
+    {"beer_styles": ["IPA", "Stout"], "breweries": ["Other Half"], "venues": [], "friends": [],
+     "flavors": ["Citrus"], "miscellaneous": ["Brooklyn"]},
+])
+def test_round_trip(data):
+    assert WordBag.from_json(data).to_json() == data
+    assert WordBag.from_json(WordBag.from_json(data).to_json()).to_json() == data
+
+
+def test_categorized_json_has_all_six_categories():
+    assert WordBag.from_json({"flavors": ["Dank"], "bogus": ["Menu"]}).to_json() == {
+        **{name: [] for name in CATEGORIES}, "flavors": ["Dank"], "miscellaneous": ["Menu"],
+    }
+
+
+def test_from_json_returns_a_bag_as_is():
+    bag = WordBag.from_json(["IPA"])
+    assert WordBag.from_json(bag) is bag
+
+
+def test_merging_adds_counts():
+    bag = WordBag.from_json(["IPA", "Stout", "IPA"])
+    for term, category, count in WordBag.from_json(["IPA", "Gose"]).items():
+        bag.add(term, category, count)
+    assert bag.count("IPA") == 3
+    assert bag.count("Stout") == bag.count("Gose") == 1
+    assert bag.flatten() == ["IPA", "Stout", "Gose"]
+
+
+def test_dedupe_merges_case_and_spacing_variants():
+    bag = WordBag.from_json(["Hazy IPA", "hazy  ipa", "HAZY IPA", "Stout"]).dedupe()
+    assert bag.flatten() == ["Hazy IPA", "Stout"]
+    assert bag.count("Hazy IPA") == 3
+
+
+def test_top_k_orders_by_count_then_insertion():
+    bag = WordBag.from_json(["Gose", "IPA", "Stout", "IPA", "Stout", "IPA", "Lager"])
+    assert bag.top_k() == ["IPA", "Stout", "Gose", "Lager"]
+    assert bag.top_k(2) == ["IPA", "Stout"]
+
+
+def test_uncategorized_terms_are_miscellaneous():
+    bag = WordBag.from_json({"miscellaneous": ["Brooklyn"], "venues": ["The Pub"]})
+    bag.add("Growler")
+    assert bag.groups()["miscellaneous"] == ["Brooklyn", "Growler"]
+    assert bag.category("miscellaneous") == ["Brooklyn", "Growler"]
+    assert bag.category("venues") == ["The Pub"]
+    assert WordBag.from_json(["IPA"]).category("miscellaneous") == ["IPA"]
+
+
+def test_as_json():
+    assert as_json(WordBag.from_json({"flavors": ["Dank"]}))["flavors"] == ["Dank"]
+    assert as_json(["IPA"]) == ["IPA"]
+
+
+def test_checkpoint_serializes_a_bag(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    queue.submit("job-1", "manual", {})
+    job_id = queue.claim("worker").job_id
+    queue.checkpoint(job_id, "worker", "words", WordBag.from_json({"flavors": ["Dank"]}))
+    row = queue._conn().execute("SELECT checkpoints FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    assert json.loads(row["checkpoints"])["words"]["flavors"] == ["Dank"]